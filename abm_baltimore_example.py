@@ -3,8 +3,7 @@ from model_classes.simulator import ICOMSimulator
 from model_classes.institutional_categories import AllHHAgents
 from model_engines.agent_creation import NewAgentCreation
 from model_engines.existing_agent_relocation import ExistingAgentReloSampler
-from model_engines.new_agent_location import NewAgentLocation
-from model_engines.existing_agent_relocation import ExistingAgentLocation
+from model_engines.agent_location import AgentLocation
 from model_engines.housing_market import HousingMarket
 from model_engines.building_development import BuildingDevelopment
 from model_engines.housing_pricing import HousingPricing
@@ -32,10 +31,12 @@ intervention = 'Baseline'
 start_year = 2018
 no_years = 2  # no of years (model will run for n+1 years)
 agent_housing_aggregation = 10  # indicates the level of agent/building aggregation (e.g., 100 indicates that 1 representative agent = 100 households, 1 representative building = 100 residences)
+agent_mode = 'component'  # indicates the household agent representation ('component': pynsim HHAgent with per-agent history, 'compact': CompactHHAgent with __slots__ and no per-agent history)
 hh_size = 2.7  # define household size (currently assumes all households have the same size, using average from 1990 data)
 initial_vacancy = 0.20  # define initial vacancy for all block groups (currently assumes all block groups have same initial vacancy rate)
-pop_growth_mode = 'perc'  # indicates which mode of population growth is used for the model run (e.g., percent-based, exogenous time series, etc.) - currently assume constant percentage growth
+pop_growth_mode = 'perc'  # indicates which mode of population growth is used for the model run ('perc' constant percentage growth or 'exog' exogenous population targets)
 pop_growth_perc = .01  # annual population percentage growth rate (only used if pop_growth_mode = 'perc')
+exog_population = None  # csv file (or dataframe) of annual population targets with year and population columns (only used if pop_growth_mode = 'exog')
 inc_growth_mode = 'random_agent_replication' # defines the mode of income growth for incoming agents (e.g., 'normal_distribution', 'percentile_based', 'random_agent_replication', etc.)
 pop_growth_inc_perc = .90  # defines the income percentile for the in-migrating population (if inc_growth_mode is 'percentile_based')
 inc_growth_perc = .05  # defines the increase mean incomes of the in-migrating population (if inc_growth_mode is 'normal_distribution')
@@ -50,7 +51,7 @@ budget_reduction_perc = .90  # defines the percentage that a household reduces b
 print(simple_anova_coefficients)  # JY Temp
 stock_increase_mode = 'simple_perc'  # indicates the mode in which prices increase for homes that are in high demand (simple perc, etc.)
 stock_increase_perc = .05  # indicates the percentage increase in price
-housing_pricing_mode = 'simple_perc'
+housing_pricing_mode = 'simple_perc'  # 'simple_perc' (per block group) or 'simple_perc_array' (same price adjustment calculated as one array expression)
 price_increase_perc = .05
 
 # Define census geography files / data (all external files that define the domain/city should be defined here)
@@ -63,14 +64,20 @@ housing_filename = 'bg_housing_1993.csv'  # housing characteristic data and othe
 hedonic_filename = 'simple_anova_hedonic_without_flood_bg0418.csv'  # simple ANOVA hedonic regression conducted by Alfred
 
 # Create pynsim simulation object and set timesteps, landscape on simulation
+profile = True  # record per-engine wall/CPU time, peak memory and counters for every year (see ICOMSimulator.export_profile)
+seed = None  # random seed of the run (an integer makes the run reproducible; None seeds from OS entropy, logged by the simulator)
 s = ICOMSimulator(network=None, record_time=False, progress=False, max_iterations=1,
-                  name=simulation_name, scenario=scenario, intervention=intervention, start_year=start_year, no_of_years=no_years)
+                  name=simulation_name, scenario=scenario, intervention=intervention, start_year=start_year, no_of_years=no_years,
+                  profile=profile, seed=seed)
 s.set_timestep_information()  # sets up timestep information based on model options (start_year, no_years)
 
 # Load geography/landscape information to simulation object
+landscape_cache_dir = 'landscape_cache'  # compiled landscapes are stored here and reused by runs with the same inputs (None to compile every run)
 s.set_landscape(landscape_name=landscape_name, geo_filename=geo_filename, pop_filename=pop_filename,
                 pop_fieldname=pop_fieldname, flood_filename=flood_filename,
-                housing_filename=housing_filename, hedonic_filename=hedonic_filename)
+                housing_filename=housing_filename, hedonic_filename=hedonic_filename,
+                house_choice_mode=house_choice_mode, simple_anova_coefficients=simple_anova_coefficients,
+                cache_dir=landscape_cache_dir)
 
 # # Create a county-level institution (agent) that will make zoning decisions (DEACTIVATE for sensitivity experiments)
 # s.network.add_institution(CountyZoningManager(name='zoning_manager_005'))
@@ -85,7 +92,7 @@ s.set_landscape(landscape_name=landscape_name, geo_filename=geo_filename, pop_fi
 s.network.add_institution(AllHHAgents(name='all_hh_agents'))
 
 # Create household agents based on initial population data
-s.convert_initial_population_to_agents(no_hhs_per_agent=agent_housing_aggregation, simple_avoidance_perc=simple_avoidance_perc)
+s.convert_initial_population_to_agents(no_hhs_per_agent=agent_housing_aggregation, simple_avoidance_perc=simple_avoidance_perc, agent_mode=agent_mode)
 
 # Initialize available units on block groups based on initial population data
 s.initialize_available_building_units(initial_vacancy=initial_vacancy)
@@ -99,7 +106,7 @@ s.initialize_available_building_units(initial_vacancy=initial_vacancy)
 target = s.network
 s.add_engine(NewAgentCreation(target, growth_mode=pop_growth_mode, growth_rate=pop_growth_perc, inc_growth_mode=inc_growth_mode,
                               pop_growth_inc_perc=pop_growth_inc_perc, inc_growth_perc=inc_growth_perc, no_hhs_per_agent=agent_housing_aggregation, hh_size=hh_size,
-                              simple_avoidance_perc=simple_avoidance_perc))
+                              simple_avoidance_perc=simple_avoidance_perc, agent_mode=agent_mode, exog_population=exog_population))
 
 # Load existing agent sampler (for re-location) to simulation object
 target = s.network
@@ -109,18 +116,16 @@ s.add_engine(ExistingAgentReloSampler(target, perc_move=perc_move))
 # target = s.network
 # s.add_engine(HousingInventory(target, residences_per_unit=agent_housing_aggregation))
 
-# Load new agent location engine to simulation object
-bg_sample_size = 10  # the number of homes that a new agent samples for residential choice
-s.add_engine(NewAgentLocation(target, bg_sample_size, house_choice_mode=house_choice_mode, simple_anova_coefficients=simple_anova_coefficients, budget_reduction_perc=budget_reduction_perc))
-
-# Load existing agent re-location engine to simulation object
+# Load agent location engine (new and re-locating agents in a single queue) to simulation object
+# (replaces the NewAgentLocation and ExistingAgentLocation engines, which search each queue separately)
 target = s.network
-bg_sample_size = 10  # the number of homes that a re-locating agent samples for residential choice
-s.add_engine(ExistingAgentLocation(target, bg_sample_size=bg_sample_size, house_choice_mode=house_choice_mode, simple_anova_coefficients=simple_anova_coefficients))
+bg_sample_size = 10  # the number of homes that a new or re-locating agent samples for residential choice
+s.add_engine(AgentLocation(target, bg_sample_size=bg_sample_size, house_choice_mode=house_choice_mode, simple_anova_coefficients=simple_anova_coefficients,
+                           budget_reduction_perc=budget_reduction_perc))
 
 # Load housing market engine to simulation object
 target = s.network
-market_mode = 'top_candidate'
+market_mode = 'top_candidate'  # 'top_candidate' or 'deferred_acceptance' (stops once no proposals remain)
 s.add_engine(HousingMarket(target, market_mode=market_mode, bg_sample_size=bg_sample_size))
 
 # Load housing market engine to simulation object  # JY to complete
@@ -150,4 +155,5 @@ s.start()
 end_time = time.time()
 sim_time = end_time-start_time
 print("Simulation took (seconds):  %s" % sim_time)
+print(s.get_profile().groupby('engine', sort=False)[['wall_time', 'cpu_time', 'peak_rss_delta_kb']].sum())  # time and memory by engine
 
@@ -3,12 +3,12 @@ from model_classes.simulator import ICOMSimulator
 from model_classes.institutional_categories import AllHHAgents
 from model_engines.agent_creation import NewAgentCreation
 from model_engines.existing_agent_relocation import ExistingAgentReloSampler
-from model_engines.new_agent_location import NewAgentLocation
-from model_engines.existing_agent_relocation import ExistingAgentLocation
+from model_engines.agent_location import AgentLocation
 from model_engines.housing_market import HousingMarket
 from model_engines.building_development import BuildingDevelopment
 from model_engines.housing_pricing import HousingPricing
 from model_engines.landscape_statistics import LandscapeStatistics
+from model_engines.result_writer import ResultWriter, read_results
 import time
 import sys
 # from model_classes.institutional_agents import CountyZoningManager, RealEstate
@@ -42,6 +42,8 @@ intervention = 'Baseline'
 start_year = 2018
 no_years = 79  # no of years (model will run for n+1 years)
 agent_housing_aggregation = 10  # indicates the level of agent/building aggregation (e.g., 100 indicates that 1 representative agent = 100 households, 1 representative building = 100 residences)
+agent_mode = 'compact'  # indicates the household agent representation ('component': pynsim HHAgent with per-agent history, 'compact': CompactHHAgent with __slots__ and no per-agent history)
+agent_history = None  # agent properties recorded by compact agents (agent locations for the alluvial fan post-processing are reconstructed from the landscape move log)
 hh_size = 2.7  # define household size (currently assumes all households have the same size, using average from 1990 data)
 initial_vacancy = 0.20  # define initial vacancy for all block groups (currently assumes all block groups have same initial vacancy rate)
 pop_growth_mode = 'perc'  # indicates which mode of population growth is used for the model run (e.g., percent-based, exogenous time series, etc.) - currently assume constant percentage growth
@@ -60,7 +62,7 @@ budget_reduction_perc = model_run[1]  # defines the percentage that a household
 print(simple_anova_coefficients)  # JY Temp
 stock_increase_mode = 'simple_perc'  # indicates the mode in which prices increase for homes that are in high demand (simple perc, etc.)
 stock_increase_perc = .05  # indicates the percentage increase in price
-housing_pricing_mode = 'simple_perc'
+housing_pricing_mode = 'simple_perc_array'  # 'simple_perc' (per block group) or 'simple_perc_array' (same price adjustment calculated as one array expression)
 price_increase_perc = .05
 
 # Define census geography files / data (all external files that define the domain/city should be defined here)
@@ -73,14 +75,21 @@ housing_filename = 'bg_housing_1993.csv'  # housing characteristic data and othe
 hedonic_filename = 'simple_anova_hedonic_without_flood_bg0418.csv'  # simple ANOVA hedonic regression conducted by Alfred
 
 # Create pynsim simulation object and set timesteps, landscape on simulation
+profile = True  # record per-engine wall/CPU time, peak memory and counters for every year (see ICOMSimulator.export_profile)
+seed = None  # random seed of the run (an integer makes the run reproducible; None seeds from OS entropy, logged by the simulator)
 s = ICOMSimulator(network=None, record_time=False, progress=False, max_iterations=1,
-                  name=simulation_name, scenario=scenario, intervention=intervention, start_year=start_year, no_of_years=no_years)
+                  name=simulation_name, scenario=scenario, intervention=intervention, start_year=start_year, no_of_years=no_years,
+                  profile=profile, seed=seed)
 s.set_timestep_information()  # sets up timestep information based on model options (start_year, no_years)
 
 # Load geography/landscape information to simulation object
+landscape_cache_dir = 'landscape_cache'  # compiled landscapes are stored here and reused by runs with the same inputs (None to compile every run)
+headless = True  # block groups without geometry (not used by this script; geopandas/shapely are not imported once the landscape is compiled)
 s.set_landscape(landscape_name=landscape_name, geo_filename=geo_filename, pop_filename=pop_filename,
                 pop_fieldname=pop_fieldname, flood_filename=flood_filename,
-                housing_filename=housing_filename, hedonic_filename=hedonic_filename)
+                housing_filename=housing_filename, hedonic_filename=hedonic_filename,
+                house_choice_mode=house_choice_mode, simple_anova_coefficients=simple_anova_coefficients,
+                cache_dir=landscape_cache_dir, headless=headless)
 
 # # Create a county-level institution (agent) that will make zoning decisions (DEACTIVATE for sensitivity experiments)
 # s.network.add_institution(CountyZoningManager(name='zoning_manager_005'))
@@ -95,7 +104,7 @@ s.set_landscape(landscape_name=landscape_name, geo_filename=geo_filename, pop_fi
 s.network.add_institution(AllHHAgents(name='all_hh_agents'))
 
 # Create household agents based on initial population data
-s.convert_initial_population_to_agents(no_hhs_per_agent=agent_housing_aggregation, simple_avoidance_perc=simple_avoidance_perc)
+s.convert_initial_population_to_agents(no_hhs_per_agent=agent_housing_aggregation, simple_avoidance_perc=simple_avoidance_perc, agent_mode=agent_mode, agent_history=agent_history)
 
 # Initialize available units on block groups based on initial population data
 s.initialize_available_building_units(initial_vacancy=initial_vacancy)
@@ -109,7 +118,7 @@ s.initialize_available_building_units(initial_vacancy=initial_vacancy)
 target = s.network
 s.add_engine(NewAgentCreation(target, growth_mode=pop_growth_mode, growth_rate=pop_growth_perc, inc_growth_mode=inc_growth_mode,
                               pop_growth_inc_perc=pop_growth_inc_perc, inc_growth_perc=inc_growth_perc, no_hhs_per_agent=agent_housing_aggregation, hh_size=hh_size,
-                              simple_avoidance_perc=simple_avoidance_perc))
+                              simple_avoidance_perc=simple_avoidance_perc, agent_mode=agent_mode, agent_history=agent_history))
 
 # Load existing agent sampler (for re-location) to simulation object
 target = s.network
@@ -119,18 +128,16 @@ s.add_engine(ExistingAgentReloSampler(target, perc_move=perc_move))
 # target = s.network
 # s.add_engine(HousingInventory(target, residences_per_unit=agent_housing_aggregation))
 
-# Load new agent location engine to simulation object
-bg_sample_size = 10  # the number of homes that a new agent samples for residential choice
-s.add_engine(NewAgentLocation(target, bg_sample_size, house_choice_mode=house_choice_mode, simple_anova_coefficients=simple_anova_coefficients, budget_reduction_perc=budget_reduction_perc))
-
-# Load existing agent re-location engine to simulation object
+# Load agent location engine (new and re-locating agents in a single queue) to simulation object
+# (replaces the NewAgentLocation and ExistingAgentLocation engines, which search each queue separately)
 target = s.network
-bg_sample_size = 10  # the number of homes that a re-locating agent samples for residential choice
-s.add_engine(ExistingAgentLocation(target, bg_sample_size=bg_sample_size, house_choice_mode=house_choice_mode, simple_anova_coefficients=simple_anova_coefficients))
+bg_sample_size = 10  # the number of homes that a new or re-locating agent samples for residential choice
+s.add_engine(AgentLocation(target, bg_sample_size=bg_sample_size, house_choice_mode=house_choice_mode, simple_anova_coefficients=simple_anova_coefficients,
+                           budget_reduction_perc=budget_reduction_perc))
 
 # Load housing market engine to simulation object
 target = s.network
-market_mode = 'top_candidate'
+market_mode = 'top_candidate'  # 'top_candidate' or 'deferred_acceptance' (stops once no proposals remain)
 s.add_engine(HousingMarket(target, market_mode=market_mode, bg_sample_size=bg_sample_size))
 
 # Load housing market engine to simulation object  # JY to complete
@@ -153,6 +160,12 @@ s.add_engine(HousingPricing(target, housing_pricing_mode=housing_pricing_mode, p
 target = s.network
 s.add_engine(LandscapeStatistics(target))
 
+# Load result writer engine to simulation object (writes each year's block group results as soon as the year is simulated)
+target = s.network
+results_dir = 'results'  # partitioned by run and model year (results/run=<run>/model_year=<year>/)
+run_name = str(model_run[0]) + '_' + str(model_run[1])
+s.add_engine(ResultWriter(target, output_dir=results_dir, run_name=run_name, output_format='parquet'))
+
 # Run simulation
 s.start()
 
@@ -160,21 +173,13 @@ s.start()
 end_time = time.time()
 sim_time = end_time-start_time
 print("Simulation took (seconds):  %s" % sim_time)
+print(s.get_profile().groupby('engine', sort=False)[['wall_time', 'cpu_time', 'peak_rss_delta_kb']].sum())  # time and memory by engine
+s.export_profile('profile_utility_' + str(model_run[0]) + '_' + str(model_run[1]) + '.csv')  # per-engine profile of each year (next to the results)
 
-first = True
-for t in range(s.network.current_timestep_idx):
-    df = s.network.get_history('housing_bg_df')[t]
-    df = df[['GEOID', 'GISJOIN', 'new_price', 'population', 'occupied_units', 'available_units',
-             'demand_exceeds_supply',
-             'perc_fld_area', 'mhi1990', 'salesprice1993', 'pop1990', 'average_income']]
-    df['model_year'] = t + 1
-    df['pop_perc_change'] = df['population'] / df['pop1990']
-    df['price_perc_change'] = df['new_price'] / df['salesprice1993']
-    if first:
-        df_combined = df
-        first = False
-    else:
-        df_combined = pd.concat([df_combined, df])
+# combine the yearly results written by the result writer (a single concatenation rather than one per year)
+df_combined = read_results(results_dir, run_name)
+df_combined['pop_perc_change'] = df_combined['population'] / df_combined['pop1990']
+df_combined['price_perc_change'] = df_combined['new_price'] / df_combined['salesprice1993']
 df_combined.to_csv('results_utility_' + str(model_run[0]) + '_' + str(model_run[1]) + '.csv')
 
 ##### Processing for household alluvial fan visual
@@ -185,9 +190,11 @@ df['flood_zone'] = "Not in Flood Zone"
 # df.loc[(df.perc_fld_area > df.perc_fld_area.quantile(.9)), 'flood_zone'] = "In Flood Zone"
 df.loc[(df.perc_fld_area > .10), 'flood_zone'] = "In Flood Zone"
 hh_df = pd.DataFrame(columns=['name','type','income','house_status'])
+start_locs = s.network.get_locations(s.start_year)  # agent locations (by agent table row) reconstructed from the move log
+end_locs = s.network.get_locations()
 for hh in s.network.get_institution('all_hh_agents').components:
-    start_loc = hh.get_history('location')[0]
-    end_loc = hh.get_history('location')[-1]
+    start_loc = start_locs[hh._row]
+    end_loc = end_locs[hh._row]
     start_loc_fld = df[(df.GEOID==start_loc)]['flood_zone']
     end_loc_fld = df[(df.GEOID == end_loc)]['flood_zone']
     if hh.name[9:16] == 'initial':
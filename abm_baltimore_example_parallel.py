@@ -3,12 +3,12 @@ from model_classes.simulator import ICOMSimulator
 from model_classes.institutional_categories import AllHHAgents
 from model_engines.agent_creation import NewAgentCreation
 from model_engines.existing_agent_relocation import ExistingAgentReloSampler
-from model_engines.new_agent_location import NewAgentLocation
-from model_engines.existing_agent_relocation import ExistingAgentLocation
+from model_engines.agent_location import AgentLocation
 from model_engines.housing_market import HousingMarket
 from model_engines.building_development import BuildingDevelopment
 from model_engines.housing_pricing import HousingPricing
 from model_engines.landscape_statistics import LandscapeStatistics
+from model_engines.result_writer import ResultWriter, read_results
 import time
 # from model_classes.institutional_agents import CountyZoningManager, RealEstate
 # from model_engines.real_estate_prices import RealEstatePrices
@@ -50,6 +50,7 @@ def run_model(model_setup):  # model_setup is a list of two value [house_choice_
     print(house_choice_mode)
     simple_anova_coefficients = [189680, 129080, 122136, 169503, model_setup[1]]  # coefficients for simple anova experiment [sqfeet, age, stories, baths, flood]
     simple_avoidance_perc = model_setup[1]
+    budget_reduction_perc = .90  # defines the percentage that a household reduces budget for housing good (to reserve for flood insurance costs)
     print(simple_anova_coefficients)  # JY Temp
     stock_increase_mode = 'simple_perc'  # indicates the mode in which prices increase for homes that are in high demand (simple perc, etc.)
     stock_increase_perc = .05  # indicates the percentage increase in price
@@ -66,14 +67,18 @@ def run_model(model_setup):  # model_setup is a list of two value [house_choice_
     hedonic_filename = 'simple_anova_hedonic_v2.csv'  # simple ANOVA hedonic regression conducted by Alfred
 
     # Create pynsim simulation object and set timesteps, landscape on simulation
+    seed = None  # random seed of the run (an integer makes the run reproducible; None seeds from OS entropy, logged by the simulator)
     s = ICOMSimulator(network=None, record_time=False, progress=False, max_iterations=1,
-                      name=simulation_name, scenario=scenario, intervention=intervention, start_year=start_year, no_of_years=no_years)
+                      name=simulation_name, scenario=scenario, intervention=intervention, start_year=start_year, no_of_years=no_years,
+                      seed=seed)
     s.set_timestep_information()  # sets up timestep information based on model options (start_year, no_years)
 
     # Load geography/landscape information to simulation object
+    landscape_cache_dir = 'landscape_cache'  # compiled landscapes are stored here and reused by runs with the same inputs (None to compile every run)
     s.set_landscape(landscape_name=landscape_name, geo_filename=geo_filename, pop_filename=pop_filename,
                     pop_fieldname=pop_fieldname, flood_filename=flood_filename,
-                    housing_filename=housing_filename, hedonic_filename=hedonic_filename)
+                    housing_filename=housing_filename, hedonic_filename=hedonic_filename,
+                    cache_dir=landscape_cache_dir)
 
     # # Create a county-level institution (agent) that will make zoning decisions (DEACTIVATE for sensitivity experiments)
     # s.network.add_institution(CountyZoningManager(name='zoning_manager_005'))
@@ -111,14 +116,12 @@ def run_model(model_setup):  # model_setup is a list of two value [house_choice_
     # target = s.network
     # s.add_engine(HousingInventory(target, residences_per_unit=agent_housing_aggregation))
 
-    # Load new agent location engine to simulation object
-    bg_sample_size = 10  # the number of homes that a new agent samples for residential choice
-    s.add_engine(NewAgentLocation(target, bg_sample_size, house_choice_mode=house_choice_mode, simple_anova_coefficients=simple_anova_coefficients, budget_reduction_perc=budget_reduction_perc))
-
-    # Load existing agent re-location engine to simulation object
+    # Load agent location engine (new and re-locating agents in a single queue) to simulation object
+    # (replaces the NewAgentLocation and ExistingAgentLocation engines, which search each queue separately)
     target = s.network
-    bg_sample_size = 10  # the number of homes that a re-locating agent samples for residential choice
-    s.add_engine(ExistingAgentLocation(target, bg_sample_size=bg_sample_size, house_choice_mode=house_choice_mode, simple_anova_coefficients=simple_anova_coefficients))
+    bg_sample_size = 10  # the number of homes that a new or re-locating agent samples for residential choice
+    s.add_engine(AgentLocation(target, bg_sample_size=bg_sample_size, house_choice_mode=house_choice_mode, simple_anova_coefficients=simple_anova_coefficients,
+                               budget_reduction_perc=budget_reduction_perc))
 
     # Load housing market engine to simulation object
     target = s.network
@@ -145,6 +148,12 @@ def run_model(model_setup):  # model_setup is a list of two value [house_choice_
     target = s.network
     s.add_engine(LandscapeStatistics(target))
 
+    # Load result writer engine to simulation object (writes each year's block group results as soon as the year is simulated)
+    target = s.network
+    results_dir = 'results'  # partitioned by run and model year (results/run=<run>/model_year=<year>/)
+    run_name = str(model_setup[0]) + '_' + str(model_setup[1])
+    s.add_engine(ResultWriter(target, output_dir=results_dir, run_name=run_name, output_format='parquet'))
+
     # Run simulation
     s.start()
 
@@ -153,21 +162,11 @@ def run_model(model_setup):  # model_setup is a list of two value [house_choice_
     sim_time = end_time-start_time
     print("Simulation took (seconds):  %s" % sim_time)
 
-    first = True
-    for t in range(s.network.current_timestep_idx):
-        df = s.network.get_history('housing_bg_df')[t]
-        df = df[['GEOID', 'GISJOIN', 'new_price', 'population', 'occupied_units', 'available_units',
-                 'demand_exceeds_supply',
-                 'perc_fld_area', 'mhi1990', 'salesprice1993', 'pop1990', 'average_income']]
-        df['model_year'] = t + 1
-        df['pop_perc_change'] = df['population'] / df['pop1990']
-        df['price_perc_change'] = df['new_price'] / df['salesprice1993']
-        if first:
-            df_combined = df
-            first = False
-        else:
-            df_combined = pd.concat([df_combined, df])
-    df_combined.to_csv('results_utility_' + str(flood_risk_coeff) + '.csv')
+    # combine the yearly results written by the result writer (a single concatenation rather than one per year)
+    df_combined = read_results(results_dir, run_name)
+    df_combined['pop_perc_change'] = df_combined['population'] / df_combined['pop1990']
+    df_combined['price_perc_change'] = df_combined['new_price'] / df_combined['salesprice1993']
+    df_combined.to_csv('results_utility_' + run_name + '.csv')
 
 
 def run_in_parallel():
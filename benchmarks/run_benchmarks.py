@@ -0,0 +1,189 @@
+"""Scaling benchmarks of the ICOM ABM over landscape size and agent aggregation.
+
+Runs the Baltimore example model setup on synthetic landscapes (see benchmarks/synthetic_landscape.py) for each
+combination of landscape size (number of block groups) and agent aggregation (no_hhs_per_agent), times the landscape
+setup and each engine in every simulated year (with the ICOMSimulator profiling hook), and writes the results to a
+JSON file. If a baseline results file is given, the mean per-year wall time of every engine is compared with the
+baseline and the run fails (exit code 1) if any engine is slower than its regression threshold.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks --sizes 650 5000 50000 --aggregations 100 10 1 --output benchmark_results.json
+    python -m benchmarks.run_benchmarks --baseline benchmark_baseline.json --threshold 1.25 --engine-threshold HousingMarket=1.5
+"""
+from model_classes.simulator import ICOMSimulator
+from model_classes.institutional_categories import AllHHAgents
+from model_engines.agent_creation import NewAgentCreation
+from model_engines.existing_agent_relocation import ExistingAgentReloSampler
+from model_engines.agent_location import AgentLocation
+from model_engines.housing_market import HousingMarket
+from model_engines.building_development import BuildingDevelopment
+from model_engines.housing_pricing import HousingPricing
+from model_engines.landscape_statistics import LandscapeStatistics
+from benchmarks.synthetic_landscape import write_synthetic_landscape
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import numpy as np
+
+DEFAULT_SIZES = [650, 5000, 20000, 50000]  # number of block groups (Baltimore has ~1200)
+DEFAULT_AGGREGATIONS = [100, 50, 10, 5, 1]  # no_hhs_per_agent
+MEAN_HHS_PER_BG = 450  # approximate households per synthetic block group (used to skip runs with too many agents)
+SIMPLE_ANOVA_COEFFICIENTS = [-121428, 294707, 130553, 128990, 154887, -500000]  # coefficients of the example script
+
+
+def run_case(data_dir, no_bgs, no_hhs_per_agent, no_years=3, seed=0, house_choice_mode='simple_avoidance_utility',
+             market_mode='top_candidate', agent_mode='compact'):
+    """Runs the example model setup on a synthetic landscape and returns the setup and per-year engine timings
+
+    **Args**:
+    data_dir (str): directory of the synthetic landscapes (one subdirectory per size)
+    no_bgs (int): number of block groups
+    no_hhs_per_agent (int): agent aggregation
+    no_years (int): number of simulated years (the model runs for no_years + 1 years)
+    seed (int): random seed of the synthetic landscape and of the model run
+    """
+    landscape_dir = os.path.join(data_dir, 'synthetic_' + str(no_bgs))
+    filenames = write_synthetic_landscape(landscape_dir, no_bgs, seed=seed)
+
+    setup_times = {}
+    s = ICOMSimulator(network=None, record_time=False, progress=False, max_iterations=1, name='benchmark',
+                      scenario='Baseline', intervention='Baseline', start_year=2018, no_of_years=no_years, profile=True,
+                      seed=seed)
+    s.set_timestep_information()
+    t = time.perf_counter()
+    s.set_landscape(landscape_name='synthetic', data_dir=landscape_dir, house_choice_mode=house_choice_mode,
+                    simple_anova_coefficients=SIMPLE_ANOVA_COEFFICIENTS, **filenames)
+    setup_times['set_landscape'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    s.network.add_institution(AllHHAgents(name='all_hh_agents'))
+    s.convert_initial_population_to_agents(no_hhs_per_agent=no_hhs_per_agent, simple_avoidance_perc=.95, agent_mode=agent_mode)
+    s.initialize_available_building_units(initial_vacancy=.20)
+    setup_times['initial_population'] = time.perf_counter() - t
+    no_initial_agents = len(s.network.hh_table)
+
+    target = s.network
+    s.add_engine(NewAgentCreation(target, growth_mode='perc', growth_rate=.01, inc_growth_mode='random_agent_replication',
+                                  pop_growth_inc_perc=.90, inc_growth_perc=.05, no_hhs_per_agent=no_hhs_per_agent, hh_size=2.7,
+                                  simple_avoidance_perc=.95, agent_mode=agent_mode))
+    s.add_engine(ExistingAgentReloSampler(target, perc_move=.10))
+    s.add_engine(AgentLocation(target, bg_sample_size=10, house_choice_mode=house_choice_mode,
+                               simple_anova_coefficients=SIMPLE_ANOVA_COEFFICIENTS, budget_reduction_perc=.90))
+    s.add_engine(HousingMarket(target, market_mode=market_mode, bg_sample_size=10))
+    s.add_engine(BuildingDevelopment(target, stock_increase_mode='simple_perc', stock_increase_perc=.05))
+    s.add_engine(HousingPricing(target, housing_pricing_mode='simple_perc_array', price_increase_perc=.05))
+    s.add_engine(LandscapeStatistics(target))
+
+    t = time.perf_counter()
+    s.start()
+    run_time = time.perf_counter() - t
+
+    profile = s.get_profile()
+    engines = {}
+    for engine_name, records in profile.groupby('engine', sort=False):
+        engines[engine_name] = {
+            'wall_time': records['wall_time'].tolist(),  # per simulated year
+            'cpu_time': records['cpu_time'].tolist(),
+            'mean_wall_time': float(records['wall_time'].mean()),
+            'peak_rss_delta_kb': float(records['peak_rss_delta_kb'].sum()),
+        }
+    return {'no_bgs': no_bgs, 'no_hhs_per_agent': no_hhs_per_agent, 'no_years': no_years + 1, 'seed': seed,
+            'no_initial_agents': no_initial_agents, 'no_final_agents': len(s.network.hh_table),
+            'setup_time': setup_times, 'run_time': run_time, 'engines': engines}
+
+
+def case_key(case):
+    return str(case['no_bgs']) + '_bgs_' + str(case['no_hhs_per_agent']) + '_hhs_per_agent'
+
+
+def compare_to_baseline(results, baseline, threshold=1.25, engine_thresholds=None, min_time=.01):
+    """Compares the mean per-year wall time of each engine (and the setup times) with a baseline results file
+
+    **Args**:
+    results (dict): benchmark results
+    baseline (dict): baseline benchmark results
+    threshold (float): maximum ratio of result to baseline time before a timing is a regression
+    engine_thresholds (dict {str:float}): thresholds of specific engines / setup steps (override threshold)
+    min_time (float): timings below min_time seconds (in both runs) are not compared (too noisy)
+
+    **Returns**:
+    list of dicts (case, timing, baseline and result times, ratio and threshold) of the regressions
+    """
+    engine_thresholds = engine_thresholds or {}
+    baseline_cases = {case_key(case): case for case in baseline['cases']}
+    regressions = []
+    for case in results['cases']:
+        baseline_case = baseline_cases.get(case_key(case))
+        if baseline_case is None:
+            continue
+        timings = [(name, case['setup_time'][name], baseline_case['setup_time'].get(name)) for name in case['setup_time']]
+        timings += [(name, case['engines'][name]['mean_wall_time'], baseline_case['engines'].get(name, {}).get('mean_wall_time'))
+                    for name in case['engines']]
+        for name, result_time, baseline_time in timings:
+            if baseline_time is None or max(result_time, baseline_time) < min_time:
+                continue
+            ratio = result_time / baseline_time if baseline_time > 0 else np.inf
+            limit = engine_thresholds.get(name, threshold)
+            if ratio > limit:
+                regressions.append({'case': case_key(case), 'timing': name, 'baseline_time': baseline_time,
+                                    'result_time': result_time, 'ratio': ratio, 'threshold': limit})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scaling benchmarks of the ICOM ABM engines')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='numbers of block groups')
+    parser.add_argument('--aggregations', type=int, nargs='+', default=DEFAULT_AGGREGATIONS, help='no_hhs_per_agent values')
+    parser.add_argument('--years', type=int, default=3, help='number of simulated years after the first year')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-agents', type=float, default=1e6, help='skip runs with more (estimated) initial agents')
+    parser.add_argument('--data-dir', default=os.path.join('benchmarks', 'data'), help='directory of the synthetic landscapes')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help='baseline results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=1.25, help='maximum ratio of result to baseline time')
+    parser.add_argument('--engine-threshold', action='append', default=[], metavar='NAME=RATIO',
+                        help='threshold of a specific engine or setup step (repeatable)')
+    parser.add_argument('--min-time', type=float, default=.01, help='shortest timing (s) compared with the baseline')
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)  # engine progress messages are not timed output
+    results = {'metadata': {'date': datetime.datetime.now().isoformat(), 'python': platform.python_version(),
+                            'numpy': np.__version__, 'platform': platform.platform(), 'years': args.years + 1},
+               'cases': []}
+    for no_bgs in args.sizes:
+        for no_hhs_per_agent in sorted(args.aggregations, reverse=True):
+            estimated_agents = no_bgs * MEAN_HHS_PER_BG / no_hhs_per_agent
+            if estimated_agents > args.max_agents:
+                print('Skipping ' + str(no_bgs) + ' block groups, ' + str(no_hhs_per_agent) + ' households per agent (~' +
+                      str(int(estimated_agents)) + ' agents)')
+                continue
+            case = run_case(args.data_dir, no_bgs, no_hhs_per_agent, no_years=args.years, seed=args.seed)
+            results['cases'].append(case)
+            print(case_key(case) + ': ' + str(case['no_initial_agents']) + ' agents, setup ' +
+                  str(round(sum(case['setup_time'].values()), 2)) + ' s, run ' + str(round(case['run_time'], 2)) + ' s')
+            with open(args.output, 'w') as f:  # rewritten after each case, so finished cases are kept if a run is killed
+                json.dump(results, f, indent=1)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        engine_thresholds = {name: float(ratio) for name, ratio in (item.split('=') for item in args.engine_threshold)}
+        regressions = compare_to_baseline(results, baseline, threshold=args.threshold, engine_thresholds=engine_thresholds,
+                                          min_time=args.min_time)
+        for regression in regressions:
+            print('REGRESSION ' + regression['case'] + ' ' + regression['timing'] + ': ' + str(round(regression['result_time'], 4)) +
+                  ' s vs ' + str(round(regression['baseline_time'], 4)) + ' s baseline (x' + str(round(regression['ratio'], 2)) +
+                  ', threshold x' + str(regression['threshold']) + ')')
+        if regressions:
+            return 1
+        print('No regressions against ' + args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
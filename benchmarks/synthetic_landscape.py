@@ -0,0 +1,101 @@
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+
+CELL_SIZE = 1000.0  # side of a synthetic block group (m, EPSG:3857)
+ORIGIN = (-8560000.0, 4720000.0)  # lower left corner of the synthetic landscape (near Baltimore, EPSG:3857)
+POP_FIELDNAME = 'POP2018'
+
+SYNTHETIC_FILENAMES = {
+    'geo_filename': 'synthetic_bg.gpkg',
+    'pop_filename': 'synthetic_bg_population.csv',
+    'pop_fieldname': POP_FIELDNAME,
+    'flood_filename': 'synthetic_bg_flood.csv',
+    'housing_filename': 'synthetic_bg_housing.csv',
+    'hedonic_filename': 'synthetic_bg_hedonic.csv',
+}  # set_landscape file arguments of a synthetic landscape (relative to its data_dir)
+
+
+def make_synthetic_landscape(no_bgs, seed=0, missing_perc=.02):
+    """Generates a synthetic landscape of no_bgs square block groups on a grid, with the columns that
+    ICOMSimulator.set_landscape expects in each input file. Values are drawn from distributions that roughly follow the
+    Baltimore inputs (1990 population, income, household size and 1993 sales prices, flood zone areas and hedonic
+    attributes). A share of block groups (missing_perc) has missing sales prices and hedonic values, so that the nearest
+    neighbor gap filling in set_landscape is exercised.
+
+    **Args**:
+    no_bgs (int): number of block groups
+    seed (int): random seed
+    missing_perc (float): share of block groups with missing sales prices and hedonic values
+
+    **Returns**:
+    dict of the geo (GeoDataFrame), pop, flood, housing and hedonic (DataFrame) inputs
+    """
+    rng = np.random.RandomState(seed)
+    side = int(np.ceil(np.sqrt(no_bgs)))
+    col = np.arange(no_bgs) % side
+    row = np.arange(no_bgs) // side
+    x0 = ORIGIN[0] + col * CELL_SIZE
+    y0 = ORIGIN[1] + row * CELL_SIZE
+    geometry = [box(x, y, x + CELL_SIZE, y + CELL_SIZE) for x, y in zip(x0, y0)]
+
+    county = 1 + np.arange(no_bgs) // 100000
+    tract = (np.arange(no_bgs) // 10) % 10000
+    blkgrp = np.arange(no_bgs) % 10
+    countyfp = np.char.zfill(county.astype(str), 3)
+    tractce = np.char.zfill(tract.astype(str), 6)
+    blkgrpce = blkgrp.astype(str)
+    geoid = np.char.add(np.char.add(np.char.add('24', countyfp), tractce), blkgrpce)
+    gisjoin = np.char.add(np.char.add(np.char.add(np.char.add('G24', countyfp), '0'), tractce), blkgrpce)
+
+    geo = gpd.GeoDataFrame({'GISJOIN': gisjoin, 'COUNTYFP': countyfp, 'TRACTCE': tractce, 'BLKGRPCE': blkgrpce,
+                            'GEOID': geoid, 'ALAND': np.full(no_bgs, CELL_SIZE ** 2)},
+                           geometry=geometry, crs='EPSG:3857')
+
+    # distances to a central business district (center of the grid) and to a coast (bottom edge of the grid)
+    center_x = ORIGIN[0] + side * CELL_SIZE / 2
+    center_y = ORIGIN[1] + side * CELL_SIZE / 2
+    cbddist = np.hypot(x0 + CELL_SIZE / 2 - center_x, y0 + CELL_SIZE / 2 - center_y)
+    coastdist = y0 + CELL_SIZE / 2 - ORIGIN[1]
+
+    pop1990 = np.round(rng.lognormal(np.log(1100), .5, no_bgs))
+    hhsize1990 = np.clip(rng.normal(2.7, .35, no_bgs), 1.2, 5)
+    mhi1990 = np.round(rng.lognormal(np.log(31600), .45, no_bgs))
+    salesprice1993 = np.round(np.clip(mhi1990 * rng.lognormal(np.log(2.6), .35, no_bgs), 14000, 370000))
+    salespricesf1993 = salesprice1993 / rng.uniform(1000, 2000, no_bgs)
+    in_flood_zone = coastdist < .1 * side * CELL_SIZE  # flood zone along the coast
+    perc_fld_area = np.where(in_flood_zone, rng.beta(1.2, 6, no_bgs), 0)
+
+    housing = pd.DataFrame({'GISJOIN': gisjoin, 'pop1990': pop1990, 'mhi1990': mhi1990, 'hhsize1990': hhsize1990,
+                            'coastdist': coastdist, 'cbddist': cbddist, 'hhtrans1993': rng.poisson(7, no_bgs) + 1,
+                            'salesprice1993': salesprice1993, 'salespricesf1993': salespricesf1993})
+    hedonic = pd.DataFrame({'GISJOIN': gisjoin, 'N_MeanSqfeet': rng.beta(2, 6, no_bgs), 'N_MeanAge': rng.beta(5, 3, no_bgs),
+                            'N_MeanNoOfStories': rng.beta(5, 3, no_bgs), 'N_MeanFullBathNumber': rng.beta(2, 5, no_bgs),
+                            'N_perc_area_flood': perc_fld_area / max(perc_fld_area.max(), 1e-9),
+                            'residuals': rng.normal(0, 40000, no_bgs)})
+
+    missing = rng.random_sample(no_bgs) < missing_perc
+    missing[0] = False  # keep at least one block group with data for the nearest neighbor gap filling
+    housing.loc[missing, ['salesprice1993', 'salespricesf1993']] = np.nan
+    hedonic.loc[missing, ['N_MeanSqfeet', 'N_MeanAge', 'N_MeanNoOfStories', 'N_MeanFullBathNumber', 'N_perc_area_flood', 'residuals']] = np.nan
+
+    pop = pd.DataFrame({'GISJOIN': gisjoin, POP_FIELDNAME: np.round(pop1990 * 1.1)})
+    flood = pd.DataFrame({'GISJOIN': gisjoin[in_flood_zone], 'perc_fld_area': perc_fld_area[in_flood_zone]})  # only block groups intersecting the flood zone (as in the FEMA input)
+    return {'geo': geo, 'pop': pop, 'flood': flood, 'housing': housing, 'hedonic': hedonic}
+
+
+def write_synthetic_landscape(data_dir, no_bgs, seed=0, missing_perc=.02):
+    """Writes a synthetic landscape (see make_synthetic_landscape) to data_dir, unless it has already been written
+
+    **Returns**:
+    dict of set_landscape file arguments (SYNTHETIC_FILENAMES)
+    """
+    if not os.path.exists(os.path.join(data_dir, SYNTHETIC_FILENAMES['hedonic_filename'])):
+        os.makedirs(data_dir, exist_ok=True)
+        inputs = make_synthetic_landscape(no_bgs, seed=seed, missing_perc=missing_perc)
+        inputs['geo'].to_file(os.path.join(data_dir, SYNTHETIC_FILENAMES['geo_filename']), driver='GPKG')
+        for name in ['pop', 'flood', 'housing', 'hedonic']:
+            inputs[name].to_csv(os.path.join(data_dir, SYNTHETIC_FILENAMES[name + '_filename']), index=False)  # hedonic is written last (marks a complete landscape)
+    return dict(SYNTHETIC_FILENAMES)
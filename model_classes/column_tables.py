@@ -0,0 +1,180 @@
+import numpy as np
+
+UNASSIGNED = -1  # location code of an agent that has not been assigned a residence (location is None)
+OUTMIGRATED = -2  # location code of an agent that has migrated outside of the domain (location is 'outmigrated')
+
+STATUS_UNASSIGNED = 0  # agent is waiting in the location queue
+STATUS_RESIDENT = 1  # agent resides in a block group
+STATUS_RELOCATING = 2  # agent is waiting in the re-location queue
+STATUS_OUTMIGRATED = 3  # agent has migrated outside of the domain
+
+
+class ColumnTable(object):
+    """The ColumnTable class.
+
+    A struct-of-arrays table: each column is a NumPy array and each row is an entity (e.g., a household agent). Rows are
+    appended at the end and the arrays grow by doubling their capacity, so adding rows one at a time is amortized O(1)
+    and whole columns can be read and written by engines as arrays.
+
+    **Attributes**:
+
+        |  *columns* (dict {str:dtype}) - column names and NumPy dtypes
+        |  *defaults* (dict {str:value}) - value of each column for new rows
+        |  *size* (int) - number of rows in use
+
+    """
+    columns = {}
+    defaults = {}
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self._capacity = max(int(capacity), 1)
+        self._data = {}
+        for column, dtype in self.columns.items():
+            self._data[column] = np.full(self._capacity, self.defaults.get(column, 0), dtype=dtype)
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self, min_capacity):
+        capacity = self._capacity
+        while capacity < min_capacity:
+            capacity *= 2
+        for column, values in self._data.items():
+            grown = np.full(capacity, self.defaults.get(column, 0), dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            self._data[column] = grown
+        self._capacity = capacity
+
+    def add_rows(self, n=1, **values):
+        """Appends n rows (columns not specified take their default value) and returns their row indices
+        """
+        if self.size + n > self._capacity:
+            self._grow(self.size + n)
+        rows = np.arange(self.size, self.size + n)
+        self.size += n
+        for column, value in values.items():
+            self._data[column][rows] = value
+        return rows
+
+    def column(self, column):
+        """Returns the values of a column for all rows in use (a view, writing to it updates the table)
+        """
+        return self._data[column][:self.size]
+
+    def get(self, column, row):
+        return self._data[column][row].item()
+
+    def set(self, column, row, value):
+        self._data[column][row] = value
+
+
+class TableColumn(object):
+    """A descriptor that exposes a ColumnTable column as an attribute of an object viewing one row of the table (the
+    object holds the table in _table and its row in _row)
+    """
+    def __init__(self, column):
+        self.column = column
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return obj._table.get(self.column, obj._row)
+
+    def __set__(self, obj, value):
+        obj._table.set(self.column, obj._row, value)
+
+
+class AgentTable(ColumnTable):
+    """The AgentTable class.
+
+    A ColumnTable of household agent attributes (one row per HHAgent). Agent locations are stored as integer codes: block
+    group names are interned in bg_names, so that after set_bg_names is called with the landscape's block groups (in row
+    order) an agent's location code is the row of its block group. UNASSIGNED and OUTMIGRATED codes stand for agents
+    without a residence.
+
+    **Attributes**:
+
+        |  *bg_names* (list / str) - block group name of each location code
+        |  *bg_codes* (dict {str:int}) - location code keyed on block group name
+
+    """
+    columns = {
+        'income': np.float64,
+        'hh_size': np.float64,
+        'no_hhs_per_agent': np.int64,
+        'house_budget': np.float64,
+        'avoidance': np.bool_,
+        'location': np.int64,
+        'year_of_residence': np.int64,
+        'status': np.int8,
+    }
+    defaults = {
+        'income': np.nan,
+        'hh_size': np.nan,
+        'house_budget': np.nan,
+        'location': UNASSIGNED,
+        'status': STATUS_UNASSIGNED,
+    }
+
+    def __init__(self, capacity=1024, bg_names=None):
+        super(AgentTable, self).__init__(capacity=capacity)
+        self.bg_names = []
+        self.bg_codes = {}
+        if bg_names is not None:
+            self.set_bg_names(bg_names)
+
+    def set_bg_names(self, bg_names):
+        """Interns the block group names in the given order (block group row order), so location codes are block group
+        rows. Must be called before any agent is located.
+        """
+        self.bg_names = []
+        self.bg_codes = {}
+        for bg_name in bg_names:
+            self.location_code(bg_name)
+
+    def location_code(self, location):
+        """Returns the location code of a block group name (interning new names), None or 'outmigrated'
+        """
+        if location is None:
+            return UNASSIGNED
+        if location == 'outmigrated':
+            return OUTMIGRATED
+        code = self.bg_codes.get(location)
+        if code is None:
+            code = len(self.bg_names)
+            self.bg_codes[location] = code
+            self.bg_names.append(location)
+        return code
+
+    def location_name(self, code):
+        """Returns the block group name (or None / 'outmigrated') of a location code
+        """
+        if code == UNASSIGNED:
+            return None
+        if code == OUTMIGRATED:
+            return 'outmigrated'
+        return self.bg_names[code]
+
+    def get(self, column, row):
+        if column == 'location':
+            return self.location_name(self._data['location'][row])
+        return super(AgentTable, self).get(column, row)
+
+    def set(self, column, row, value):
+        if column == 'location':
+            code = self.location_code(value)
+            self._data['location'][row] = code
+            if code == UNASSIGNED:
+                self._data['status'][row] = STATUS_UNASSIGNED
+            elif code == OUTMIGRATED:
+                self._data['status'][row] = STATUS_OUTMIGRATED
+            else:
+                self._data['status'][row] = STATUS_RESIDENT
+        else:
+            super(AgentTable, self).set(column, row, value)
+
+    def rows_of(self, agents):
+        """Returns the table rows of a list of HHAgent objects (all viewing this table)
+        """
+        return np.fromiter((agent._row for agent in agents), dtype=np.int64, count=len(agents))
@@ -0,0 +1,129 @@
+import numpy as np
+import os
+
+
+class ColumnHistory(object):
+    """The ColumnHistory class.
+
+    A time-series store that records a set of columns (one value per entity, e.g., per block group) once per timestep
+    into preallocated (timesteps x entities) NumPy matrices, instead of keeping a copy of a dataframe or a list of
+    values per entity and timestep. Numeric and boolean columns can be backed by memory-mapped .npy files (so long
+    runs keep their history on disk); other columns (e.g., strings or None) are kept in object matrices in memory.
+    Columns appearing after the first timestep have missing values (nan / None) for earlier timesteps. The dtype of a
+    matrix is set by the first recorded values and promoted (bool -> int -> float -> object) when later values do not
+    fit it, so values are never silently cast (e.g., floats recorded after integer defaults).
+
+    **Attributes**:
+
+        |  *no_entities* (int) - number of entities (matrix columns)
+        |  *capacity* (int) - number of timesteps allocated (matrices grow by doubling if exceeded)
+        |  *no_recorded* (int) - number of timesteps recorded
+        |  *history_dir* (str) - directory of the memory-mapped .npy files (None to keep the matrices in memory)
+        |  *matrices* (dict {str:array}) - (capacity x no_entities) matrix of each column
+
+    """
+    def __init__(self, no_entities, capacity=1, history_dir=None):
+        self.no_entities = no_entities
+        self.capacity = max(int(capacity), 1)
+        self.no_recorded = 0
+        self.history_dir = history_dir
+        self.matrices = {}
+        if history_dir is not None:
+            os.makedirs(history_dir, exist_ok=True)
+
+    def _allocate(self, column, dtype, capacity):
+        shape = (capacity, self.no_entities)
+        if self.history_dir is not None and dtype != np.object_:
+            filename = os.path.join(self.history_dir, column + '_' + np.dtype(dtype).name + '_' + str(capacity) + '.npy')
+            matrix = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+        else:
+            matrix = np.empty(shape, dtype=dtype)
+        if dtype == np.object_:
+            matrix[:] = None
+        elif np.issubdtype(dtype, np.floating):
+            matrix[:] = np.nan
+        else:
+            matrix[:] = 0
+        return matrix
+
+    def _reallocate(self, column, dtype, capacity):
+        matrix = self.matrices[column]
+        reallocated = self._allocate(column, dtype, capacity)
+        reallocated[:self.no_recorded] = matrix[:self.no_recorded]
+        if isinstance(matrix, np.memmap):
+            filename = matrix.filename
+            del matrix
+            self.matrices[column] = reallocated
+            os.remove(filename)
+        else:
+            self.matrices[column] = reallocated
+
+    def _grow(self):
+        capacity = self.capacity * 2
+        for column in list(self.matrices):
+            self._reallocate(column, self.matrices[column].dtype, capacity)
+        self.capacity = capacity
+
+    @staticmethod
+    def _column_dtype(values):
+        kind = np.asarray(values).dtype.kind
+        if kind == 'b':
+            return np.bool_
+        if kind in 'iu':
+            return np.int64
+        if kind == 'f':
+            return np.float64
+        return np.object_
+
+    def record(self, columns):
+        """Records the values of each column (arrays of no_entities values) for the next timestep
+        """
+        if self.no_recorded == self.capacity:
+            self._grow()
+        t = self.no_recorded
+        for column, values in columns.items():
+            dtype = self._column_dtype(values)
+            if column not in self.matrices:
+                self.matrices[column] = self._allocate(column, dtype, self.capacity)
+            elif np.result_type(self.matrices[column].dtype, dtype) != self.matrices[column].dtype:
+                self._reallocate(column, np.result_type(self.matrices[column].dtype, dtype), self.capacity)  # promote
+            self.matrices[column][t] = values
+        self.no_recorded += 1
+
+    def column(self, column):
+        """Returns the (no_recorded x no_entities) matrix of a column (a view)
+        """
+        return self.matrices[column][:self.no_recorded]
+
+    def timestep(self, t):
+        """Returns the values of every column at timestep t (views of the matrix rows)
+        """
+        if t < 0:
+            t += self.no_recorded
+        if not 0 <= t < self.no_recorded:
+            raise IndexError('timestep ' + str(t) + ' has not been recorded')
+        return {column: matrix[t] for column, matrix in self.matrices.items()}
+
+
+class FrameHistory(object):
+    """A read-only sequence of recorded dataframes (one per timestep) that are materialized on demand: indexing
+    frames[t] joins the static dataframe with the columns recorded at timestep t (frames[-1] is the last timestep).
+    """
+    def __init__(self, static_df, history):
+        self.static_df = static_df
+        self.history = history
+
+    def __len__(self):
+        return self.history.no_recorded
+
+    def __getitem__(self, t):
+        if isinstance(t, slice):
+            return [self[i] for i in range(*t.indices(len(self)))]
+        frame = self.static_df.copy(deep=False)
+        for column, values in self.history.timestep(t).items():
+            frame[column] = values.copy()
+        return frame
+
+    def __iter__(self):
+        for t in range(len(self)):
+            yield self[t]
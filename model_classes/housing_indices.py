@@ -0,0 +1,221 @@
+import numpy as np
+
+
+class WeightedSampler(object):
+    """The WeightedSampler class.
+
+    A Fenwick (binary indexed) tree over a fixed number of positions, each holding a non-negative weight (e.g., available
+    units). Prefix sums, point updates and weighted draws (finding the position in which a target value of the cumulative
+    weight falls) all take O(log n), so the weights can be kept in sync one unit at a time without rebuilding a weight
+    vector. Prefix sums and draws are vectorized over arrays of queries.
+
+    **Attributes**:
+
+        |  *weights* (array / float) - weight of each position
+        |  *tree* (array / float) - Fenwick tree of partial sums (1-based)
+
+    """
+    REBUILD_THRESHOLD = 16  # no. of changed weights above which set_range rebuilds the tree instead of updating each weight
+
+    def __init__(self, weights):
+        self.weights = np.array(weights, dtype=float)
+        self.size = len(self.weights)
+        self.rebuild()
+        self._top_step = 1 << (self.size.bit_length() - 1) if self.size > 0 else 0
+
+    def rebuild(self):
+        """Rebuilds the tree from the weights in O(n) with array operations (tree node i holds the sum of the weights of
+        positions i - lowbit(i) .. i - 1, a difference of cumulative sums)
+        """
+        cumulative = np.zeros(self.size + 1)
+        np.cumsum(self.weights, out=cumulative[1:])
+        i = np.arange(self.size + 1)
+        self.tree = cumulative - cumulative[i - (i & -i)]
+
+    def add(self, position, delta):
+        """Adds delta to the weight of a position
+        """
+        self.weights[position] += delta
+        i = position + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    def set(self, position, weight):
+        """Sets the weight of a position
+        """
+        delta = weight - self.weights[position]
+        if delta != 0:
+            self.add(position, delta)
+
+    def set_range(self, start, weights):
+        """Sets the weights of consecutive positions beginning at start (only changed weights are updated, the tree is
+        rebuilt if more than REBUILD_THRESHOLD weights change)
+        """
+        weights = np.asarray(weights, dtype=float)
+        deltas = weights - self.weights[start:start + len(weights)]
+        changed = np.flatnonzero(deltas)
+        if len(changed) > self.REBUILD_THRESHOLD:
+            self.set_all(np.concatenate([self.weights[:start], weights, self.weights[start + len(weights):]]))
+            return
+        for offset in changed:
+            self.add(start + offset, deltas[offset])
+
+    def set_all(self, weights):
+        """Sets the weights of all positions (the tree is rebuilt)
+        """
+        self.weights = np.array(weights, dtype=float)
+        self.rebuild()
+
+    def prefix_sum(self, counts):
+        """Returns the total weight of the first counts positions (vectorized over an array of counts)
+        """
+        i = np.array(counts, dtype=np.int64, ndmin=1)
+        totals = np.zeros(len(i))
+        remaining = i > 0
+        while remaining.any():
+            totals[remaining] += self.tree[i[remaining]]
+            i[remaining] -= i[remaining] & -i[remaining]
+            remaining = i > 0
+        return totals
+
+    def total(self):
+        """Returns the total weight of all positions
+        """
+        return self.prefix_sum([self.size])[0]
+
+    def search(self, targets):
+        """Returns, for each target value, the first position at which the cumulative weight exceeds the target (i.e.,
+        a weighted draw if targets are uniform random values between 0 and the total weight)
+        """
+        targets = np.array(targets, dtype=float, ndmin=1)
+        positions = np.zeros(targets.shape, dtype=np.int64)
+        step = self._top_step
+        while step > 0:
+            candidates = positions + step
+            valid = candidates <= self.size
+            advance = valid & (self.tree[np.where(valid, candidates, 0)] <= targets)
+            positions[advance] = candidates[advance]
+            targets = targets - np.where(advance, self.tree[np.where(advance, candidates, 0)], 0)
+            step >>= 1
+        return np.minimum(positions, self.size - 1)
+
+
+class AffordabilityIndex(object):
+    """The AffordabilityIndex class.
+
+    An index over a set of block groups that keeps the block groups sorted by housing price, so that the block groups a
+    household can afford are a prefix of the price order (found with a binary search on the household's budget). The
+    available units of the block groups are held in a WeightedSampler over the price order, so that the units within
+    budget (a prefix sum) and a block group within budget drawn with probability proportional to its available units
+    (a search of the tree) both take O(log n), and unit changes are applied in O(log n).
+
+    **Attributes**:
+
+        |  *order* (array / int) - block group rows sorted by price (lowest to highest)
+        |  *sorted_prices* (array / float) - block group prices in price order (missing prices are stored as inf)
+        |  *rank* (array / int) - position of each block group row in the price order (-1 if not in the index)
+        |  *units* (array / float) - available units of each block group row
+        |  *sampler* (WeightedSampler) - available units (floored at 0) over the price order
+
+    """
+    def __init__(self, prices, units, members=None):
+        prices = np.where(np.isnan(np.asarray(prices, dtype=float)), np.inf, prices)  # block groups without a price are never affordable
+        if members is None:
+            members = np.ones(len(prices), dtype=bool)
+        member_rows = np.flatnonzero(members)
+        self.order = member_rows[np.argsort(prices[member_rows], kind='stable')]
+        self.sorted_prices = prices[self.order]
+        self.rank = np.full(len(prices), -1, dtype=np.int64)
+        self.rank[self.order] = np.arange(len(self.order))
+        self.set_units(units)
+
+    def set_units(self, units):
+        """Resets the available units of all block groups (rebuilds the sampler, the price order is unchanged)
+        """
+        self.units = np.nan_to_num(np.asarray(units, dtype=float))
+        self.sampler = WeightedSampler(np.maximum(self.units[self.order], 0))
+
+    def add_units(self, bg_row, delta):
+        """Adds delta available units to a block group
+        """
+        self.units[bg_row] += delta
+        if self.rank[bg_row] >= 0:
+            self.sampler.set(self.rank[bg_row], max(self.units[bg_row], 0))
+
+    def affordable_units(self, budgets):
+        """Returns the total available units within each budget
+        """
+        return self.sampler.prefix_sum(np.searchsorted(self.sorted_prices, budgets, side='right'))
+
+    def locate(self, targets):
+        """Returns the block group row in which each target value of the cumulative available units falls (targets must
+        be lower than the total available units within the household's budget)
+        """
+        return self.order[self.sampler.search(targets)]
+
+    def sample(self, budgets, sample_size, random_state=np.random):
+        """Draws sample_size block groups with replacement for each budget, weighted by available units, from the block
+        groups within budget. Rows of the returned (no. of budgets x sample_size) array are -1 if no units are affordable.
+        random_state is a NumPy Generator (or the np.random module).
+        """
+        totals = self.affordable_units(budgets)
+        candidates = np.full((len(totals), sample_size), -1, dtype=np.int64)
+        can_afford = totals > 0
+        targets = random_state.random((int(can_afford.sum()), sample_size)) * totals[can_afford, None]
+        candidates[can_afford] = self.locate(targets)
+        return candidates
+
+    def update_price(self, bg_row, new_price):
+        """Moves a block group to its new position in the price order in place (only the entries between the old and the
+        new position are shifted, the index is not re-sorted)
+        """
+        old_position = self.rank[bg_row]
+        if old_position < 0:
+            return
+        if np.isnan(new_price):
+            new_price = np.inf
+        new_position = np.searchsorted(self.sorted_prices, new_price, side='right')
+        if new_position > old_position + 1:  # price increase, shift the block groups in between down the order
+            new_position -= 1
+            self.order[old_position:new_position] = self.order[old_position + 1:new_position + 1]
+            self.sorted_prices[old_position:new_position] = self.sorted_prices[old_position + 1:new_position + 1]
+        elif new_position < old_position:  # price decrease, shift the block groups in between up the order
+            self.order[new_position + 1:old_position + 1] = self.order[new_position:old_position]
+            self.sorted_prices[new_position + 1:old_position + 1] = self.sorted_prices[new_position:old_position]
+        else:
+            new_position = old_position
+        self.order[new_position] = bg_row
+        self.sorted_prices[new_position] = new_price
+        start, stop = min(old_position, new_position), max(old_position, new_position) + 1
+        self.rank[self.order[start:stop]] = np.arange(start, stop)
+        self.sampler.set_range(start, np.maximum(self.units[self.order[start:stop]], 0))
+
+    def update_prices(self, bg_rows, new_prices):
+        """Updates the price of several block groups at once: the block groups are removed from the price order and
+        merged back at their new prices (one stable sort of the changed block groups and a merge, O(n + k log k)), and the
+        sampler is rebuilt once. The order is the one of update_price applied to each block group in turn (a block group
+        is placed after the block groups of equal price, block groups of equal new price keep their order in bg_rows).
+        """
+        bg_rows = np.asarray(bg_rows, dtype=np.int64)
+        new_prices = np.where(np.isnan(np.asarray(new_prices, dtype=float)), np.inf, new_prices)
+        _, last = np.unique(bg_rows[::-1], return_index=True)  # last update of each block group
+        last = np.sort(len(bg_rows) - 1 - last)
+        bg_rows, new_prices = bg_rows[last], new_prices[last]
+        in_index = self.rank[bg_rows] >= 0
+        bg_rows, new_prices = bg_rows[in_index], new_prices[in_index]
+        if len(bg_rows) == 0:
+            return
+
+        moved = np.zeros(len(self.order), dtype=bool)
+        moved[self.rank[bg_rows]] = True
+        kept_order, kept_prices = self.order[~moved], self.sorted_prices[~moved]
+        by_price = np.argsort(new_prices, kind='stable')
+        bg_rows, new_prices = bg_rows[by_price], new_prices[by_price]
+        positions = np.searchsorted(kept_prices, new_prices, side='right') + np.arange(len(bg_rows))
+        is_new = np.zeros(len(self.order), dtype=bool)
+        is_new[positions] = True
+        self.order[positions], self.sorted_prices[positions] = bg_rows, new_prices
+        self.order[~is_new], self.sorted_prices[~is_new] = kept_order, kept_prices
+        self.rank[self.order] = np.arange(len(self.order))
+        self.sampler.set_all(np.maximum(self.units[self.order], 0))
@@ -1,12 +1,20 @@
 from pynsim import Network
 from pynsim import Node
+from model_classes.housing_indices import AffordabilityIndex
+from model_classes.column_tables import AgentTable, STATUS_RELOCATING
+from model_classes.history_store import ColumnHistory, FrameHistory
+from model_classes.move_log import MoveEventLog
 import logging
-import statistics
-import geopandas as gpd
-import pandas as pd
+import os
 from math import nan
 import numpy as np
 
+UTILITY_SOURCE_COLUMNS = ['N_MeanSqfeet', 'N_MeanAge', 'N_MeanNoOfStories', 'N_MeanFullBathNumber', 'N_perc_area_flood', 'residuals']  # block group columns used by the simple anova utility functions
+CACHED_UTILITY_MODES = ['simple_flood_utility', 'simple_avoidance_utility', 'budget_reduction']  # house choice modes with utilities that only depend on UTILITY_SOURCE_COLUMNS
+DYNAMIC_BG_COLUMNS = ['new_price', 'name', 'no_hh_agents', 'population', 'average_income', 'avg_hh_size', 'pop_density', 'occupied_units',
+                      'available_units', 'demand_exceeds_supply', 'average_income_norm', 'new_units_constructed']  # block group columns updated during the simulation
+DEMAND_STATE_YEARS = 64  # number of recent years of demand states kept in the block group demand bitmasks (bits of a uint64)
+
 class ABMLandscape(Network):
     """The ABMLandscape class.
 
@@ -18,6 +26,23 @@ class ABMLandscape(Network):
 
         |  *unassigned_hhs* (list / HHAgent) - list of HHAgent objects that are waiting to be assigned
         |  *available_units* (list / str) - list of available units labeled by block group name
+        |  *bg_index* (dict {str:int}) - block group row index (row of housing_bg_df / position in nodes) keyed on block group name
+        |  *hh_table* (AgentTable) - columnar store of household agent attributes (HHAgent objects are views over its rows)
+        |  *bg_static_df* (GeoDataFrame) - static block group columns (geometry, census and hedonic attributes), built once
+        |      (a DataFrame without geometry in headless runs, see ICOMSimulator.set_landscape)
+        |  *bg_dynamic* (dict {str:array}) - block group columns updated during the simulation (in block group row order)
+        |  *housing_bg_df* (GeoDataFrame) - static and dynamic block group columns joined (built lazily on access and
+        |      cached until a dynamic column changes)
+        |  *bg_history* (ColumnHistory) - dynamic block group columns recorded every year (get_history('housing_bg_df')[t]
+        |      materializes the dataframe of year t on demand)
+        |  *node_history* (ColumnHistory) - block group node properties recorded every year (BlockGroup.get_history)
+        |  *bg_aggregates* (dict {str:array}) - running block group sums of resident agents (in block group row order),
+        |      updated whenever agents are placed in or vacate a block group (see place_agents / vacate_agents)
+        |  *demand_state* (array / uint64) - bitmask of recent demand_exceeds_supply flags of each block group (bit 0 is
+        |      the last recorded year), independent of history recording (see record_demand_state / recent_demand)
+        |  *demand_state_years* (int) - number of years in the demand bitmasks (at most DEMAND_STATE_YEARS)
+        |  *move_log* (MoveEventLog) - append-only log of household agent moves (see log_moves), from which agent
+        |      locations at any year can be reconstructed
 
     """
     def __init__(self, name, **kwargs):
@@ -28,13 +53,375 @@ class ABMLandscape(Network):
         self.available_units_list = []  # list of available units (long list, do not include as property to save memory)
         self.avg_hh_income = 0
         self.avg_hh_size = 0
+        self.bg_index = {}  # block group row index keyed on block group name (set when the landscape is created)
+        self._bg_utility_cache = {}  # block group utility arrays keyed on (house_choice_mode, coefficients)
+        self.affordability_indices = {}  # price-sorted AffordabilityIndex objects keyed on name (built on first use by the housing search)
+        self.hh_table = AgentTable()  # columnar household agent attributes (one row per HHAgent)
+        self.reset_bg_aggregates()
+        self.housing_bg_df = None  # static block group dataframe and dynamic columns (set when the landscape is created)
+        self.bg_history = None  # yearly dynamic block group columns (years x block groups matrices)
+        self.node_history = None  # yearly block group node properties (years x block groups matrices)
+        self.move_log = MoveEventLog()  # household agent moves (file-backed if a history directory is provided)
+        self.demand_state = None  # recent demand_exceeds_supply flags of each block group (allocated when the first year is recorded)
+        self.demand_state_years = 0
 
     _properties = {
         'total_population': 0,
         'avg_hh_income': 0,
         'avg_hh_size': 0,
-        'housing_bg_df': None,  # Currently stores bg dataframe, note history record will correspond to bg status at the beginning of the time period/year
-    }
+    }  # JY housing_bg_df is recorded in the columnar bg_history rather than as a pynsim property (see post_process / get_history)
+
+    def calc_bg_utility(self, house_choice_mode, simple_anova_coefficients):
+        """Calculates the utility of every block group (in block group row order) for the specified location choice
+        model. Use get_bg_utility to avoid recalculating utilities that do not change between years.
+
+        **Args**:
+        house_choice_mode (str): location choice model (cobb_douglas_utility, simple_flood_utility, simple_avoidance_utility, budget_reduction)
+        simple_anova_coefficients (list): coefficients for simple anova experiment [intercept, sqfeet, age, stories, baths, flood]
+        """
+        bg_df = self.housing_bg_df
+        if house_choice_mode == 'cobb_douglas_utility':
+            a = 0.4  # JY revise - only need this for Cobb-Douglas
+            b = 0.4
+            c = 0.2
+            utility = (bg_df['average_income_norm'] ** a) * (bg_df['prox_cbd_norm'] ** b) * (bg_df['flood_risk_norm'] ** c)
+        elif house_choice_mode == 'simple_flood_utility':
+            utility = (simple_anova_coefficients[0]) + (simple_anova_coefficients[1] * bg_df['N_MeanSqfeet']) + (simple_anova_coefficients[2] * bg_df['N_MeanAge']) \
+                      + (simple_anova_coefficients[3] * bg_df['N_MeanNoOfStories']) + (simple_anova_coefficients[4] * bg_df['N_MeanFullBathNumber']) \
+                      + (simple_anova_coefficients[5] * bg_df['N_perc_area_flood']) + (1 * bg_df['residuals'])  # JY temp change N_perc_area_flood to perc_fld_area
+        elif house_choice_mode == 'simple_avoidance_utility' or house_choice_mode == 'budget_reduction':
+            utility = (simple_anova_coefficients[0]) + (simple_anova_coefficients[1] * bg_df['N_MeanSqfeet']) + (simple_anova_coefficients[2] * bg_df['N_MeanAge']) \
+                      + (simple_anova_coefficients[3] * bg_df['N_MeanNoOfStories']) + (simple_anova_coefficients[4] * bg_df['N_MeanFullBathNumber']) \
+                      + (1 * bg_df['residuals'])
+        else:
+            raise ValueError('Unknown house choice mode: ' + str(house_choice_mode))
+        return np.asarray(utility, dtype=float)
+
+    def get_bg_utility(self, house_choice_mode, simple_anova_coefficients):
+        """Returns the utility of every block group (in block group row order). Utilities of the simple anova modes only
+        depend on static hedonic columns and the coefficients, so they are cached and only recalculated when the
+        coefficients change or a source column is updated through update_bg_column (or invalidate_bg_utility is called).
+        Cobb-Douglas utilities depend on current block group incomes and are always recalculated.
+        """
+        if house_choice_mode not in CACHED_UTILITY_MODES:
+            return self.calc_bg_utility(house_choice_mode, simple_anova_coefficients)
+        key = (house_choice_mode, tuple(simple_anova_coefficients))
+        if key not in self._bg_utility_cache:
+            self._bg_utility_cache[key] = self.calc_bg_utility(house_choice_mode, simple_anova_coefficients)
+        return self._bg_utility_cache[key]
+
+    def invalidate_bg_utility(self):
+        """Clears all cached block group utilities (call after modifying a utility source column in place)"""
+        self._bg_utility_cache = {}
+
+    @property
+    def housing_bg_df(self):
+        """Block group dataframe: the static block group dataframe joined with the dynamic columns. The join is built on
+        first access and cached until a dynamic column changes; the static columns (including geometry) are shared with
+        bg_static_df rather than copied.
+        """
+        if self._housing_bg_view is None and self.bg_static_df is not None:
+            view = self.bg_static_df.copy(deep=False)
+            for column, values in self.bg_dynamic.items():
+                view[column] = values.copy()  # copy so in-place updates of the dynamic columns do not change earlier views (history)
+            self._housing_bg_view = view
+        return self._housing_bg_view
+
+    @housing_bg_df.setter
+    def housing_bg_df(self, bg_df):
+        """Splits a block group dataframe (in block group row order) into the static dataframe and dynamic columns
+        """
+        self._housing_bg_view = None
+        if bg_df is None:
+            self.bg_static_df = None
+            self.bg_dynamic = {}
+            return
+        bg_df = bg_df.reset_index(drop=True)
+        dynamic_columns = [column for column in bg_df.columns if column in DYNAMIC_BG_COLUMNS]
+        self.bg_static_df = bg_df.drop(columns=dynamic_columns)
+        self.bg_dynamic = {column: bg_df[column].to_numpy(copy=True) for column in dynamic_columns}
+
+    def get_bg_column(self, column):
+        """Returns the values of a block group column (in block group row order) without joining the dataframe
+        """
+        if column in self.bg_dynamic:
+            return self.bg_dynamic[column]
+        return self.bg_static_df[column].values
+
+    def set_bg_values(self, column, bg_rows, values):
+        """Updates a dynamic block group column in place for the given block group rows (a new column is created with
+        missing values for the other block groups)
+        """
+        if column not in self.bg_dynamic:
+            self.bg_dynamic[column] = np.full(len(self.bg_static_df), nan)
+        if len(bg_rows) > 0:
+            self.bg_dynamic[column][np.asarray(bg_rows, dtype=np.int64)] = values
+        self._housing_bg_view = None
+
+    def update_bg_column(self, column, values):
+        """Updates a column of the block group dataframe (values in block group row order), invalidating cached
+        utilities if the column is used by the utility functions. Columns of the static dataframe are replaced (earlier
+        views keep the previous values), other columns are stored as dynamic columns.
+        """
+        if column in self.bg_static_df.columns:
+            self.bg_static_df[column] = values
+        else:
+            self.bg_dynamic[column] = np.array(values)
+        self._housing_bg_view = None
+        if column in UTILITY_SOURCE_COLUMNS:
+            self.invalidate_bg_utility()
+
+    def get_affordability_index(self, name, members=None):
+        """Returns the affordability index (block groups sorted by price) with the given name, building it from the
+        current block group prices and available units on first use. The index is then kept in sync by
+        update_affordability_prices and adjust_available_units, so sampling never rebuilds the weights.
+
+        **Args**:
+        name (str): name of the index
+        members (array / bool): block groups included in the index (all block groups if None)
+        """
+        if name not in self.affordability_indices:
+            available_units = np.fromiter((bg.available_units for bg in self.nodes), dtype=float, count=len(self.nodes))
+            self.affordability_indices[name] = AffordabilityIndex(self.get_bg_column('new_price'), available_units, members)
+        return self.affordability_indices[name]
+
+    def adjust_available_units(self, bg, delta):
+        """Adds delta available units to a block group node and keeps the affordability index samplers in sync (all
+        changes to available units during the simulation should go through this method or set_available_units)
+
+        **Args**:
+        bg (BlockGroup): block group node
+        delta (int): change in available units
+        """
+        bg.available_units += delta
+        bg_row = self.bg_index[bg.name]
+        for index in self.affordability_indices.values():
+            index.add_units(bg_row, delta)
+
+    def adjust_available_units_rows(self, bg_rows, deltas):
+        """Adds available units to several block groups (bg rows, one delta per block group) and keeps the affordability
+        index samplers in sync (see adjust_available_units)
+        """
+        for bg_row, delta in zip(bg_rows, deltas):
+            self.nodes[bg_row].available_units += delta
+            for index in self.affordability_indices.values():
+                index.add_units(bg_row, delta)
+
+    def get_node_values(self, attr, dtype=float):
+        """Returns an attribute of every block group node as an array (in block group row order)
+        """
+        return np.fromiter((getattr(bg, attr) for bg in self.nodes), dtype=dtype, count=len(self.nodes))
+
+    def set_available_units(self, bg, available_units):
+        """Sets the available units of a block group node (see adjust_available_units)
+        """
+        self.adjust_available_units(bg, available_units - bg.available_units)
+
+    def update_affordability_prices(self, bg_rows, new_prices):
+        """Moves block groups with new prices to their new position in each affordability index (in place)
+
+        **Args**:
+        bg_rows (list / int): block group row indices
+        new_prices (list / float): new price of each block group
+        """
+        for index in self.affordability_indices.values():
+            index.update_prices(bg_rows, new_prices)
+
+    def reset_bg_aggregates(self):
+        """Resets the running block group aggregates of resident agents (agent count, income and household size sums and
+        counts of missing values, population of agents with a valid household size and number of households with a
+        missing household size) to zero for every block group node
+        """
+        no_bgs = len(self.nodes)
+        self.bg_aggregates = {
+            'agent_count': np.zeros(no_bgs, dtype=np.int64),
+            'income_sum': np.zeros(no_bgs),
+            'income_nan_count': np.zeros(no_bgs, dtype=np.int64),
+            'hh_size_sum': np.zeros(no_bgs),
+            'hh_size_nan_count': np.zeros(no_bgs, dtype=np.int64),
+            'population': np.zeros(no_bgs),
+            'hhs_without_size': np.zeros(no_bgs),
+        }
+
+    def _update_bg_aggregates(self, agent_rows, bg_rows, sign):
+        agent_rows = np.asarray(agent_rows, dtype=np.int64)
+        bg_rows = np.asarray(bg_rows, dtype=np.int64)
+        income = self.hh_table.column('income')[agent_rows]
+        hh_size = self.hh_table.column('hh_size')[agent_rows]
+        no_hhs = self.hh_table.column('no_hhs_per_agent')[agent_rows]
+        valid_income = np.isfinite(income)
+        valid_size = np.isfinite(hh_size)
+        aggregates = self.bg_aggregates
+        np.add.at(aggregates['agent_count'], bg_rows, sign)
+        np.add.at(aggregates['income_sum'], bg_rows[valid_income], sign * income[valid_income])
+        np.add.at(aggregates['income_nan_count'], bg_rows[~valid_income], sign)
+        np.add.at(aggregates['hh_size_sum'], bg_rows[valid_size], sign * hh_size[valid_size])
+        np.add.at(aggregates['hh_size_nan_count'], bg_rows[~valid_size], sign)
+        np.add.at(aggregates['population'], bg_rows[valid_size], sign * no_hhs[valid_size] * hh_size[valid_size])
+        np.add.at(aggregates['hhs_without_size'], bg_rows[~valid_size], sign * no_hhs[~valid_size])
+
+    def place_agents(self, agents, bg_rows):
+        """Adds household agents to the hh_agents of their block groups (bg rows) and to the running block group
+        aggregates. Does not change occupied / available units or agent locations.
+        """
+        for agent, bg_row in zip(agents, bg_rows):
+            self.nodes[bg_row].hh_agents[agent.name] = agent
+        self._update_bg_aggregates(self.hh_table.rows_of(agents), bg_rows, 1)
+
+    def vacate_agents(self, agents):
+        """Removes household agents from the hh_agents of the block groups they currently reside in (their location) and
+        from the running block group aggregates. Does not change occupied / available units or agent locations.
+        """
+        agent_rows = self.hh_table.rows_of(agents)
+        bg_rows = self.hh_table.column('location')[agent_rows]  # location codes are block group rows
+        for agent, bg_row in zip(agents, bg_rows):
+            del self.nodes[bg_row].hh_agents[agent.name]
+        self._update_bg_aggregates(agent_rows, bg_rows, -1)
+
+    def log_moves(self, agents, to_bgs, reason, year=None):
+        """Appends household agent moves to the move log, from the agents' current locations to to_bgs (location codes,
+        a single code or one per agent). Must be called before the agents' locations are changed. Moves that do not change
+        an agent's location are not logged, except for re-locating agents (who keep their old location while in the
+        re-location queue and may be matched with the same block group).
+
+        **Args**:
+        agents (list / HHAgent): household agents that move
+        to_bgs (int or array): destination location codes (block group rows, UNASSIGNED or OUTMIGRATED)
+        reason (int or array): move reason (MOVE_* constants of model_classes.move_log)
+        year (int): year of the moves (defaults to the current timestep)
+        """
+        if len(agents) == 0:
+            return
+        if year is None:
+            year = self.current_timestep.year
+        agent_rows = self.hh_table.rows_of(agents)
+        from_bgs = self.hh_table.column('location')[agent_rows]
+        to_bgs = np.broadcast_to(to_bgs, agent_rows.shape)
+        reason = np.broadcast_to(reason, agent_rows.shape)
+        moved = (from_bgs != to_bgs) | (self.hh_table.column('status')[agent_rows] == STATUS_RELOCATING)
+        self.move_log.append(year, agent_rows[moved], from_bgs[moved], to_bgs[moved], reason[moved])
+
+    def get_locations(self, year=None):
+        """Returns the block group name (or None / 'outmigrated') of every household agent (in agent table row order)
+        at the end of a year (None for the last recorded year), reconstructed from the move log
+        """
+        codes = self.move_log.locations_at(len(self.hh_table), year=year)
+        names = np.array(list(self.hh_table.bg_names) + ['outmigrated', None], dtype=object)  # codes -2 and -1 index from the end
+        return names[codes]
+
+    def record_demand_state(self):
+        """Shifts the year's demand_exceeds_supply flag of every block group into the demand bitmasks (flags older than
+        DEMAND_STATE_YEARS years drop out)
+        """
+        demand = self.get_node_values('demand_exceeds_supply', dtype=bool)
+        if self.demand_state is None or len(self.demand_state) != len(demand):
+            self.demand_state = np.zeros(len(demand), dtype=np.uint64)
+            self.demand_state_years = 0
+        self.demand_state = (self.demand_state << np.uint64(1)) | demand.astype(np.uint64)
+        self.demand_state_years = min(self.demand_state_years + 1, DEMAND_STATE_YEARS)
+
+    def recent_demand(self, lookback):
+        """Returns whether demand exceeded supply in each block group in any of the last lookback recorded years (bool
+        array in block group row order)
+
+        **Args**:
+        lookback (int): number of years (at most DEMAND_STATE_YEARS)
+        """
+        if lookback > DEMAND_STATE_YEARS:
+            raise ValueError('demand states are kept for ' + str(DEMAND_STATE_YEARS) + ' years, lookback is ' + str(lookback))
+        if self.demand_state is None:
+            return np.zeros(len(self.nodes), dtype=bool)
+        mask = np.uint64(np.iinfo(np.uint64).max >> (DEMAND_STATE_YEARS - lookback)) if lookback > 0 else np.uint64(0)
+        return (self.demand_state & mask) != 0
+
+    def publish_bg_statistics(self):
+        """Publishes the block group statistics (population, agent counts, average income and household size, population
+        density) from the running aggregates to the block group nodes and the dynamic block group columns, and updates the landscape
+        totals. Block groups without resident agents have missing (nan) averages.
+        """
+        aggregates = self.bg_aggregates
+        agent_count = aggregates['agent_count']
+        occupied = agent_count > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            average_income = np.where(occupied & (aggregates['income_nan_count'] == 0), aggregates['income_sum'] / agent_count, nan)
+            avg_hh_size = np.where(occupied & (aggregates['hh_size_nan_count'] == 0), aggregates['hh_size_sum'] / agent_count, nan)
+        population = np.where(aggregates['hh_size_nan_count'] == 0, aggregates['population'], nan)  # agents without a household size have no population in their block group
+        area = np.fromiter((bg.area for bg in self.nodes), dtype=float, count=len(self.nodes))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pop_density = population / area
+
+        # landscape totals (agents without a household size are assumed to have the mean 1990 household size)
+        self.total_population = float(aggregates['population'].sum() + aggregates['hhs_without_size'].sum() * np.nanmean(self.get_bg_column('hhsize1990')))
+        no_agents = agent_count.sum()
+        self.avg_hh_income = float(aggregates['income_sum'].sum() / no_agents) if aggregates['income_nan_count'].sum() == 0 else nan
+        self.avg_hh_size = float(aggregates['hh_size_sum'].sum() / no_agents) if aggregates['hh_size_nan_count'].sum() == 0 else nan
+
+        for i, bg in enumerate(self.nodes):
+            bg.population = population[i]
+            bg.no_of_hhs = int(agent_count[i])
+            bg.avg_hh_income = average_income[i]  # update attribute on block group
+            bg.avg_hh_size = avg_hh_size[i]  # update attribute on block group
+            bg.pop_density = pop_density[i]
+
+        # update the dynamic block group columns in place (the static columns and geometry are not copied)
+        bg_statistics = {
+            'name': np.array([bg.name for bg in self.nodes], dtype=object),
+            'no_hh_agents': agent_count.copy(),
+            'population': population,
+            'average_income': average_income,
+            'avg_hh_size': avg_hh_size,
+            'pop_density': pop_density,
+            'occupied_units': np.array([bg.occupied_units for bg in self.nodes]),
+            'available_units': np.array([bg.available_units for bg in self.nodes]),
+            'demand_exceeds_supply': np.array([bg.demand_exceeds_supply for bg in self.nodes], dtype=bool),
+        }
+
+        # calculate normalized statistics for block groups
+        bg_statistics['average_income_norm'] = average_income / np.nanmax(average_income) if np.isfinite(average_income).any() else average_income
+
+        self.bg_dynamic.update(bg_statistics)
+        self._housing_bg_view = None
+
+    def init_history_store(self, no_years, history_dir=None):
+        """Preallocates the block group history matrices for no_years years (they grow if the simulation runs longer).
+        If history_dir is provided, the move log is also written to history_dir/moves.bin.
+
+        **Args**:
+        no_years (int): number of years (timesteps) that will be recorded
+        history_dir (str): directory for memory-mapped history files (None to keep the history in memory)
+        """
+        self.bg_history = ColumnHistory(len(self.nodes), capacity=no_years,
+                                        history_dir=None if history_dir is None else os.path.join(history_dir, 'housing_bg_df'))
+        self.node_history = ColumnHistory(len(self.nodes), capacity=no_years,
+                                          history_dir=None if history_dir is None else os.path.join(history_dir, 'nodes'))
+        if history_dir is not None:
+            self.move_log = MoveEventLog(log_file=os.path.join(history_dir, 'moves.bin'))
+
+    def post_process(self):
+        """Records the year's demand states, records the dynamic block group columns and block group node properties of
+        the year in the columnar history stores and flushes the move log, then records the landscape properties (and calls post_process of all other components)
+        """
+        self.record_demand_state()
+        if self.bg_history is None:
+            self.init_history_store(1)
+        self.move_log.flush()
+        self.bg_history.record(self.bg_dynamic)
+        self.node_history.record({k: [getattr(bg, k) for bg in self.nodes] for k in BlockGroup._properties})
+        super(ABMLandscape, self).post_process()
+
+    def get_history(self, attr_name=None):
+        """Returns the history of a landscape property. The history of housing_bg_df is a sequence of dataframes (one
+        per year) joined from the static dataframe and the recorded dynamic columns on access.
+        """
+        if attr_name == 'housing_bg_df':
+            if self.bg_history is None:
+                return []
+            return FrameHistory(self.bg_static_df, self.bg_history)
+        history = super(ABMLandscape, self).get_history(attr_name)
+        if attr_name is None:
+            history = dict(history)
+            history['housing_bg_df'] = self.get_history('housing_bg_df')
+        return history
 
     def setup(self, timestep):
         logging.info('Starting model year: ' + str(self.current_timestep.year))
@@ -44,77 +431,7 @@ class ABMLandscape(Network):
         self.available_units_list = []
 
         if self.current_timestep_idx == 0:  # For first timestep, load housing_bg_df based upon initial agent population
-            # reset population sums
-            self.total_population = 0
-
-            # calculate various statistics (landscape level) from hh agents
-            incomes_landscape = []
-            hh_size_landscape = []
-
-            # update master block group pandas dataframe (JY Add engine so this takes place at end of timestep rather than at beginning of next timestep)
-            rows_list = []  # first load dictionary for each row into a list, then create the dataframe from the dictionary (much faster!)
-            for bg in self.nodes:
-                bg_dict = {}
-                bg_dict['name'] = bg.name
-                bg_dict['no_hh_agents'] = len(bg.hh_agents)
-
-                # calculate various statistics (block level) from hh agents
-                bg.population = 0
-                incomes_bg = []
-                hh_size_bg = []
-                bg.no_of_hhs = len(bg.hh_agents)
-
-
-                for name, a in bg.hh_agents.items():
-                    if np.isfinite(a.hh_size) or a.hh_size == 0:  # accounts for 0 or nan hh_size values
-                        self.total_population += a.no_hhs_per_agent * a.hh_size
-                    else:  # use mean
-                        self.total_population += a.no_hhs_per_agent * self.housing_bg_df.hhsize1990.mean()
-                    bg.population += a.no_hhs_per_agent * a.hh_size
-                    incomes_bg.append(a.income)
-                    incomes_landscape.append(a.income)
-                    hh_size_bg.append(a.hh_size)
-                    hh_size_landscape.append(a.hh_size)
-
-                bg_dict['population'] = bg.population
-                if not incomes_bg:  # i.e. no households reside in block group
-                    bg_dict['average_income'] = nan
-                    bg.mean_hh_income = nan  # update attribute on block group
-                else:
-                    bg_dict['average_income'] = statistics.mean(incomes_bg)
-                    bg.avg_hh_income = statistics.mean(incomes_bg)  # update attribute on block group
-                if not hh_size_bg:
-                    bg_dict['avg_hh_size'] = nan
-                    bg.avg_hh_size = nan  # update attribute on block group
-                else:
-                    bg_dict['avg_hh_size'] = statistics.mean(hh_size_bg)
-                    bg.avg_hh_size = statistics.mean(hh_size_bg)  # update attribute on block group
-
-                # pop density calc
-                bg_dict['pop_density'] = bg.population / bg.area
-                bg.pop_density = bg.population / bg.area
-
-                #  occupied units calc
-                bg_dict['occupied_units'] = bg.occupied_units
-
-                # available units calc
-                bg_dict['available_units'] = bg.available_units
-
-                # supply exceeds demand
-                bg_dict['demand_exceeds_supply'] = bg.demand_exceeds_supply
-
-                rows_list.append(bg_dict)
-
-            housing_current_df = pd.DataFrame(rows_list)
-            self.avg_hh_income = statistics.mean(incomes_landscape)
-            self.avg_hh_size = statistics.mean(hh_size_landscape)
-
-            # calculate normalized statistics for block groups
-            housing_current_df['average_income_norm'] = housing_current_df['average_income'] / housing_current_df['average_income'].max()
-
-            # merge with housing_bg_df to retain geometry features
-            cols_to_use = self.housing_bg_df.columns.difference(housing_current_df.columns)
-            self.housing_bg_df = pd.merge(self.housing_bg_df[cols_to_use], housing_current_df, how='left',left_on='GEOID', right_on='name')
+            self.publish_bg_statistics()  # (JY Add engine so this takes place at end of timestep rather than at beginning of next timestep)
 
             pass  # added to allow for debugger
 
@@ -129,7 +446,7 @@ class BlockGroup(Node):
 
         |  *hh_agents* (list) - list of HHAgent objects that reside in block group
         |  *distance_to_cbd* (list) - distance to central business district
-        |  *geometry* (shapely multipolygon object) - shapely multipolygon object (for spatial calculations)
+        |  *geometry* (shapely multipolygon object) - shapely multipolygon object (for spatial calculations; None in headless runs)
 
     **Properties**:
 
@@ -198,6 +515,25 @@ class BlockGroup(Node):
         'new_units_constructed': 0,
     }
 
+    def post_process(self):
+        # node properties are recorded by the landscape in its columnar node_history
+        if getattr(self.network, 'node_history', None) is None:
+            super(BlockGroup, self).post_process()
+
+    def get_history(self, attr_name=None):
+        """Returns the yearly values of a property (or a dictionary of all properties) of the block group from the
+        landscape's columnar node_history
+        """
+        node_history = getattr(self.network, 'node_history', None)
+        if node_history is None:
+            return super(BlockGroup, self).get_history(attr_name)
+        bg_row = self.network.bg_index[self.name]
+        if attr_name is None:
+            return {k: self.get_history(k) for k in self._properties}
+        if attr_name not in node_history.matrices:
+            return [] if attr_name in self._properties else None
+        return node_history.column(attr_name)[:, bg_row].tolist()
+
     def setup(self, timestep):
         # Note: block group population statistics are updated in the landscape's setup method
         # calculate various block group level statistics based on hh agent population at beginning of each timestep
@@ -0,0 +1,185 @@
+import hashlib
+import importlib.util
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+# geopandas and shapely are imported by the functions that use them (compiling a landscape, reading a GeoParquet
+# table), so a headless run that loads a compiled landscape does not import them
+
+TABLE_FORMAT = 'parquet' if importlib.util.find_spec('pyarrow') is not None else 'pkl'  # (Geo)Parquet tables require pyarrow (optional, tables are pickled without it)
+
+LANDSCAPE_CACHE_VERSION = 3  # increase when compile_landscape changes, so that stale compiled landscapes are not loaded
+SHAPEFILE_SIDECARS = ['.shx', '.dbf', '.prj', '.cpg']  # files read with a shapefile (part of its cache key)
+GAP_FILL_COLUMNS = ['salesprice1993', 'N_MeanSqfeet', 'N_MeanAge', 'N_MeanNoOfStories', 'N_MeanFullBathNumber', 'N_perc_area_flood',
+                    'residuals', 'salespricesf1993']  # columns copied from the nearest block group with data
+
+
+def nearest_rows(geometries, donor_geometries):
+    """Returns the position of the nearest donor geometry (polygon distance) of each geometry, from a single query of
+    an STRtree built over the donor geometries. Of several equally near donors (e.g., adjacent polygons at distance 0),
+    the donor with the nearest centroid is used (then the first donor), so the result does not depend on the tree.
+    """
+    import shapely
+    tree = shapely.STRtree(donor_geometries)
+    geometry_positions, donor_positions = tree.query_nearest(geometries, all_matches=True)  # all equally near donors
+    centroid_distance = shapely.distance(shapely.centroid(geometries[geometry_positions]), shapely.centroid(donor_geometries[donor_positions]))
+    order = np.lexsort((donor_positions, centroid_distance, geometry_positions))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = geometry_positions[order][1:] != geometry_positions[order][:-1]
+    nearest = np.empty(len(geometries), dtype=np.int64)
+    nearest[geometry_positions[order][first]] = donor_positions[order][first]
+    return nearest
+
+
+def compile_landscape(data_dir, geo_filename, pop_filename, pop_fieldname, flood_filename, housing_filename, hedonic_filename):
+    """Reads the census / housing / flood / hedonic inputs and compiles the block group table of the landscape (the
+    joins, normalized values and nearest neighbor gap filling of ICOMSimulator.set_landscape) and the node attributes
+    that are not columns of the table (block group centroids).
+
+    **Returns**:
+    (GeoDataFrame, dict {str:array}) block group table (rows indexed 0..n-1, in node order) and node attribute arrays
+    """
+    import geopandas as gpd
+    import shapely
+    bg = gpd.read_file(os.path.join(data_dir, geo_filename))
+    pop = pd.read_csv(os.path.join(data_dir, pop_filename))
+    flood = pd.read_csv(os.path.join(data_dir, flood_filename))
+    housing = pd.read_csv(os.path.join(data_dir, housing_filename))
+    hedonic = pd.read_csv(os.path.join(data_dir, hedonic_filename))
+
+    # join census/population data to block groups
+    bg = pd.merge(bg, pop[['GISJOIN', pop_fieldname]], how='left', on='GISJOIN')
+    bg = pd.merge(bg, flood[['GISJOIN', 'perc_fld_area']], how='left', on='GISJOIN')
+    bg['perc_fld_area'] = bg['perc_fld_area'].fillna(0)
+    bg = pd.merge(bg, housing, how='left', on='GISJOIN')
+
+    # load table with hedonic regression information for utility function
+    bg = pd.merge(bg, hedonic[['GISJOIN', 'N_MeanSqfeet', 'N_MeanAge', 'N_MeanNoOfStories','N_MeanFullBathNumber','N_perc_area_flood','residuals']], how='left', on='GISJOIN')
+
+    # determine relative cbd proximity and relative flood risk for input to hh utility calcs (JY consider moving into an if statement so only loads with specified utility formulation)
+    bg['rel_prox_cbd'] = bg['cbddist'].max() + 1 - bg['cbddist']
+    bg['rel_flood_risk'] = bg['perc_fld_area'].max() + 1 - bg['perc_fld_area']
+
+    # calculate normalized values for cbd proximity and flood risk
+    bg['prox_cbd_norm'] = bg['rel_prox_cbd'] / bg['rel_prox_cbd'].max()
+    bg['flood_risk_norm'] = bg['rel_flood_risk'] / bg['rel_flood_risk'].max()
+
+    # calculate housing budget based on 1990-1993 data
+    bg['housing_budget_perc'] = bg['mhi1990'] / bg['salesprice1993']
+
+    # replace 0 mhi1990 values with non-zero minimum
+    non_zero_min = bg[(bg.mhi1990 > 0)].mhi1990.min()
+    bg.loc[bg['mhi1990'] == 0, 'mhi1990'] = non_zero_min
+
+    # JY fill in missing sales price and hedonic regression values with nearest neighbor values that have data: the
+    # nearest block group with data (polygon distance) of every block group with missing values is found with a single
+    # query of a spatial index (STRtree) of the block groups with data, and the values are gathered for all of them at once
+    missing = (np.isnan(bg['salesprice1993']) | np.isnan(bg['N_MeanSqfeet'])).values
+    if missing.any():
+        donors = np.flatnonzero(np.isfinite(bg['salesprice1993']).values & np.isfinite(bg['N_MeanSqfeet']).values)
+        nearest_donors = nearest_rows(np.asarray(bg.geometry.values)[missing], np.asarray(bg.geometry.values)[donors])
+        bg.loc[missing, GAP_FILL_COLUMNS] = bg[GAP_FILL_COLUMNS].values[donors[nearest_donors]]
+
+    # initialize new price for updating
+    bg['new_price'] = bg['salesprice1993']
+
+    # block group rows are indexed 0..n-1 (in the same order as the network nodes) so they can be accessed by block group row index
+    bg = bg.reset_index(drop=True)
+
+    centroids = shapely.centroid(np.asarray(bg.geometry.values))  # block group node coordinates
+    node_arrays = {'x': shapely.get_x(centroids), 'y': shapely.get_y(centroids)}
+    return bg, node_arrays
+
+
+def input_filenames(data_dir, geo_filename, pop_filename, flood_filename, housing_filename, hedonic_filename):
+    """Returns the paths of all files read by compile_landscape (including the sidecar files of a shapefile)
+    """
+    filenames = [os.path.join(data_dir, filename) for filename in [geo_filename, pop_filename, flood_filename, housing_filename, hedonic_filename]]
+    stem, extension = os.path.splitext(filenames[0])
+    if extension.lower() == '.shp':
+        filenames += [stem + sidecar for sidecar in SHAPEFILE_SIDECARS if os.path.exists(stem + sidecar)]
+    return filenames
+
+
+def landscape_cache_key(filenames, parameters):
+    """Returns the cache key of a compiled landscape: a SHA-256 hash of the contents of the input files, the compile
+    parameters and the cache version (so a compiled landscape is only reused for identical inputs)
+
+    **Args**:
+    filenames (list): paths of the input files
+    parameters (dict): other compile parameters (e.g., the population field name)
+    """
+    h = hashlib.sha256()
+    h.update(('version=' + str(LANDSCAPE_CACHE_VERSION) + ';').encode())
+    for name in sorted(parameters):
+        h.update((name + '=' + str(parameters[name]) + ';').encode())
+    for filename in filenames:
+        h.update((os.path.basename(filename) + ';').encode())
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def headless_table(bg):
+    """Returns the block group table without geometry (a DataFrame, see ICOMSimulator.set_landscape)
+    """
+    if 'geometry' not in bg.columns:
+        return bg
+    return pd.DataFrame(bg.drop(columns=['geometry']))
+
+
+def _cache_filenames(cache_dir, key):
+    stem = os.path.join(cache_dir, 'landscape_' + key)
+    return stem + '.' + TABLE_FORMAT, stem + '_headless.' + TABLE_FORMAT, stem + '.npz'
+
+
+def save_compiled_landscape(cache_dir, key, bg, node_arrays):
+    """Writes a compiled landscape (block group table, the table without geometry for headless runs and node attribute
+    arrays) to cache_dir. Files are written to a temporary name and then renamed, and the table is written last (it
+    marks a complete entry), so concurrent runs (e.g., the tasks of a Slurm array) never load a partial entry.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    table_filename, headless_filename, arrays_filename = _cache_filenames(cache_dir, key)
+    temp_suffix = '.tmp' + str(os.getpid())
+    with open(arrays_filename + temp_suffix, 'wb') as f:
+        np.savez(f, **node_arrays)
+    os.replace(arrays_filename + temp_suffix, arrays_filename)
+    for filename, table in [(headless_filename, headless_table(bg)), (table_filename, bg)]:
+        if TABLE_FORMAT == 'parquet':
+            table.to_parquet(filename + temp_suffix)
+        else:
+            table.to_pickle(filename + temp_suffix)
+        os.replace(filename + temp_suffix, filename)
+    logging.info("Compiled landscape written to " + table_filename)
+
+
+def load_compiled_landscape(cache_dir, key, headless=False):
+    """Reads a compiled landscape from cache_dir (the table without geometry if headless, which does not import
+    geopandas or shapely)
+
+    **Returns**:
+    (GeoDataFrame / DataFrame, dict {str:array}) block group table and node attribute arrays, or None if there is no
+    (readable) compiled landscape for the key
+    """
+    table_filename, headless_filename, arrays_filename = _cache_filenames(cache_dir, key)
+    if not os.path.exists(table_filename):
+        return None
+    filename = headless_filename if headless else table_filename
+    try:
+        if TABLE_FORMAT == 'parquet' and not headless:
+            import geopandas as gpd
+            bg = gpd.read_parquet(filename)
+        elif TABLE_FORMAT == 'parquet':
+            bg = pd.read_parquet(filename)
+        else:
+            bg = pd.read_pickle(filename)
+        with np.load(arrays_filename) as arrays:
+            node_arrays = {name: arrays[name] for name in arrays.files}
+    except Exception as e:  # e.g., written by incompatible library versions, recompile
+        logging.info("Compiled landscape " + filename + " could not be read (" + str(e) + ")")
+        return None
+    logging.info("Compiled landscape read from " + filename)
+    return bg, node_arrays
@@ -0,0 +1,130 @@
+import numpy as np
+import os
+from model_classes.column_tables import UNASSIGNED
+
+MOVE_EVENT_DTYPE = np.dtype([('year', np.int32), ('agent', np.int64), ('from_bg', np.int32), ('to_bg', np.int32), ('reason', np.int8)])
+
+MOVE_INITIAL = 0  # agent of the initial population placed in its block group
+MOVE_SETTLED = 1  # new agent located by the housing market
+MOVE_VACATED = 2  # existing agent left its home to re-locate (to the re-location queue)
+MOVE_RELOCATED = 3  # re-locating agent located by the housing market
+MOVE_OUTMIGRATED = 4  # agent migrated outside of the domain (cannot afford any available homes)
+
+
+class MoveEventLog(object):
+    """The MoveEventLog class.
+
+    An append-only log of household agent moves: one (year, agent, from_bg, to_bg, reason) record of MOVE_EVENT_DTYPE
+    per change of an agent's location. Agents are AgentTable rows and block groups are location codes (block group rows,
+    UNASSIGNED or OUTMIGRATED), so the log grows with the number of moves rather than with agents x years. Events are
+    appended in simulation order, so the location of an agent at the end of a year is the destination of its last event
+    up to that year.
+
+    If log_file is provided, events are appended to the file (raw MOVE_EVENT_DTYPE records) whenever flush is called
+    and only unflushed events are kept in memory; the file can be memory-mapped after a run with MoveEventLog.load.
+
+    **Attributes**:
+
+        |  *log_file* (str) - binary file the events are flushed to (None to keep all events in memory)
+        |  *no_flushed* (int) - number of events written to log_file
+        |  *size* (int) - number of events in the in-memory buffer
+
+    """
+    def __init__(self, capacity=1024, log_file=None):
+        self._buffer = np.zeros(max(int(capacity), 1), dtype=MOVE_EVENT_DTYPE)
+        self.size = 0
+        self.log_file = log_file
+        self.no_flushed = 0
+        if log_file is not None:
+            log_dir = os.path.dirname(log_file)
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)
+            open(log_file, 'wb').close()  # start a new log
+
+    def __len__(self):
+        return self.no_flushed + self.size
+
+    def append(self, year, agents, from_bgs, to_bgs, reason):
+        """Appends one event per agent (arrays of agent rows, origin and destination location codes and reasons, or
+        single values for all agents)
+        """
+        agents = np.asarray(agents, dtype=np.int64)
+        from_bgs = np.broadcast_to(np.asarray(from_bgs, dtype=np.int64), agents.shape)
+        to_bgs = np.broadcast_to(np.asarray(to_bgs, dtype=np.int64), agents.shape)
+        reason = np.broadcast_to(np.asarray(reason, dtype=np.int8), agents.shape)
+        n = len(agents)
+        if self.size + n > len(self._buffer):
+            grown = np.zeros(max(len(self._buffer) * 2, self.size + n), dtype=MOVE_EVENT_DTYPE)
+            grown[:self.size] = self._buffer[:self.size]
+            self._buffer = grown
+        events = self._buffer[self.size:self.size + n]
+        events['year'] = year
+        events['agent'] = agents
+        events['from_bg'] = from_bgs
+        events['to_bg'] = to_bgs
+        events['reason'] = reason
+        self.size += n
+
+    def flush(self):
+        """Appends the buffered events to log_file and clears the buffer (no-op for in-memory logs)
+        """
+        if self.log_file is None or self.size == 0:
+            return
+        with open(self.log_file, 'ab') as f:
+            self._buffer[:self.size].tofile(f)
+        self.no_flushed += self.size
+        self.size = 0
+
+    @staticmethod
+    def load(log_file):
+        """Memory-maps the events of a log file (read-only)
+        """
+        if os.path.getsize(log_file) == 0:
+            return np.zeros(0, dtype=MOVE_EVENT_DTYPE)
+        return np.memmap(log_file, dtype=MOVE_EVENT_DTYPE, mode='r')
+
+    def events(self):
+        """Returns all events in simulation order (flushed events are memory-mapped from log_file)
+        """
+        if self.no_flushed == 0:
+            return self._buffer[:self.size]
+        flushed = self.load(self.log_file)
+        if self.size == 0:
+            return flushed
+        return np.concatenate([flushed, self._buffer[:self.size]])
+
+    def events_since(self, n):
+        """Returns the events appended after the first n events (from the in-memory buffer, the flushed events are only
+        memory-mapped if some of them were appended after the first n)
+        """
+        if n >= self.no_flushed:
+            return self._buffer[n - self.no_flushed:self.size]
+        return np.concatenate([self.load(self.log_file)[n:], self._buffer[:self.size]])
+
+    @staticmethod
+    def _up_to(events, year):
+        if year is None:
+            return events
+        return events[:np.searchsorted(events['year'], year, side='right')]  # events are in year order
+
+    def locations_at(self, no_agents, year=None, events=None):
+        """Reconstructs the location code of agent rows 0..no_agents-1 at the end of a year (None for the last
+        recorded year). Agents without events up to that year are UNASSIGNED.
+        """
+        events = self._up_to(self.events() if events is None else events, year)
+        locations = np.full(no_agents, UNASSIGNED, dtype=np.int64)
+        agents = events['agent'][::-1]  # the last event of each agent is its first occurrence in reverse order
+        unique_agents, last = np.unique(agents, return_index=True)
+        in_range = unique_agents < no_agents
+        locations[unique_agents[in_range]] = events['to_bg'][::-1][last[in_range]]
+        return locations
+
+    def agent_locations(self, agent, years, events=None):
+        """Reconstructs the location code of one agent row at the end of each year in years
+        """
+        events = self.events() if events is None else events
+        agent_events = events[events['agent'] == agent]
+        years = np.asarray(years)
+        last_event = np.searchsorted(agent_events['year'], years, side='right') - 1
+        destinations = np.append(agent_events['to_bg'].astype(np.int64), UNASSIGNED)  # index -1 (no event yet) is UNASSIGNED
+        return destinations[last_event]
@@ -1,16 +1,51 @@
 from pynsim import Simulator
-from model_classes.landscape import ABMLandscape, BlockGroup
-from model_classes.urban_agents import HHAgent
+from model_classes.landscape import ABMLandscape, BlockGroup, CACHED_UTILITY_MODES
+from model_classes.urban_agents import create_agents
+from model_classes.column_tables import UNASSIGNED
+from model_classes.move_log import MOVE_INITIAL, MOVE_OUTMIGRATED
+from model_classes.landscape_cache import compile_landscape, headless_table, input_filenames, landscape_cache_key, load_compiled_landscape, save_compiled_landscape
 import datetime
-import geopandas as gpd
+import sys
+import time
+import json
 import pandas as pd
 import logging
 import numpy as np
+from math import nan
+
+try:
+    import resource  # peak resident set size (unix only)
+except ImportError:
+    resource = None
+
+
+def _peak_rss():
+    """Returns the peak resident set size of the process in kB (None if unavailable)
+    """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak_rss / 1024  # ru_maxrss is in bytes on macOS (kB on linux)
+    return peak_rss
+
 
 class ICOMSimulator(Simulator):
     """An ICOM Simulator class (a child of the pynsim Simulator class)
+
+    If profile is True, each engine's run is wrapped with a profiling hook that records, for every year and engine, the
+    wall and CPU time, the increase of the process's peak resident set size (RSS) and counters (queue sizes, agents
+    added, moves and outmigrations logged, and engine-specific counters returned by an engine's profile_counters method,
+    e.g., housing market rounds). The records are kept in profile_records and can be exported with export_profile.
+
+    Random numbers are drawn from NumPy Generators seeded from a single seed sequence: the simulator's own stream (rng,
+    used to set up the initial population) and one stream spawned for each engine when it is added (engine.rng), in
+    the order engines are added. Runs with the same seed and engine list are reproducible, and an engine can be swapped
+    for an optimized version without changing the random numbers drawn by the other engines. If seed is None, the seed
+    sequence is seeded from fresh OS entropy (seed_sequence.entropy can be used to repeat the run).
     """
-    def __init__(self, network, record_time, progress, max_iterations, name, scenario, intervention, start_year, no_of_years):
+    def __init__(self, network, record_time, progress, max_iterations, name, scenario, intervention, start_year, no_of_years, profile=False,
+                 seed=None):
         super(ICOMSimulator, self).__init__(network, record_time, progress, max_iterations)
         # set simulator characteristics
         self.name = name
@@ -21,6 +56,91 @@ class ICOMSimulator(Simulator):
         self.start_year = start_year
         self.no_of_years = no_of_years
 
+        # engine profiling (see profile_engine)
+        self.profile = profile
+        self.profile_records = []
+
+        # random number streams (see add_engine)
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.seed_sequence.spawn(1)[0])
+        logging.info("Random seed (seed sequence entropy): " + str(self.seed_sequence.entropy))
+
+    def add_engine(self, engine, depends_on=[]):
+        engine.rng = np.random.default_rng(self.seed_sequence.spawn(1)[0])  # engine's own random number stream
+        super(ICOMSimulator, self).add_engine(engine, depends_on=depends_on)
+
+    def start(self, initialise=True):
+        if self.profile:
+            for engine in self.engines:
+                if not hasattr(engine, '_unprofiled_run'):  # wrap each engine once
+                    engine._unprofiled_run = engine.run
+                    engine.run = self._profiled_run(engine)
+        super(ICOMSimulator, self).start(initialise=initialise)
+        if self.profile:
+            self.log_profile_summary()
+
+    def _profiled_run(self, engine):
+        def run():
+            self.profile_engine(engine)
+        return run
+
+    def profile_engine(self, engine):
+        """Runs an engine and appends its profiling record for the current year to profile_records
+        """
+        landscape = self.network
+        no_agents = len(landscape.hh_table)
+        no_events = len(landscape.move_log)
+        rss_before = _peak_rss()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        engine._unprofiled_run()
+
+        cpu_time = time.process_time() - cpu_start
+        wall_time = time.perf_counter() - wall_start
+        rss_after = _peak_rss()
+        new_events = landscape.move_log.events_since(no_events)  # events of this engine run (not the whole flushed log)
+        record = {
+            'year': landscape.current_timestep.year,
+            'engine': type(engine).__name__,
+            'wall_time': wall_time,
+            'cpu_time': cpu_time,
+            'peak_rss_delta_kb': rss_after - rss_before if rss_before is not None else nan,
+            'peak_rss_kb': rss_after if rss_after is not None else nan,
+            'unassigned_hhs': len(landscape.unassigned_hhs),
+            'relocating_hhs': len(landscape.relocating_hhs),
+            'agents_added': len(landscape.hh_table) - no_agents,
+            'moves': len(new_events),
+            'outmigrations': int((new_events['reason'] == MOVE_OUTMIGRATED).sum()),
+        }
+        if hasattr(engine, 'profile_counters'):
+            record.update(engine.profile_counters())
+        self.profile_records.append(record)
+
+    def get_profile(self):
+        """Returns the profiling records as a dataframe (one row per year and engine)
+        """
+        return pd.DataFrame(self.profile_records)
+
+    def log_profile_summary(self):
+        """Logs the total wall time, CPU time and peak RSS increase of each engine over all years
+        """
+        if not self.profile_records:
+            return
+        summary = self.get_profile().groupby('engine', sort=False)[['wall_time', 'cpu_time', 'peak_rss_delta_kb']].sum()
+        for engine_name, row in summary.iterrows():
+            logging.info('Engine ' + engine_name + ': wall time ' + str(round(row['wall_time'], 3)) + ' s, CPU time ' +
+                         str(round(row['cpu_time'], 3)) + ' s, peak RSS increase ' + str(row['peak_rss_delta_kb']) + ' kB')
+
+    def export_profile(self, filename):
+        """Writes the profiling records to a csv or json file (by file extension)
+        """
+        if filename.endswith('.json'):
+            with open(filename, 'w') as f:
+                json.dump(self.profile_records, f, indent=1, default=float)
+        else:
+            self.get_profile().to_csv(filename, index=False)
+
     def set_timestep_information(self):
         logging.info("Setting up timestep information")
         timesteps = [datetime.datetime.strptime(str(self.start_year), '%Y')]
@@ -31,66 +151,54 @@ class ICOMSimulator(Simulator):
         logging.info("The first timestep is " + str(self.timesteps[0]))
         logging.info("The last timestep is " + str(self.timesteps[-1]))
 
-    def set_landscape(self, landscape_name, geo_filename, pop_filename, pop_fieldname, flood_filename, housing_filename, hedonic_filename):
+    def set_landscape(self, landscape_name, geo_filename, pop_filename, pop_fieldname, flood_filename, housing_filename, hedonic_filename,
+                      house_choice_mode=None, simple_anova_coefficients=None, history_dir=None, data_dir='data_inputs', cache_dir=None,
+                      headless=False):
         """Create landscape based on census geographies / data (assumes data structure follows IPUMS/NHGIS format
+
+        If house_choice_mode (one of the simple anova modes) and simple_anova_coefficients are provided, block group
+        utilities for the location choice model are calculated once here and reused by the location engines (see ABMLandscape.get_bg_utility)
+
+        Block group history is recorded in preallocated (years x block groups) matrices, memory-mapped to .npy files in
+        history_dir if provided (see ABMLandscape.init_history_store)
+
+        Input files are read from data_dir (e.g., a synthetic landscape generated by the benchmarks)
+
+        If cache_dir is provided, the compiled block group table and node attributes (see compile_landscape) are stored
+        in cache_dir, keyed by a hash of the input files and parameters, and loaded from there by later runs with the
+        same inputs instead of being compiled again
+
+        If headless is True, the landscape is built without geometry: block group nodes keep their centroids but no
+        polygon and housing_bg_df is a DataFrame rather than a GeoDataFrame. With a compiled landscape in cache_dir, a
+        headless run does not import geopandas or shapely (e.g., for short sweep tasks)
         """
         logging.info("Setting up model landscape")
         landscape = ABMLandscape(name=landscape_name)
 
-        bg = gpd.read_file('data_inputs/' + geo_filename)
-        pop = pd.read_csv('data_inputs/' + pop_filename)
-        flood = pd.read_csv('data_inputs/' + flood_filename)
-        housing = pd.read_csv('data_inputs/' + housing_filename)
-        hedonic = pd.read_csv('data_inputs/' + hedonic_filename)
-
-        # join census/population data to block groups
-        bg = pd.merge(bg, pop[['GISJOIN', pop_fieldname]], how='left', on='GISJOIN')
-        bg = pd.merge(bg, flood[['GISJOIN', 'perc_fld_area']], how='left', on='GISJOIN')
-        bg['perc_fld_area'] = bg['perc_fld_area'].fillna(0)
-        bg = pd.merge(bg, housing, how='left', on='GISJOIN')
-
-        # load table with hedonic regression information for utility function
-        bg = pd.merge(bg, hedonic[['GISJOIN', 'N_MeanSqfeet', 'N_MeanAge', 'N_MeanNoOfStories','N_MeanFullBathNumber','N_perc_area_flood','residuals']], how='left', on='GISJOIN')
-
-        # determine relative cbd proximity and relative flood risk for input to hh utility calcs (JY consider moving into an if statement so only loads with specified utility formulation)
-        bg['rel_prox_cbd'] = bg['cbddist'].max() + 1 - bg['cbddist']
-        bg['rel_flood_risk'] = bg['perc_fld_area'].max() + 1 - bg['perc_fld_area']
-
-        # calculate normalized values for cbd proximity and flood risk
-        bg['prox_cbd_norm'] = bg['rel_prox_cbd'] / bg['rel_prox_cbd'].max()
-        bg['flood_risk_norm'] = bg['rel_flood_risk'] / bg['rel_flood_risk'].max()
-
-        # calculate housing budget based on 1990-1993 data
-        bg['housing_budget_perc'] = bg['mhi1990'] / bg['salesprice1993']
-
-        # replace 0 mhi1990 values with non-zero minimum
-        non_zero_min = bg[(bg.mhi1990 > 0)].mhi1990.min()
-        bg.loc[bg['mhi1990'] == 0, 'mhi1990'] = non_zero_min
-
-        for index, row in bg.iterrows():  # JY fill in missing sales price and hedonic regression values with nearest neighbor values that have data (this can be pre-processed to save computation time)
-            if np.isnan(row['salesprice1993']) or np.isnan(row['N_MeanSqfeet']):
-                location = row['geometry']
-                bg_subset = bg[(bg.GEOID != row['GEOID']) & (np.isfinite(bg.salesprice1993)) & (np.isfinite(bg.N_MeanSqfeet))]
-                polygon_index = bg_subset.distance(location).sort_values().index[0]
-                bg.at[index, 'salesprice1993'] = bg_subset.loc[[polygon_index]]['salesprice1993']
-                bg.at[index, 'N_MeanSqfeet'] = bg_subset.loc[[polygon_index]]['N_MeanSqfeet']
-                bg.at[index, 'N_MeanAge'] = bg_subset.loc[[polygon_index]]['N_MeanAge']
-                bg.at[index, 'N_MeanNoOfStories'] = bg_subset.loc[[polygon_index]]['N_MeanNoOfStories']
-                bg.at[index, 'N_MeanFullBathNumber'] = bg_subset.loc[[polygon_index]]['N_MeanFullBathNumber']
-                bg.at[index, 'N_perc_area_flood'] = bg_subset.loc[[polygon_index]]['N_perc_area_flood']
-                bg.at[index, 'residuals'] = bg_subset.loc[[polygon_index]]['residuals']
-                bg.at[index, 'salespricesf1993'] = bg_subset.loc[[polygon_index]]['salespricesf1993']
-
-        # initialize new price for updating
-        bg['new_price'] = bg['salesprice1993']
+        compiled = None
+        if cache_dir is not None:  # reuse the compiled block group table of identical inputs (see model_classes/landscape_cache.py)
+            filenames = input_filenames(data_dir, geo_filename, pop_filename, flood_filename, housing_filename, hedonic_filename)
+            key = landscape_cache_key(filenames, {'pop_fieldname': pop_fieldname})
+            compiled = load_compiled_landscape(cache_dir, key, headless=headless)
+        if compiled is None:
+            compiled = compile_landscape(data_dir, geo_filename, pop_filename, pop_fieldname, flood_filename, housing_filename, hedonic_filename)
+            if cache_dir is not None:
+                save_compiled_landscape(cache_dir, key, *compiled)
+        bg, node_arrays = compiled
+        if headless:
+            bg = headless_table(bg)
+        has_geometry = 'geometry' in bg.columns
+
+        landscape.bg_index = dict(zip(bg['GEOID'], range(len(bg))))
+        landscape.hh_table.set_bg_names(bg['GEOID'].values)  # household agent location codes are block group rows
 
         # for each entry in census table, create pysnim-based block group cell/node
         cells = []
         for index, row in bg.iterrows():
-            x = row['geometry'].centroid.x  # gets x-coord of centroid on polygon from shapely geometric object
-            y = row['geometry'].centroid.y  # gets x-coord of centroid on polygon from shapely geometric object
+            x = node_arrays['x'][index]  # x-coord of centroid of the block group polygon
+            y = node_arrays['y'][index]  # y-coord of centroid of the block group polygon
             cells.append(BlockGroup(name=row['GEOID'], x=x, y=y, county=row['COUNTYFP'], tract=row['TRACTCE'],
-                                    blkgrpce=row['BLKGRPCE'], area=row['ALAND'], geometry=row['geometry'],
+                                    blkgrpce=row['BLKGRPCE'], area=row['ALAND'], geometry=row['geometry'] if has_geometry else None,
                                     init_pop=row[pop_fieldname], perc_fld_area=row['perc_fld_area'],
                                     pop90=row['pop1990'], mhi90=row['mhi1990'], hhsize90=row['hhsize1990'],
                                     coastdist=row['coastdist'], cbddist=row['cbddist'], hhtrans93=row['hhtrans1993'],
@@ -100,36 +208,47 @@ class ICOMSimulator(Simulator):
         landscape.housing_bg_df = bg
 
         landscape.add_nodes(*cells)
+        landscape.reset_bg_aggregates()  # running statistics of resident agents (one entry per block group node)
+        landscape.init_history_store(self.no_of_years + 1, history_dir=history_dir)
 
         self.add_network(landscape)
         logging.info(str(len(self.network.nodes)) + " block group nodes were added to the network")
 
+        if house_choice_mode in CACHED_UTILITY_MODES and simple_anova_coefficients is not None:
+            landscape.get_bg_utility(house_choice_mode, simple_anova_coefficients)  # pre-calculate block group utilities
 
-    def convert_initial_population_to_agents(self, no_hhs_per_agent=10, simple_avoidance_perc=.10):
+
+    def convert_initial_population_to_agents(self, no_hhs_per_agent=10, simple_avoidance_perc=.10, agent_mode='component', agent_history=None):
+        # agent_mode: 'component' (HHAgent) or 'compact' (CompactHHAgent); agent_history: properties recorded by compact agents (e.g., ['location'])
+        agent_options = {} if agent_history is None else {'record_history': agent_history}
         logging.info("Converting initial population to agents and adding to the simulation")
-        count = 1
-        for bg in self.network.nodes:
-            if bg.hhsize90 != 0 and np.isfinite(bg.hhsize90):
-                no_of_hhs = round(bg.pop90 / bg.hhsize90)
-            else:  # if hh size is 0 or nan (i.e., data error) using median household size for population
-                no_of_hhs = round(bg.pop90 / self.network.housing_bg_df.hhsize1990.median())
-            no_of_agents = (no_of_hhs + no_hhs_per_agent // 2) // no_hhs_per_agent  # division with rounding to nearest integer
-            for a in range(no_of_agents):
-                name = 'hh_agent_initial_' + str(count)
-                self.network.add_component(HHAgent(name=name, location=bg.name, no_hhs_per_agent=no_hhs_per_agent,
-                                                   hh_size=bg.hhsize90, income=bg.mhi90, house_budget_mode='rhea',
-                                                   year_of_residence=self.start_year, simple_avoidance_perc=simple_avoidance_perc))  # add household agent to pynsim network
-                bg.hh_agents[self.network.components[-1].name] = self.network.components[-1]  # add pynsim household agent to associated block group node
-                bg.occupied_units += 1  # add occupied unit to associated block group node
-                self.network.get_institution('all_hh_agents').add_component(self.network.components[-1])  # add pynsim household agent to all hh agents institution
-                count += 1
-        logging.info(str(count) + " initial agents added to the simulation")
+        # the number of agents of every block group is calculated as an array, and the whole initial population is
+        # created (see create_agents), registered, placed and logged at once
+        pop90 = self.network.get_node_values('pop90')
+        hhsize90 = self.network.get_node_values('hhsize90')
+        valid_size = (hhsize90 != 0) & np.isfinite(hhsize90)  # if hh size is 0 or nan (i.e., data error) using median household size for population
+        no_of_hhs = np.round(pop90 / np.where(valid_size, hhsize90, np.nanmedian(self.network.get_bg_column('hhsize1990')))).astype(np.int64)
+        no_of_agents = (no_of_hhs + no_hhs_per_agent // 2) // no_hhs_per_agent  # division with rounding to nearest integer
+        bg_rows = np.repeat(np.arange(len(self.network.nodes)), no_of_agents)  # block group row of each agent
+
+        names = ['hh_agent_initial_' + str(count) for count in range(1, len(bg_rows) + 1)]
+        avoidance = self.rng.random(len(bg_rows)) <= simple_avoidance_perc  # flood avoidance flags of all agents
+        agents = create_agents(agent_mode, names, self.network.hh_table, bg_rows, no_hhs_per_agent=no_hhs_per_agent,
+                               hh_size=hhsize90[bg_rows], year_of_residence=self.start_year, income=self.network.get_node_values('mhi90')[bg_rows],
+                               avoidance=avoidance, house_budget_mode='rhea', **agent_options)
+        self.network.add_components(*agents)  # add household agents to pynsim network
+        self.network.get_institution('all_hh_agents').add_components(*agents)  # add household agents to all hh agents institution
+        self.network.place_agents(agents, bg_rows)  # add household agents to associated block group nodes
+        for bg, n in zip(self.network.nodes, no_of_agents.tolist()):
+            bg.occupied_units += n  # add occupied units to associated block group node
+        self.network.move_log.append(self.start_year, self.network.hh_table.rows_of(agents), UNASSIGNED, bg_rows, MOVE_INITIAL)  # log initial placement
+        logging.info(str(len(agents)) + " initial agents added to the simulation")
 
     def initialize_available_building_units(self, initial_vacancy=.20):
         # currently assume a fixed initial vacancy rate across all block groups at the initial_vacancy percentage
         logging.info("Converting initial population to building availability")
         for bg in self.network.nodes:
-            bg.available_units = round((initial_vacancy * bg.occupied_units) / (1 - initial_vacancy))
+            self.network.set_available_units(bg, round((initial_vacancy * bg.occupied_units) / (1 - initial_vacancy)))
 
 
 
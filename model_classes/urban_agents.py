@@ -1,20 +1,83 @@
 from pynsim.components.component import Component
-import random
+from model_classes.column_tables import AgentTable, TableColumn, UNASSIGNED, STATUS_UNASSIGNED, STATUS_RESIDENT
+import numpy as np
+import tracemalloc
 import math
 
-class HHAgent(Component):
+class HHAgentRow(object):
+    """Household agent attributes stored in a row of an AgentTable (shared by HHAgent and CompactHHAgent). Holds no
+    instance attributes of its own (__slots__), so subclasses decide how the rest of the agent is stored.
+    """
+    __slots__ = ()
+
+    income = TableColumn('income')
+    hh_size = TableColumn('hh_size')
+    no_hhs_per_agent = TableColumn('no_hhs_per_agent')
+    house_budget = TableColumn('house_budget')
+    avoidance = TableColumn('avoidance')
+    location = TableColumn('location')
+    year_of_residence = TableColumn('year_of_residence')
+    status = TableColumn('status')
+
+    def _add_table_row(self, table):
+        if table is None:
+            table = AgentTable(capacity=1)
+        self._table = table
+        self._row = int(table.add_rows(1)[0])
+
+    def _set_row_attributes(self, location, no_hhs_per_agent, hh_size, year_of_residence, income, hh_budget_perc,
+                            house_budget_mode, simple_avoidance_perc, avoidance=None, rng=None):
+        self.location = location
+        self.no_hhs_per_agent = no_hhs_per_agent
+        self.hh_size = hh_size
+        self.year_of_residence = year_of_residence
+        ### Other potential attributes
+        self.income = income
+        self.average_age = 0
+        self.hh_budget_perc = hh_budget_perc
+
+        if avoidance is not None:  # avoidance flags drawn for a batch of agents by the creating engine (see NewAgentCreation)
+            self.avoidance = bool(avoidance)
+        elif rng is not None:
+            self.avoidance = bool(rng.random() <= simple_avoidance_perc)  # indicates whether agent avoids flood zone (used in "simple avoidance utility" model)
+        else:
+            raise ValueError('avoidance or rng (a NumPy Generator to draw avoidance from) must be given')
+
+        # calculate housing budget
+        if house_budget_mode == 'rhea':
+            self.house_budget = calc_house_budget(self.income) # See de Koning and Filatova, 2020 supplemental materials
+        elif house_budget_mode == 'perc':
+            self.house_budget = self.income / self.hh_budget_perc
+
+
+def calc_house_budget(income):
+    """Returns the housing budget of a household income ('rhea' house budget mode, see de Koning and Filatova, 2020
+    supplemental materials)
+    """
+    return math.exp(4.96 + (0.63 * math.log(income)))
+
+
+class HHAgent(HHAgentRow, Component):
     """The HHAgent component class.
 
     A HHAgent is representative of a household agent. Household agents represent an aggregation of households of similar
     socioeconomic characteristics and make residential choice decisions by calculating their utility for available
     residences in the landscape.
 
+    The agent's attributes are stored in a row of an AgentTable (struct-of-arrays, typically the landscape's hh_table)
+    and the HHAgent object is a thin view over that row, so engines can operate on whole columns of the table. Agents
+    created without a table get a standalone single-row table.
+
     **Attributes**:
 
         |  *no_hhs_per_agent* (int) - the number of similar households that the agent represents
         |  *hh_size* (int) - average number of individuals in the household
         |  *income* (float) - average household income
         |  *age* (float) - average resident age
+        |  *house_budget* (float) - housing budget
+        |  *avoidance* (bool) - indicates whether agent avoids the flood zone (if not given, drawn with probability
+        |      simple_avoidance_perc from rng, a NumPy Generator, e.g., the creating engine's random number stream)
+        |  *status* (int) - queue / residence status code (see model_classes.column_tables)
 
 
     **Properties**:
@@ -28,35 +91,31 @@ class HHAgent(Component):
     """
 
     def __init__(self, name, location=None, no_hhs_per_agent=100, hh_size=4, year_of_residence=2018, income=None,
-                 hh_budget_perc=0.33, house_budget_mode='rhea', simple_avoidance_perc=.10, **kwargs):
+                 hh_budget_perc=0.33, house_budget_mode='rhea', simple_avoidance_perc=.10, avoidance=None, rng=None, table=None, **kwargs):
+        self._add_table_row(table)  # table row must exist before pynsim sets the default properties
         super(HHAgent, self).__init__(name, **kwargs)
         self.name = name
-        self.location = location
-        self.no_hhs_per_agent = no_hhs_per_agent
-        self.hh_size = hh_size
-        self.year_of_residence = year_of_residence
-        ### Other potential attributes
-        self.income = income
-        self.average_age = 0
-        self.hh_budget_perc = hh_budget_perc
-
-        random_avoidance = random.uniform(0, 1)   # indicates whether agent avoids flood zone (used in "simple avoidance utility" model)
-        if random_avoidance <= simple_avoidance_perc:
-            self.avoidance = True
-        else:
-            self.avoidance = False
-
-        # calculate housing budget
-        if house_budget_mode == 'rhea':
-            self.house_budget = math.exp(4.96 + (0.63 * math.log(self.income))) # See de Koning and Filatova, 2020 supplemental materials
-        elif house_budget_mode == 'perc':
-            self.house_budget = self.income / self.hh_budget_perc
+        self._set_row_attributes(location, no_hhs_per_agent, hh_size, year_of_residence, income, hh_budget_perc,
+                                 house_budget_mode, simple_avoidance_perc, avoidance, rng)
 
     _properties = {
         'location': None,  # number of individuals residing in block group
         'hh_utilities': {},
     }
 
+    @classmethod
+    def from_row(cls, name, table, row, hh_budget_perc=0.33):
+        """Creates an agent viewing an existing row of table, without writing its attributes (see create_agents). Note
+        that pynsim resets the location of the row to None (its default property).
+        """
+        agent = cls.__new__(cls)
+        agent._table = table
+        agent._row = row
+        Component.__init__(agent, name)
+        agent.average_age = 0
+        agent.hh_budget_perc = hh_budget_perc
+        return agent
+
     def setup(self, timestep):
         """Setup for a household agent
         """
@@ -72,9 +131,10 @@ class HHAgent(Component):
         **Inter-module Outputs/Modifications**:
         self.hh_utilities
         """
-        income = self.network.housing_bg_df[(self.network.housing_bg_df.name == bg)]['average_income_norm'].values[0]
-        distance = self.network.housing_bg_df[(self.network.housing_bg_df.GEOID == bg)]['prox_cbd_norm'].values[0]
-        flood = self.network.housing_bg_df[(self.network.housing_bg_df.GEOID == bg)]['flood_risk_norm'].values[0]
+        bg_row = self.network.bg_index[bg]  # block group row (rather than scanning the dataframe for the GEOID)
+        income = self.network.get_bg_column('average_income_norm')[bg_row]
+        distance = self.network.get_bg_column('prox_cbd_norm')[bg_row]
+        flood = self.network.get_bg_column('flood_risk_norm')[bg_row]
         a = 0.4  # temporary, need to define higher up
         b = 0.4
         c = 0.2
@@ -92,13 +152,160 @@ class HHAgent(Component):
         self.hh_utilities
         """
 
-    def calc_utility_random(self, bg):
+    def calc_utility_random(self, bg, rng):
         """Calculates utility of a residence for a household agent.
 
         **Args**:
         bg (str): name of BlockGroup object
+        rng (Generator): NumPy random number generator (e.g., the calling engine's random number stream)
 
         **Inter-module Outputs/Modifications**:
         self.hh_utilities
         """
-        self.hh_utilities[bg] = random.uniform(0, 1)  # temporarily calculate random utility value
\ No newline at end of file
+        self.hh_utilities[bg] = rng.random()  # temporarily calculate random utility value
+
+
+class CompactHHAgent(HHAgentRow):
+    """The CompactHHAgent class.
+
+    A compact household agent for long or fine-grained (e.g., one household per agent) simulations. It is a view over a
+    row of an AgentTable like HHAgent, but it is not a pynsim Component: it uses __slots__ (no per-agent __dict__) and by
+    default records no history, so the hh_utilities and location dicts/values are not copied for every agent every
+    year. It can be added to the network and the all_hh_agents institution like a HHAgent.
+
+    **Args**:
+
+        |  *record_history* (bool or list / str) - record the location and hh_utilities properties of the agent every year
+        |      (as HHAgent) if True, or only the listed properties (e.g., ['location'], which only stores references to
+        |      the interned block group names)
+
+    """
+    __slots__ = ('name', 'network', '_table', '_row', 'average_age', 'hh_budget_perc', 'hh_utilities', '_history')
+
+    base_type = 'component'
+    component_type = 'CompactHHAgent'
+    _properties = HHAgent._properties
+
+    def __init__(self, name, location=None, no_hhs_per_agent=100, hh_size=4, year_of_residence=2018, income=None,
+                 hh_budget_perc=0.33, house_budget_mode='rhea', simple_avoidance_perc=.10, avoidance=None, rng=None, table=None, record_history=False):
+        self._add_table_row(table)
+        self.name = name
+        self.network = None
+        self._init_history(record_history)
+        self._set_row_attributes(location, no_hhs_per_agent, hh_size, year_of_residence, income, hh_budget_perc,
+                                 house_budget_mode, simple_avoidance_perc, avoidance, rng)
+
+    @classmethod
+    def from_row(cls, name, table, row, hh_budget_perc=0.33, record_history=False):
+        """Creates an agent viewing an existing row of table, without writing its attributes (see create_agents)
+        """
+        agent = cls.__new__(cls)
+        agent._table = table
+        agent._row = row
+        agent.name = name
+        agent.network = None
+        agent._init_history(record_history)
+        agent.average_age = 0
+        agent.hh_budget_perc = hh_budget_perc
+        return agent
+
+    def _init_history(self, record_history):
+        if record_history is True:
+            record_history = list(self._properties)
+        self.hh_utilities = {} if record_history and 'hh_utilities' in record_history else None  # utilities are calculated by the housing search, not stored on agents
+        self._history = {k: [] for k in record_history} if record_history else None
+
+    def __repr__(self):
+        return "CompactHHAgent(name=%s)" % (self.name)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def setup(self, timestep):
+        """Setup for a household agent
+        """
+        if self.hh_utilities is not None:
+            self.hh_utilities = {}  # reset any previously calculated utilities
+
+    def post_process(self):
+        if self._history is not None:
+            for k, values in self._history.items():
+                attr = getattr(self, k)
+                values.append(dict(attr) if isinstance(attr, dict) else attr)
+
+    def get_history(self, attr_name=None):
+        if self._history is None:
+            return {} if attr_name is None else None
+        if attr_name is None:
+            return self._history
+        return self._history.get(attr_name, None)
+
+    def reset_history(self):
+        if self._history is not None:
+            self._history = {k: [] for k in self._history}
+
+
+AGENT_CLASSES = {'component': HHAgent, 'compact': CompactHHAgent}  # household agent class keyed on agent_mode
+
+
+def create_agents(agent_mode, names, table, locations, no_hhs_per_agent, hh_size, year_of_residence, income, avoidance,
+                  hh_budget_perc=0.33, house_budget_mode='rhea', **kwargs):
+    """Creates household agents in bulk: appends one row per agent to table, creates the agent objects viewing the rows
+    and writes all attributes as whole columns (rather than one agent and attribute at a time). Attributes are arrays
+    with one value per agent (or single values); the flood avoidance flags are drawn by the caller.
+
+    **Args**:
+    agent_mode (str): 'component' (HHAgent) or 'compact' (CompactHHAgent)
+    names (list / str): agent names
+    table (AgentTable): agent table (e.g., the landscape's hh_table)
+    locations (array): location codes (block group rows, or UNASSIGNED)
+    kwargs: other agent arguments (e.g., record_history for compact agents)
+
+    **Returns**:
+    list of HHAgent / CompactHHAgent objects (not yet added to the network)
+    """
+    agent_class = AGENT_CLASSES[agent_mode]
+    rows = table.add_rows(len(names))
+    agents = [agent_class.from_row(name, table, int(row), hh_budget_perc=hh_budget_perc, **kwargs) for name, row in zip(names, rows)]
+
+    income = np.broadcast_to(np.asarray(income, dtype=float), rows.shape)
+    if house_budget_mode == 'rhea':
+        # budgets are calculated once per distinct income with the same math functions as for a single agent (np.exp and
+        # np.log can differ in the last bit), so agents created in bulk and one at a time have identical budgets
+        unique_incomes, inverse = np.unique(income, return_inverse=True)
+        house_budget = np.array([calc_house_budget(i) for i in unique_incomes.tolist()], dtype=float)[inverse]
+    elif house_budget_mode == 'perc':
+        house_budget = income / hh_budget_perc
+    else:
+        house_budget = np.nan
+    locations = np.broadcast_to(np.asarray(locations, dtype=np.int64), rows.shape)
+    values = {'location': locations, 'status': np.where(locations == UNASSIGNED, STATUS_UNASSIGNED, STATUS_RESIDENT),
+              'no_hhs_per_agent': no_hhs_per_agent, 'hh_size': hh_size, 'year_of_residence': year_of_residence,
+              'income': income, 'house_budget': house_budget, 'avoidance': avoidance}
+    for column, value in values.items():
+        table.column(column)[rows] = value
+    return agents
+
+
+def measure_agent_memory(agent_mode='component', no_of_agents=10000, **kwargs):
+    """Measures the memory used per household agent (bytes, including its AgentTable row) by creating no_of_agents agents
+    with tracemalloc running. Agents are created after their table so that the table's capacity is allocated up front.
+
+    **Args**:
+    agent_mode (str): 'component' (HHAgent) or 'compact' (CompactHHAgent)
+    no_of_agents (int): number of agents to create
+    kwargs: other HHAgent / CompactHHAgent arguments (e.g., record_history for compact agents)
+    """
+    agent_class = AGENT_CLASSES[agent_mode]
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        table = AgentTable(capacity=no_of_agents)
+        agents = [agent_class(name='hh_agent_' + str(i), income=50000.0, table=table, **kwargs) for i in range(no_of_agents)]
+        end, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (end - start) / len(agents)
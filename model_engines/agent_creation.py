@@ -1,8 +1,9 @@
 from pynsim import Engine
-from model_classes.urban_agents import HHAgent
-import scipy.stats as stats
+from model_classes.urban_agents import create_agents
+from model_classes.column_tables import UNASSIGNED
+import pandas as pd
+import numpy as np
 import logging
-import random
 
 class NewAgentCreation(Engine):
     """An engine class that creates new agent's based upon population growth or exogenous scenario assumptions.
@@ -18,6 +19,16 @@ class NewAgentCreation(Engine):
         growth_mode (string): defined as either "perc" or "exog" depending upon simulation mode
         growth_rate (float): if growth_mode = "perc", defines the annual percentage population growth rate
         growth_inc (float): if growth_mode = "perc", defines the increase in the mean income for incoming population
+        exog_population (str or DataFrame): if growth_mode = "exog", table (or csv file) of annual population targets with
+            year and population columns; each year, the population needed to reach the year's target is added (no agents
+            are added in years without a target or if the population already meets the target)
+        agent_mode (string): household agent representation, "component" (HHAgent) or "compact" (CompactHHAgent)
+        agent_history (list): if agent_mode = "compact", properties recorded in each agent's history (none by default)
+
+    **Attributes**:
+        rng (Generator): random number stream of the engine (replaced by a seeded stream when the engine is added to an
+            ICOMSimulator); incomes and flood avoidance flags of each year's new agents are drawn as vectors
+        population_targets (dict {int:float}): if growth_mode = "exog", population target keyed on year
 
     **Inter-module Outputs/Modifications**:
         s.network.unassigned_hhs (dict): dictionary of HHAgent objects in the location queue (keys are household agent names)
@@ -25,7 +36,7 @@ class NewAgentCreation(Engine):
     """
 
     def __init__(self, target, growth_mode, growth_rate, inc_growth_mode, pop_growth_inc_perc, inc_growth_perc=.05, no_hhs_per_agent=10, hh_size=2.7,
-                 simple_avoidance_perc=.10, **kwargs):
+                 simple_avoidance_perc=.10, agent_mode='component', agent_history=None, exog_population=None, **kwargs):
         super(NewAgentCreation, self).__init__(target, **kwargs)
         self.growth_mode = growth_mode
         self.growth_rate = growth_rate
@@ -35,6 +46,15 @@ class NewAgentCreation(Engine):
         self.pop_growth_inc_perc = pop_growth_inc_perc
         self.inc_growth_perc = inc_growth_perc
         self.simple_avoidance_perc = simple_avoidance_perc
+        self.agent_mode = agent_mode
+        self.agent_options = {} if agent_history is None else {'record_history': agent_history}
+        self.rng = np.random.default_rng()
+
+        self.population_targets = {}
+        if growth_mode == 'exog':
+            if isinstance(exog_population, str):
+                exog_population = pd.read_csv(exog_population)
+            self.population_targets = dict(zip(exog_population['year'].astype(int), exog_population['population'].astype(float)))
 
     def run(self):
         """ Run the NewAgentCreation Engine.
@@ -44,55 +64,58 @@ class NewAgentCreation(Engine):
         # creates new agents based upon population growth mode and adds to the unassigned households queue
         if self.growth_mode == 'perc':
             new_population = self.target.total_population * self.growth_rate
-            no_of_new_agents = (new_population / self.hh_size + self.no_hhs_per_agent // 2) // self.no_hhs_per_agent  # division with rounding to nearest integer
+        elif self.growth_mode == 'exog':
+            population_target = self.population_targets.get(self.timestep.year)
+            if population_target is None:
+                logging.info("No exogenous population target for year " + str(self.timestep.year) + ", no new agents are created")
+                return
+            new_population = max(population_target - self.target.total_population, 0)
+        else:
+            return
+        no_of_new_agents = int((new_population / self.hh_size + self.no_hhs_per_agent // 2) // self.no_hhs_per_agent)  # division with rounding to nearest integer
+        if no_of_new_agents <= 0:
+            return
 
-            if self.inc_growth_mode == 'normal_distribution':
-                # create gaussian distribution for household income of new population
-                lower, upper = 5000, 300000  # truncate distribution to avoid unrealistic incomes
-                mu, sigma = self.target.housing_bg_df.average_income.mean() * (1 + self.inc_growth_perc), self.target.housing_bg_df.average_income.std()
-                X = stats.truncnorm(
-                    (lower - mu) / sigma, (upper - mu) / sigma, loc=mu, scale=sigma)
+        hh_incomes = self.draw_incomes(no_of_new_agents)
+        if hh_incomes is None:
+            return
+        avoidance = self.draw_avoidance(no_of_new_agents)
 
-                count = 1
-                for a in range(int(no_of_new_agents)):
-                    name = 'hh_agent_' + str(self.timestep.year) + '_' + str(count)
-                    hh_income = X.rvs(1)[0]  # sample from household income distribution
-                    self.target.add_component(HHAgent(name=name, location=None, no_hhs_per_agent=self.no_hhs_per_agent,
-                                                       hh_size=self.hh_size, income=hh_income, house_budget_mode='rhea',
-                                                      year_of_residence=self.timestep.year, simple_avoidance_perc = self.simple_avoidance_perc))  # add household agent to pynsim network; currently uses landscape avg hh income & size
-                    self.target.get_institution('all_hh_agents').add_component(self.target.components[-1])  # add pynsim household agent to all hh agents institution
-                    self.target.unassigned_hhs[self.target.components[-1].name] = self.target.components[-1]  # add pynsim household agent to unassigned agent dictionary
-                    count += 1
-            elif self.inc_growth_mode == 'percentile_based':
-                # JY ADD CODE HERE
-                hh_income = self.target.housing_bg_df.average_income.quantile(q=self.pop_growth_inc_perc) ### UPDATE WITH LIVE INCOMES!
-                count = 1
-                for a in range(int(no_of_new_agents)):
-                    name = 'hh_agent_' + str(self.timestep.year) + '_' + str(count)
-                    self.target.add_component(HHAgent(name=name, location=None, no_hhs_per_agent=self.no_hhs_per_agent,
-                                                      hh_size=self.hh_size, income=hh_income, house_budget_mode='rhea',
-                                                      year_of_residence=self.timestep.year, simple_avoidance_perc = self.simple_avoidance_perc))  # add household agent to pynsim network; currently uses landscape avg hh income & size
-                    self.target.get_institution('all_hh_agents').add_component(
-                        self.target.components[-1])  # add pynsim household agent to all hh agents institution
-                    self.target.unassigned_hhs[self.target.components[-1].name] = self.target.components[
-                        -1]  # add pynsim household agent to unassigned agent dictionary
-                    count += 1
-            elif self.inc_growth_mode == 'random_agent_replication':
-                count = 1
-                for a in range(int(no_of_new_agents)):
-                    name = 'hh_agent_' + str(self.timestep.year) + '_' + str(count)
-                    random_agent = random.choice(self.target.get_institution('all_hh_agents').components)
-                    random_income = random_agent.income
-                    self.target.add_component(HHAgent(name=name, location=None, no_hhs_per_agent=self.no_hhs_per_agent,
-                                                          hh_size=self.hh_size, income=random_income, house_budget_mode='rhea',
-                                                          year_of_residence=self.timestep.year, simple_avoidance_perc = self.simple_avoidance_perc))  # add household agent to pynsim network; currently uses landscape avg hh income & size
-                    self.target.get_institution('all_hh_agents').add_component(
-                        self.target.components[-1])  # add pynsim household agent to all hh agents institution
-                    self.target.unassigned_hhs[self.target.components[-1].name] = self.target.components[
-                        -1]  # add pynsim household agent to unassigned agent dictionary
-                    count += 1
-        elif self.growth_mode == 'exog':
-            # ADD CODE HERE
-            pass
+        # the year's cohort is created and registered in bulk (see create_agents)
+        names = ['hh_agent_' + str(self.timestep.year) + '_' + str(count) for count in range(1, no_of_new_agents + 1)]
+        agents = create_agents(self.agent_mode, names, self.target.hh_table, UNASSIGNED, no_hhs_per_agent=self.no_hhs_per_agent,
+                               hh_size=self.hh_size, year_of_residence=self.timestep.year, income=hh_incomes, avoidance=avoidance,
+                               house_budget_mode='rhea', **self.agent_options)  # currently uses landscape avg hh income & size
+        self.target.add_components(*agents)  # add household agents to pynsim network
+        self.target.get_institution('all_hh_agents').add_components(*agents)  # add household agents to all hh agents institution
+        self.target.unassigned_hhs.update((hh.name, hh) for hh in agents)  # add household agents to unassigned agent dictionary
 
         pass  # to accommodate debugger
+
+    def draw_incomes(self, no_of_agents):
+        """Draws the household incomes of no_of_agents new agents as a single vector, according to the income growth mode
+        (None if the mode is unknown)
+        """
+        if self.inc_growth_mode == 'normal_distribution':
+            from scipy import stats  # imported on first use (only this income mode uses scipy)
+            # create gaussian distribution for household income of new population
+            lower, upper = 5000, 300000  # truncate distribution to avoid unrealistic incomes
+            mu, sigma = self.target.housing_bg_df.average_income.mean() * (1 + self.inc_growth_perc), self.target.housing_bg_df.average_income.std()
+            X = stats.truncnorm(
+                (lower - mu) / sigma, (upper - mu) / sigma, loc=mu, scale=sigma)
+            return X.rvs(size=no_of_agents, random_state=self.rng)  # sample from household income distribution
+        elif self.inc_growth_mode == 'percentile_based':
+            # JY ADD CODE HERE
+            hh_income = self.target.housing_bg_df.average_income.quantile(q=self.pop_growth_inc_perc) ### UPDATE WITH LIVE INCOMES!
+            return np.full(no_of_agents, hh_income)
+        elif self.inc_growth_mode == 'random_agent_replication':
+            # replicate the incomes of randomly drawn existing agents (of the all_hh_agents institution, drawn with replacement)
+            all_hh_agents = self.target.get_institution('all_hh_agents').components
+            existing_incomes = self.target.hh_table.column('income')[self.target.hh_table.rows_of(all_hh_agents)]
+            return existing_incomes[self.rng.integers(len(existing_incomes), size=no_of_agents)]
+        return None
+
+    def draw_avoidance(self, no_of_agents):
+        """Draws the flood avoidance flags of no_of_agents new agents (True with probability simple_avoidance_perc)
+        """
+        return self.rng.random(no_of_agents) <= self.simple_avoidance_perc
@@ -0,0 +1,55 @@
+from pynsim import Engine
+from model_engines.housing_search import batched_housing_search
+import numpy as np
+import logging
+
+class AgentLocation(Engine):
+    """An engine class to calculate new and relocating household agents' utility for homes in a single pass.
+
+    The AgentLocation class is a pynsim engine that combines the NewAgentLocation and ExistingAgentLocation engines. The
+    new household agents waiting in the location queue and the existing household agents waiting in the re-location
+    queue are searched as a single queue: the engine samples from available homes for all of them at once and builds
+    one candidate/utility table for the housing market.
+
+    Target:
+        s.network: the simulation network
+
+    Args:
+        None
+
+    Attributes:
+        bg_sample_size (integer): a single value that indicates the sample size for each agent's housing search
+        rng (Generator): random number stream of the engine (replaced by a seeded stream when the engine is added to an
+            ICOMSimulator)
+
+    **Inter-module Outputs/Modifications**:
+        s.network.hh_utilities_df (DataFrame): sampled block groups (GEOID) and utilities for each household agent (hh)
+    """
+    def __init__(self, target, bg_sample_size=10, house_choice_mode='simple_anova_utility', simple_anova_coefficients=[], budget_reduction_perc=.10, **kwargs):
+        super(AgentLocation, self).__init__(target, **kwargs)
+        self.bg_sample_size = bg_sample_size
+        self.house_choice_mode = house_choice_mode
+        self.simple_anova_coefficients = simple_anova_coefficients
+        self.budget_reduction_perc = budget_reduction_perc
+        self.rng = np.random.default_rng()
+
+    def run(self):
+        """ Run the AgentLocation Engine. The target of this engine are all household agents waiting in the location and
+            re-location queues. New agents are placed ahead of relocating agents in the combined queue (the same order
+            as when the NewAgentLocation and ExistingAgentLocation engines are run one after the other).
+        """
+
+        logging.info("Running the agent location engine, year " + str(self.target.current_timestep.year))
+
+        hh_queue = list(self.target.unassigned_hhs.values()) + list(self.target.relocating_hhs.values())
+        self.no_hhs_searched = len(hh_queue)
+        self.target.hh_utilities_df = batched_housing_search(self.target, hh_queue, self.house_choice_mode, self.simple_anova_coefficients,
+                                                             bg_sample_size=self.bg_sample_size, budget_reduction_perc=self.budget_reduction_perc,
+                                                             random_state=self.rng)
+
+        pass  # to accommodate debugger
+
+    def profile_counters(self):
+        """Returns the engine-specific counters of the last run (see ICOMSimulator.profile_engine)
+        """
+        return {'hhs_searched': self.no_hhs_searched, 'candidates': len(self.target.hh_utilities_df)}
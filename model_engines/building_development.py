@@ -7,12 +7,19 @@ class BuildingDevelopment(Engine):
         self.stock_increase_perc = stock_increase_perc
 
     def run(self):
-        for bg in self.target.nodes:
-            if bg.demand_exceeds_supply == True:
-                bg.new_units_constructed = round(bg.occupied_units * self.stock_increase_perc)
-                bg.available_units += bg.new_units_constructed
-                bg.available_units = int(bg.available_units)
-                self.target.housing_bg_df.loc[self.target.housing_bg_df['GEOID'] == bg.name, 'new_units_constructed'] = bg.new_units_constructed
-                self.target.housing_bg_df.loc[self.target.housing_bg_df['GEOID'] == bg.name, 'available_units'] = bg.available_units
-            else:
-                bg.new_units_constructed = 0
\ No newline at end of file
+        # new construction is calculated for all block groups as arrays (in block group row order)
+        demand_exceeds_supply = self.target.get_node_values('demand_exceeds_supply', dtype=bool)
+        occupied_units = self.target.get_node_values('occupied_units')
+        new_units_constructed = np.where(demand_exceeds_supply, np.round(occupied_units * self.stock_increase_perc), 0).astype(np.int64)
+        developed_bg_rows = np.flatnonzero(demand_exceeds_supply)  # block group rows with new construction (used to update the dynamic block group columns)
+
+        for bg, new_units in zip(self.target.nodes, new_units_constructed.tolist()):
+            bg.new_units_constructed = new_units
+        self.target.adjust_available_units_rows(developed_bg_rows, new_units_constructed[developed_bg_rows].tolist())
+        available_units = np.empty(len(developed_bg_rows), dtype=np.int64)
+        for i, bg_row in enumerate(developed_bg_rows):
+            bg = self.target.nodes[bg_row]
+            bg.available_units = int(bg.available_units)
+            available_units[i] = bg.available_units
+        self.target.set_bg_values('new_units_constructed', developed_bg_rows, new_units_constructed[developed_bg_rows])
+        self.target.set_bg_values('available_units', developed_bg_rows, available_units)
@@ -1,5 +1,8 @@
 from pynsim import Engine
-import random
+from model_classes.landscape import CACHED_UTILITY_MODES
+from model_classes.column_tables import STATUS_RELOCATING, UNASSIGNED, OUTMIGRATED
+from model_classes.move_log import MOVE_VACATED, MOVE_OUTMIGRATED
+import numpy as np
 import logging
 
 class ExistingAgentReloSampler(Engine):
@@ -16,11 +19,14 @@ class ExistingAgentReloSampler(Engine):
 
     Attributes:
         perc_move (float): the percentage of agents that desire to move in any given time period
+        rng (Generator): random number stream of the engine (replaced by a seeded stream when the engine is added to an
+            ICOMSimulator)
 
     """
     def __init__(self, target, perc_move=.10, **kwargs):
         super(ExistingAgentReloSampler, self).__init__(target, **kwargs)
         self.perc_move = perc_move
+        self.rng = np.random.default_rng()
 
 
     def run(self):
@@ -31,17 +37,27 @@ class ExistingAgentReloSampler(Engine):
         """
         logging.info("Running the existing agent sampler engine, year " + str(self.target.current_timestep.year))
 
-        for bg in self.target.nodes:
-            no_of_agents = len(bg.hh_agents)  # number of representative household agents
-            no_of_agents_moving = round(self.perc_move * no_of_agents)  # number of representative household agents that are moving
-            agents_moving = random.sample(list(bg.hh_agents), no_of_agents_moving)  # randomly sample agents that will move
-            for hh in agents_moving:
-                self.target.relocating_hhs[hh] = self.target.get_institution('all_hh_agents')._component_map[hh]  # add agent to unassigned hh list (is there a better way in pynsim rather than accessing _components_map)
-                bg_old_location = self.target.get_node(self.target.get_institution('all_hh_agents')._component_map[hh].location)
-                del bg_old_location.hh_agents[hh]  # remove agent from old location
-                bg_old_location.occupied_units -= 1  # adjust occupied units
-                bg_old_location.available_units += 1  # adjust available units
-                # need to adjust available units in block group that agent is moving from
+        # the agents moving out of all block groups are sampled at once: every resident agent draws a random key and the
+        # round(perc_move * no. of agents) agents with the lowest keys in each block group move (a sample without
+        # replacement within each block group)
+        bg_agents = [list(bg.hh_agents.values()) for bg in self.target.nodes]
+        no_of_agents = np.array([len(agents) for agents in bg_agents], dtype=np.int64)  # number of representative household agents
+        no_of_agents_moving = np.round(self.perc_move * no_of_agents).astype(np.int64)  # number of representative household agents that are moving
+        agents = [hh for agents in bg_agents for hh in agents]
+        agent_bg_rows = np.repeat(np.arange(len(bg_agents)), no_of_agents)
+        order = np.lexsort((self.rng.random(len(agents)), agent_bg_rows))  # agents grouped by block group, in random order
+        rank = np.arange(len(agents)) - np.repeat(np.cumsum(no_of_agents) - no_of_agents, no_of_agents)  # position within the block group
+        agents_moving = [agents[i] for i in order[rank < np.repeat(no_of_agents_moving, no_of_agents)]]
+
+        for hh in agents_moving:
+            self.target.relocating_hhs[hh.name] = hh  # add agent to the re-location queue
+            hh.status = STATUS_RELOCATING
+        self.target.vacate_agents(agents_moving)  # remove agents from old location (and block group statistics)
+        self.target.log_moves(agents_moving, UNASSIGNED, MOVE_VACATED)  # agents keep their old location until they are matched
+        moving_bg_rows = np.flatnonzero(no_of_agents_moving)
+        for bg_row in moving_bg_rows:
+            self.target.nodes[bg_row].occupied_units -= int(no_of_agents_moving[bg_row])  # adjust occupied units
+        self.target.adjust_available_units_rows(moving_bg_rows, no_of_agents_moving[moving_bg_rows].tolist())  # adjust available units in the block groups agents are moving from
         pass  # to accommodate debugger
 
 class ExistingAgentLocation(Engine):
@@ -67,6 +83,7 @@ class ExistingAgentLocation(Engine):
         self.house_choice_mode = house_choice_mode
         self.simple_anova_coefficients = simple_anova_coefficients
         self.budget_reduction_perc = budget_reduction_perc
+        self.rng = np.random.default_rng()  # replaced by a seeded stream when the engine is added to an ICOMSimulator
 
 
     def run(self):
@@ -108,9 +125,10 @@ class ExistingAgentLocation(Engine):
                 bg_budget = bg_all[(bg_all.new_price <= hh.house_budget)]  # JY revise to pin to dynamic prices
             if first:
                 try:
-                    bg_sample = bg_budget.sample(n=10, replace=True, weights='available_units')  # Sample from available units (JY revisit this weighting)
+                    bg_sample = bg_budget.sample(n=10, replace=True, weights='available_units', random_state=self.rng)  # Sample from available units (JY revisit this weighting)
                 except ValueError:
                     logging.info(hh.name + ' cannot afford any available homes!')  # JY: need to pull out of unassigned_hhs
+                    self.target.log_moves([hh], OUTMIGRATED, MOVE_OUTMIGRATED)
                     hh.location = 'outmigrated'
                     continue
                 bg_sample['hh'] = hh.name
@@ -119,9 +137,10 @@ class ExistingAgentLocation(Engine):
                 bg_sample['c'] = 0.2
             else:
                 try:
-                    bg_append = bg_budget.sample(n=10, replace=True, weights='available_units')  # Sample from available units
+                    bg_append = bg_budget.sample(n=10, replace=True, weights='available_units', random_state=self.rng)  # Sample from available units
                 except ValueError:
                     logging.info(hh.name + ' cannot afford any available homes!')  # JY: need to pull out of unassigned_hhs
+                    self.target.log_moves([hh], OUTMIGRATED, MOVE_OUTMIGRATED)
                     hh.location = 'outmigrated'
                     continue
                 bg_append['hh'] = hh.name
@@ -139,15 +158,8 @@ class ExistingAgentLocation(Engine):
 
             bg_sample['utility'] = bg_sample.apply(cobb_douglas_utility, axis=1)
 
-        elif self.house_choice_mode == 'simple_flood_utility':  # JY consider moving to method on household agents
-            bg_sample['utility'] = (self.simple_anova_coefficients[0]) + (self.simple_anova_coefficients[1] * self.target.housing_bg_df['N_MeanSqfeet']) + (self.simple_anova_coefficients[2] * self.target.housing_bg_df['N_MeanAge']) \
-                                                                + (self.simple_anova_coefficients[3] * self.target.housing_bg_df['N_MeanNoOfStories']) + (self.simple_anova_coefficients[4]* self.target.housing_bg_df['N_MeanFullBathNumber'])\
-                                                                + (self.simple_anova_coefficients[5] * self.target.housing_bg_df['N_perc_area_flood']) + (1 * self.target.housing_bg_df['residuals'])  # JY temp change N_perc_area_flood to perc_fld_area
-
-        elif self.house_choice_mode == 'simple_avoidance_utility' or self.house_choice_mode == 'budget_reduction':  # JY consider moving to method on household agents
-            bg_sample['utility'] = (self.simple_anova_coefficients[0]) + (self.simple_anova_coefficients[1] * self.target.housing_bg_df['N_MeanSqfeet']) + (self.simple_anova_coefficients[2] * self.target.housing_bg_df['N_MeanAge']) \
-                                                                + (self.simple_anova_coefficients[3] * self.target.housing_bg_df['N_MeanNoOfStories']) + (self.simple_anova_coefficients[4]* self.target.housing_bg_df['N_MeanFullBathNumber'])\
-                                                                + (1 * self.target.housing_bg_df['residuals'])
+        elif self.house_choice_mode in CACHED_UTILITY_MODES:  # JY consider moving to method on household agents
+            bg_sample['utility'] = self.target.get_bg_utility(self.house_choice_mode, self.simple_anova_coefficients)[bg_sample.index.values]  # gather cached utility by block group row
 
         try:
             self.target.hh_utilities_df = self.target.hh_utilities_df.append(bg_sample[['GEOID', 'hh', 'utility']])
@@ -1,6 +1,10 @@
 from pynsim import Engine
-from operator import itemgetter
+import numpy as np
+import pandas as pd
+import heapq
 import logging
+from model_classes.column_tables import OUTMIGRATED
+from model_classes.move_log import MOVE_SETTLED, MOVE_RELOCATED, MOVE_OUTMIGRATED
 
 class HousingMarket(Engine):
     """An engine class that matches buyers with housing inventory representing the housing market.
@@ -11,7 +15,14 @@ class HousingMarket(Engine):
         s.network
 
     **Args**:
-        market_mode (string): defined to indicate the type of market
+        market_mode (string): defined to indicate the type of market ('top_candidate': each iteration, households bid on
+            their next candidate and block groups accept the highest-income bidders; 'deferred_acceptance': households
+            propose in utility order and block groups hold their highest-income proposers until no proposals remain)
+        bg_sample_size (int): number of candidate block groups of each household
+
+    **Attributes**:
+        rounds (int): number of market rounds processed in the last run
+        proposals (int): number of bids / proposals processed in the last run
 
     **Inter-module Outputs/Modifications**:
         s.network.unassigned_hhs (list): list of HHAgent objects that are in the location queue
@@ -22,99 +33,195 @@ class HousingMarket(Engine):
         super(HousingMarket, self).__init__(target, **kwargs)
         self.market_mode = market_mode
         self.bg_sample_size = bg_sample_size
+        self.rounds = 0
+        self.proposals = 0
+
+    def rank_candidates(self, hh_queue):
+        """Ranks the candidate block groups of each household in the queue by utility (highest first). A household's
+        duplicate candidates (the same block group sampled more than once) are ranked once, and ties in utility are
+        broken by GEOID (highest first), as when sorting each household's (utility, GEOID) pairs.
+
+        **Args**:
+        hh_queue (list / str): names of the households in the location and re-location queues
+
+        **Returns**:
+        (no. of households x bg_sample_size) integer array of block group rows; market iteration k reads column k and
+        entries are -1 once a household has run out of candidates
+        """
+        hh_utilities_df = self.target.hh_utilities_df
+        geoids = self.target.get_bg_column('GEOID')
+        ranked_candidates = np.full((len(hh_queue), self.bg_sample_size), -1, dtype=np.int64)
+        if hh_utilities_df is None or len(hh_utilities_df) == 0 or len(hh_queue) == 0:
+            return ranked_candidates
+
+        hh_positions = pd.Index(hh_queue).get_indexer(hh_utilities_df['hh'].values)
+        bg_rows = pd.Index(geoids).get_indexer(hh_utilities_df['GEOID'].values)
+        utility = hh_utilities_df['utility'].values.astype(float)
+        in_queue = (hh_positions >= 0) & (bg_rows >= 0)
+        hh_positions, bg_rows, utility = hh_positions[in_queue], bg_rows[in_queue], utility[in_queue]
+
+        # keep the last sampled utility of duplicate (hh, bg) pairs (as when building a dict of each household's candidates)
+        pair_keys = hh_positions * len(geoids) + bg_rows
+        _, last_of_pair = np.unique(pair_keys[::-1], return_index=True)
+        keep = len(pair_keys) - 1 - last_of_pair
+        hh_positions, bg_rows, utility = hh_positions[keep], bg_rows[keep], utility[keep]
+
+        geoid_rank = np.empty(len(geoids), dtype=np.int64)
+        geoid_rank[np.argsort(geoids, kind='stable')] = np.arange(len(geoids))
+        order = np.lexsort((-geoid_rank[bg_rows], -utility, hh_positions))  # by household, then utility and GEOID (highest first)
+        hh_positions, bg_rows = hh_positions[order], bg_rows[order]
+        group_start = np.searchsorted(hh_positions, hh_positions, side='left')
+        candidate_rank = np.arange(len(hh_positions)) - group_start
+        within_sample = candidate_rank < self.bg_sample_size
+        ranked_candidates[hh_positions[within_sample], candidate_rank[within_sample]] = bg_rows[within_sample]
+        return ranked_candidates
+
+    def profile_counters(self):
+        """Returns the engine-specific counters of the last run (see ICOMSimulator.profile_engine)
+        """
+        return {'market_rounds': self.rounds, 'market_bids': self.proposals}
+
+    def remove_from_queue(self, hh, is_new_hh):
+        """Deletes a matched (or outmigrating) household from the location queue (new agents) or the re-location queue
+        (agents re-locating within domain)
+        """
+        if is_new_hh:
+            del self.target.unassigned_hhs[hh.name]
+        else:
+            del self.target.relocating_hhs[hh.name]
+
+    def place_households(self, hh_queue, is_new_hh, positions, bg_rows):
+        """Moves matched households (queue positions) to their block groups (bg rows) and applies the occupancy changes
+        in bulk (one adjustment per block group)
+        """
+        geoids = self.target.get_bg_column('GEOID')
+        matched_counts = np.bincount(bg_rows, minlength=len(geoids))
+        for bg_row in np.flatnonzero(matched_counts):
+            bg = self.target.nodes[bg_row]
+            bg.occupied_units += int(matched_counts[bg_row])  # adjust occupied units
+            self.target.adjust_available_units(bg, -int(matched_counts[bg_row]))  # adjust available units
+        matched_hhs = [hh_queue[position] for position in positions]
+        self.target.log_moves(matched_hhs, bg_rows, np.where(is_new_hh[positions], MOVE_SETTLED, MOVE_RELOCATED))
+        self.target.place_agents(matched_hhs, bg_rows)  # add pynsim household agents to associated block group nodes (and block group statistics)
+        for position, hh, bg_row in zip(positions, matched_hhs, bg_rows):
+            hh.location = geoids[bg_row]  # change location attribute on household agent
+            self.remove_from_queue(hh, is_new_hh[position])
+
+    def outmigrate_household(self, hh, is_new_hh):
+        """Removes a household that has run out of candidates from the queue (assumed to migrate outside of domain)
+        """
+        logging.info(hh.name + ' cannot afford any properties and is assumed to migrate outside of domain')
+        self.remove_from_queue(hh, is_new_hh)
+        self.target.log_moves([hh], OUTMIGRATED, MOVE_OUTMIGRATED)
+        hh.location = 'outmigrated'
+
+    def deferred_acceptance(self, hh_queue, is_new_hh, ranked_candidates, incomes):
+        """Matches households with block groups by deferred acceptance. In each round, every household without a
+        tentative match proposes to its next candidate (in utility order); each block group holds its highest-income
+        proposers up to its available units (in a heap keyed on income, ties in queue order) and rejects the rest, who
+        propose again in the next round. The market stops as soon as a round has no proposals, and held proposals are
+        then accepted (a stable matching for the households' ranked candidates).
+        """
+        no_bgs = len(self.target.nodes)
+        capacity = np.fromiter((bg.available_units for bg in self.target.nodes), dtype=float, count=no_bgs)
+        held = {}  # bg row -> heap of (income, -queue position) of the proposals held by the bg (weakest at the top)
+        next_choice = np.zeros(len(hh_queue), dtype=np.int64)
+        proposing = list(range(len(hh_queue)))
+        self.rounds = 0
+        self.proposals = 0
+
+        while proposing:
+            rejected = []
+            no_round_proposals = 0
+            for position in proposing:
+                choice = next_choice[position]
+                bg_row = ranked_candidates[position, choice] if choice < ranked_candidates.shape[1] else -1
+                if bg_row < 0:  # household has run out of candidates
+                    self.outmigrate_household(hh_queue[position], is_new_hh[position])
+                    continue
+                next_choice[position] += 1
+                no_round_proposals += 1
+                bg_heap = held.setdefault(bg_row, [])
+                heapq.heappush(bg_heap, (incomes[position], -position))
+                if len(bg_heap) > capacity[bg_row]:  # demand exceeds supply, reject the weakest proposal held
+                    self.target.nodes[bg_row].demand_exceeds_supply = True
+                    rejected.append(-heapq.heappop(bg_heap)[1])
+            if no_round_proposals == 0:
+                break
+            self.rounds += 1
+            self.proposals += no_round_proposals
+            proposing = sorted(rejected)
+
+        positions = []
+        bg_rows = []
+        for bg_row in sorted(held.keys()):
+            for income, neg_position in sorted(held[bg_row], reverse=True):
+                positions.append(-neg_position)
+                bg_rows.append(bg_row)
+        self.place_households(hh_queue, is_new_hh, np.array(positions, dtype=np.int64), np.array(bg_rows, dtype=np.int64))
+        logging.info('Deferred acceptance market converged after ' + str(self.rounds) + ' rounds and ' + str(self.proposals) + ' proposals')
 
     def run(self):
         """ Run the HousingMarket Engine.
         """
         logging.info("Running the housing market engine, year " + str(self.target.current_timestep.year))
 
+        # rank each household's candidates once (rather than filtering and re-sorting hh_utilities_df every iteration)
+        hh_queue = list(self.target.unassigned_hhs.values()) + list(self.target.relocating_hhs.values())
+        is_new_hh = np.arange(len(hh_queue)) < len(self.target.unassigned_hhs)  # new agents are ahead of relocating agents in the queue
+        ranked_candidates = self.rank_candidates([hh.name for hh in hh_queue])
+        incomes = self.target.hh_table.column('income')[self.target.hh_table.rows_of(hh_queue)]
 
-        for market_iter in range(self.bg_sample_size):
+        if self.market_mode == 'deferred_acceptance':
+            self.deferred_acceptance(hh_queue, is_new_hh, ranked_candidates, incomes)
+        else:
+            self.rounds = 0
+            self.proposals = 0
+            in_queue = np.ones(len(hh_queue), dtype=bool)
+            geoids = self.target.get_bg_column('GEOID')
+            for market_iter in range(self.bg_sample_size):
 
-            logging.info('Housing market iteration: ' + str(market_iter))
+                logging.info('Housing market iteration: ' + str(market_iter))
 
-            to_delete_unassigned_hhs = []  # list of households to delete from unassigned dicts for market iteration
-            to_delete_relocating_hhs = []  # list of households to delete from unassigned dicts for market iteration
+                if not in_queue.any():  # break out of market iteration loop if no more unassigned households
+                    break
+                self.rounds += 1
 
-            if not self.target.unassigned_hhs and not self.target.relocating_hhs:  # break out of market iteration loop if no more unassigned households
-                break
-            bg_demand = {}  # a dictionary that will identify hh's and top candidate bg's
-            for hh in self.target.unassigned_hhs.values():
-                hh_utilities_subset = self.target.hh_utilities_df[(self.target.hh_utilities_df.hh == hh.name)]
-                hh_utilities_dict = dict(zip(hh_utilities_subset.GEOID, hh_utilities_subset.utility))
-                sorted_bg_candidates = sorted(((v,k) for k,v in hh_utilities_dict.items()))  # sort bg candidates from lowest to highest
-                try:
-                    top_candidate_bg = sorted_bg_candidates[-1-market_iter][1]  # get the bg name for the top candidate (excluding previous top candidates from previous iterations)
-                    top_candidate_utility = hh_utilities_dict[top_candidate_bg]
-                    if top_candidate_bg in bg_demand.keys():
-                        bg_demand[top_candidate_bg][hh.name] = hh.income # JY replace top_candidate_utility with hh.income (every agent has same utility fx, assume agents with highest income outcompete)
-                    else:
-                        bg_demand[top_candidate_bg] = {}
-                        bg_demand[top_candidate_bg][hh.name] = hh.income
-                except IndexError:  # if list index is out of range, indicates that no available units are affordable for agent
-                    logging.info(hh.name + ' cannot afford any properties and is assumed to migrate outside of domain')
-                    # del self.target.unassigned_hhs[hh.name]
-                    to_delete_unassigned_hhs.append(hh.name)
-                    self.target.get_institution('all_hh_agents')._component_map[hh.name].location = 'outmigrated'
-            for hh in self.target.relocating_hhs.values():
-                hh_utilities_subset = self.target.hh_utilities_df[(self.target.hh_utilities_df.hh == hh.name)]
-                hh_utilities_dict = dict(zip(hh_utilities_subset.GEOID, hh_utilities_subset.utility))
-                sorted_bg_candidates = sorted(((v,k) for k,v in hh_utilities_dict.items()))  # sort bg candidates from lowest to highest
-                try:
-                    top_candidate_bg = sorted_bg_candidates[-1-market_iter][1]  # get the bg name for the top candidate (excluding previous top candidates from previous iterations)
-                    top_candidate_utility = hh_utilities_dict[top_candidate_bg]
-                    if top_candidate_bg in bg_demand.keys():
-                        bg_demand[top_candidate_bg][hh.name] = hh.income
-                    else:
-                        bg_demand[top_candidate_bg] = {}
-                        bg_demand[top_candidate_bg][hh.name] = hh.income
-                except IndexError: # if list index is out of range, indicates that no available units are affordable for agent
-                    logging.info(hh.name + ' cannot afford any properties and is assumed to migrate outside of domain')
-                    to_delete_relocating_hhs.append(hh.name)
-                    self.target.get_institution('all_hh_agents')._component_map[hh.name].location = 'outmigrated'
-
-            for hh in to_delete_unassigned_hhs:
-                del self.target.unassigned_hhs[hh]
-            for hh in to_delete_relocating_hhs:
-                del self.target.relocating_hhs[hh]
-
-            for bg in bg_demand.keys():
-                no_of_hhs = len(bg_demand[bg])
-                if self.target.get_node(bg).available_units >= no_of_hhs:  # if bg has enough available units to accommodate all matching agents, move all agents to location
-                    for hh_match in bg_demand[bg].keys():
-                        if self.target.get_institution('all_hh_agents')._component_map[hh_match].year_of_residence == self.timestep.year and \
-                                self.target.get_institution('all_hh_agents')._component_map[hh_match].name[9:16] != 'initial':  # if agent is new to domain
-                            self.target.get_node(bg).hh_agents[hh_match] = self.target.get_institution('all_hh_agents')._component_map[hh_match]  # add pynsim household agent to associated block group node
-                            self.target.get_node(bg).occupied_units += 1  # adjust occupied units
-                            self.target.get_node(bg).available_units -= 1  # adjust available units
-                            self.target.get_institution('all_hh_agents')._component_map[hh_match].location = bg  # change location attribute on household agent
-                            del self.target.unassigned_hhs[hh_match]  # delete matched agent from unassigned hh dict
-                        else:  # if agent already exists (i.e., agent re-locating within domain)
-                            self.target.get_node(bg).hh_agents[hh_match] = self.target.get_institution('all_hh_agents')._component_map[hh_match]  # add agent to new block group node
-                            self.target.get_node(bg).occupied_units += 1  # adjust occupied units
-                            self.target.get_node(bg).available_units -= 1  # adjust available units
-                            self.target.get_institution('all_hh_agents')._component_map[hh_match].location = bg  # change location attribute on household agent
-                            del self.target.relocating_hhs[hh_match]  # delete matched agent from relocating hh dict
-                    bg_demand[bg] = {}  # delete all matched agents from hh/bg matching dict
-                else:  # else move only those agents with highest utility for bg up to the amount of available units / JY revise this to highest budgets!
-                    self.target.get_node(bg).demand_exceeds_supply = True  # JY to implement
-                    top_matches = dict(sorted(bg_demand[bg].items(), key=itemgetter(1), reverse=True)[:self.target.get_node(bg).available_units])
-                    for hh_match in top_matches.keys():
-                        if self.target.get_institution('all_hh_agents')._component_map[hh_match].year_of_residence == self.timestep.year and \
-                                self.target.get_institution('all_hh_agents')._component_map[hh_match].name[9:16] != 'initial':  # if agent is new to domain
-                            self.target.get_node(bg).hh_agents[hh_match] = self.target.get_institution('all_hh_agents')._component_map[hh_match]  # add pynsim household agent to associated block group node
-                            self.target.get_node(bg).occupied_units += 1  # adjust occupied units
-                            self.target.get_node(bg).available_units -= 1  # adjust available units
-                            self.target.get_institution('all_hh_agents')._component_map[hh_match].location = bg  # change location attribute on household agent
-                            del self.target.unassigned_hhs[hh_match]  # delete matched agent from unassigned hh dict
-                        else:  # if agent already exists (i.e., agent re-locating within domain)
-                            self.target.get_node(bg).hh_agents[hh_match] = self.target.get_institution('all_hh_agents')._component_map[hh_match]  # add agent to new block group node
-                            self.target.get_node(bg).occupied_units += 1  # adjust occupied units
-                            self.target.get_node(bg).available_units -= 1  # adjust available units
-                            self.target.get_institution('all_hh_agents')._component_map[hh_match].location = bg  # change location attribute on household agent
-                            del self.target.relocating_hhs[hh_match]  # delete matched agent from unassigned hh dict
+                # bids of the iteration as parallel arrays: queue position, bg row of the top candidate (excluding previous
+                # top candidates from previous iterations) and income
+                bidders = np.flatnonzero(in_queue)
+                bid_bgs = ranked_candidates[bidders, market_iter]
+                no_candidate = bid_bgs < 0  # if no candidate is left for this iteration, indicates that no available units are affordable for agent
+                for position in bidders[no_candidate]:
+                    self.outmigrate_household(hh_queue[position], is_new_hh[position])
+                in_queue[bidders[no_candidate]] = False
+                bidders, bid_bgs = bidders[~no_candidate], bid_bgs[~no_candidate]
+                self.proposals += len(bidders)
+
+                # order bids by bg and then by income (highest first, ties in queue order) and accept bids up to the amount of
+                # available units of each bg (JY every agent has same utility fx, assume agents with highest income outcompete)
+                order = np.lexsort((bidders, -incomes[bidders], bid_bgs))
+                bidders, bid_bgs = bidders[order], bid_bgs[order]
+                bid_rank = np.arange(len(bid_bgs)) - np.searchsorted(bid_bgs, bid_bgs, side='left')
+                bid_counts = np.bincount(bid_bgs, minlength=len(geoids))
+                available_units = np.fromiter((self.target.nodes[bg_row].available_units for bg_row in range(len(geoids))), dtype=float, count=len(geoids))
+                accepted = bid_rank < available_units[bid_bgs]
+
+                for bg_row in np.flatnonzero((bid_counts > 0) & (bid_counts > available_units)):
+                    self.target.nodes[bg_row].demand_exceeds_supply = True
+
+                # add matched agents in the order bgs first received a bid (and, within a bg, in queue order unless demand
+                # exceeds supply) so that each bg's hh_agents keeps the same ordering for the re-location sampler
+                first_bid = np.full(len(geoids), len(hh_queue), dtype=np.int64)
+                np.minimum.at(first_bid, bid_bgs, bidders)
+                oversubscribed = bid_counts[bid_bgs] > available_units[bid_bgs]
+                move_order = np.lexsort((np.where(oversubscribed, bid_rank, bidders)[accepted], first_bid[bid_bgs[accepted]]))
+                self.place_households(hh_queue, is_new_hh, bidders[accepted][move_order], bid_bgs[accepted][move_order])
+                in_queue[bidders[accepted]] = False
+            logging.info('Top candidate market processed ' + str(self.rounds) + ' rounds and ' + str(self.proposals) + ' bids')
 
         # for any households remaining in queue, assume they migrate
+        self.target.log_moves(list(self.target.unassigned_hhs.values()) + list(self.target.relocating_hhs.values()), OUTMIGRATED, MOVE_OUTMIGRATED)
         for hh in self.target.unassigned_hhs.values():
             self.target.get_institution('all_hh_agents')._component_map[hh.name].location = 'outmigrated'
         for hh in self.target.relocating_hhs.values():
@@ -2,19 +2,69 @@ from pynsim import Engine
 import numpy as np
 
 class HousingPricing(Engine):
-    def __init__(self, target, housing_pricing_mode='simple_perc', price_increase_perc=0.05, **kwargs):
+    """An engine class that adjusts block group housing prices for excess demand.
+
+    Prices of block groups in which demand exceeded supply increase by price_increase_perc, and (once demand_lookback
+    years have been recorded) prices of block groups without excess demand in the last demand_lookback years decrease by
+    price_increase_perc. Recent demand is read from the landscape's demand bitmasks, so the price decrease does not
+    depend on block group history being recorded.
+
+    **Target**:
+        s.network
+
+    **Args**:
+        housing_pricing_mode (str): 'simple_perc' (adjusts each block group node in turn) or 'simple_perc_array' (same
+            adjustment calculated for all block groups as one array expression)
+        price_increase_perc (float): price adjustment (percentage)
+        demand_lookback (int): number of recent years without excess demand before prices decrease (at most 64)
+
+    **Inter-module Outputs/Modifications**:
+        bg.new_price, s.network.housing_bg_df (new_price column), s.network.affordability_indices
+    """
+    def __init__(self, target, housing_pricing_mode='simple_perc', price_increase_perc=0.05, demand_lookback=5, **kwargs):
         super(HousingPricing, self).__init__(target, **kwargs)
+        self.housing_pricing_mode = housing_pricing_mode
         self.price_increase_perc = price_increase_perc
+        self.demand_lookback = demand_lookback
 
     def run(self):
 
+        if self.housing_pricing_mode == 'simple_perc_array':
+            self.run_array()
+            return
+
+        check_decrease = self.target.demand_state_years >= self.demand_lookback  # JY TEMP for testing
+        recent_demand = self.target.recent_demand(self.demand_lookback)
+        new_prices = {}  # new prices keyed on block group row (used to update the block group prices and affordability indices)
         for bg in self.target.nodes:
             if bg.demand_exceeds_supply == True:
                 bg.new_price = bg.new_price * (1 + self.price_increase_perc)
-                self.target.housing_bg_df.loc[self.target.housing_bg_df['GEOID'] == bg.name, 'new_price'] = bg.new_price
+                new_prices[self.target.bg_index[bg.name]] = bg.new_price
 
-            if self.target.current_timestep_idx >= 5: # JY TEMP for testing
-                if not any(bg.get_history('demand_exceeds_supply')[-5:]):
+            if check_decrease:
+                if not recent_demand[self.target.bg_index[bg.name]]:
                     bg.new_price = bg.new_price * (1 - self.price_increase_perc)
-                    self.target.housing_bg_df.loc[self.target.housing_bg_df['GEOID'] == bg.name, 'new_price'] = bg.new_price
-            #bg.new_price = bg.new_price * 2  # !JY TEMP
\ No newline at end of file
+                    new_prices[self.target.bg_index[bg.name]] = bg.new_price
+
+        self.target.set_bg_values('new_price', list(new_prices.keys()), list(new_prices.values()))  # update the dynamic block group prices in place
+        self.target.update_affordability_prices(list(new_prices.keys()), list(new_prices.values()))  # re-position block groups in price order (no re-sort)
+
+    def run_array(self):
+        """Calculates the price adjustment of all block groups as arrays (in block group row order). The increase and
+        decrease are applied one after the other (as in the simple_perc mode), so prices are identical.
+        """
+        prices = self.target.get_node_values('new_price')
+        demand_exceeds_supply = self.target.get_node_values('demand_exceeds_supply', dtype=bool)
+        changed = demand_exceeds_supply.copy()
+        prices = prices * np.where(demand_exceeds_supply, 1 + self.price_increase_perc, 1)
+        if self.target.demand_state_years >= self.demand_lookback:  # JY TEMP for testing
+            no_recent_demand = ~self.target.recent_demand(self.demand_lookback)
+            prices = prices * np.where(no_recent_demand, 1 - self.price_increase_perc, 1)
+            changed |= no_recent_demand
+
+        bg_rows = np.flatnonzero(changed)
+        new_prices = prices[bg_rows]
+        for bg_row, new_price in zip(bg_rows, new_prices.tolist()):
+            self.target.nodes[bg_row].new_price = new_price
+        self.target.set_bg_values('new_price', bg_rows, new_prices)  # update the dynamic block group prices in place
+        self.target.update_affordability_prices(bg_rows, new_prices)  # re-position block groups in price order (no re-sort)
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import logging
+from model_classes.column_tables import OUTMIGRATED
+from model_classes.move_log import MOVE_OUTMIGRATED
+
+FLOOD_ZONE_THRESHOLD = .10  # JY threshold for flood zone (10 percent of building footprint inundated)
+
+
+def sample_bg_candidates(landscape, budgets, avoidance, house_choice_mode, bg_sample_size=10, budget_reduction_perc=.10,
+                         random_state=np.random):
+    """Draws candidate block groups for a batch of households. Each household draws bg_sample_size block groups with
+    replacement, weighted by available units, from the block groups it can afford (and, in the simple_avoidance_utility
+    mode, that lie outside of the flood zone for flood avoiding households). Affordable block groups are found with
+    binary searches on the landscape's price-sorted affordability indices, rather than by filtering the dataframe.
+
+    **Args**:
+    landscape (ABMLandscape): the simulation network
+    budgets (array): housing budget of each household
+    avoidance (array): boolean flood avoidance flag of each household
+    house_choice_mode (str): location choice model
+    bg_sample_size (int): number of block groups sampled by each household
+    budget_reduction_perc (float): budget reduction for homes in the flood zone (budget_reduction mode only)
+    random_state (Generator): random number stream of the searching engine (or the np.random module)
+
+    **Returns**:
+    (no. of households x bg_sample_size) integer array of block group rows; rows are -1 for households that cannot
+    afford any available homes
+    """
+    budgets = np.asarray(budgets, dtype=float)
+    avoidance = np.asarray(avoidance, dtype=bool)
+    flood = landscape.get_bg_column('perc_fld_area')
+
+    if house_choice_mode == 'simple_avoidance_utility':
+        candidates = np.full((len(budgets), bg_sample_size), -1, dtype=np.int64)
+        all_bgs = landscape.get_affordability_index('all')
+        candidates[~avoidance] = all_bgs.sample(budgets[~avoidance], bg_sample_size, random_state=random_state)
+        outside_flood_zone = landscape.get_affordability_index('outside_flood_zone', flood <= FLOOD_ZONE_THRESHOLD)
+        candidates[avoidance] = outside_flood_zone.sample(budgets[avoidance], bg_sample_size, random_state=random_state)
+    elif house_choice_mode == 'budget_reduction':
+        # households can spend their full budget outside the flood zone and a reduced budget in the flood zone, so
+        # draw from the combined units of both indices
+        below_flood_zone = landscape.get_affordability_index('below_flood_zone', ~(flood >= FLOOD_ZONE_THRESHOLD))
+        flood_zone = landscape.get_affordability_index('flood_zone', flood >= FLOOD_ZONE_THRESHOLD)
+        reduced_budgets = budgets * (1.0 - budget_reduction_perc)
+        below_flood_zone_units = below_flood_zone.affordable_units(budgets)
+        totals = below_flood_zone_units + flood_zone.affordable_units(reduced_budgets)
+        candidates = np.full((len(budgets), bg_sample_size), -1, dtype=np.int64)
+        can_afford = totals > 0
+        targets = random_state.random((int(can_afford.sum()), bg_sample_size)) * totals[can_afford, None]
+        split = np.broadcast_to(below_flood_zone_units[can_afford, None], targets.shape)
+        in_flood_zone = targets >= split
+        draws = np.empty(targets.shape, dtype=np.int64)
+        draws[~in_flood_zone] = below_flood_zone.locate(targets[~in_flood_zone])
+        draws[in_flood_zone] = flood_zone.locate(targets[in_flood_zone] - split[in_flood_zone])
+        candidates[can_afford] = draws
+    else:
+        candidates = landscape.get_affordability_index('all').sample(budgets, bg_sample_size, random_state=random_state)
+    return candidates
+
+
+def batched_housing_search(landscape, households, house_choice_mode, simple_anova_coefficients, bg_sample_size=10, budget_reduction_perc=.10,
+                           random_state=np.random):
+    """Samples candidate block groups for all households in the list and calculates their utilities in a single batch.
+    Households that cannot afford any available homes are flagged as outmigrated (as in the per-household search).
+
+    **Args**:
+    landscape (ABMLandscape): the simulation network
+    households (list / HHAgent): households searching for a residence
+
+    **Returns**:
+    DataFrame with GEOID, hh and utility columns (bg_sample_size rows per household)
+    """
+    hh_rows = landscape.hh_table.rows_of(households)  # household attributes are gathered from the agent table columns
+    budgets = landscape.hh_table.column('house_budget')[hh_rows]
+    avoidance = landscape.hh_table.column('avoidance')[hh_rows]
+    candidates = sample_bg_candidates(landscape, budgets, avoidance, house_choice_mode, bg_sample_size=bg_sample_size,
+                                      budget_reduction_perc=budget_reduction_perc, random_state=random_state)
+
+    can_afford = candidates[:, 0] >= 0
+    no_hh_outmigrated = 0
+    landscape.log_moves([hh for hh, affordable in zip(households, can_afford) if not affordable], OUTMIGRATED, MOVE_OUTMIGRATED)
+    for hh, affordable in zip(households, can_afford):
+        if not affordable:
+            hh.location = 'outmigrated'  # JY: need to pull out of unassigned_hhs
+            no_hh_outmigrated += 1
+    if no_hh_outmigrated > 0:
+        logging.info(str(no_hh_outmigrated) + ' households cannot afford any available homes!')
+
+    hh_names = np.array([hh.name for hh in households], dtype=object)[can_afford]
+    bg_positions = candidates[can_afford].ravel()
+    utility = landscape.get_bg_utility(house_choice_mode, simple_anova_coefficients)  # utilities are gathered by block group row
+    return pd.DataFrame({'GEOID': landscape.get_bg_column('GEOID')[bg_positions],
+                         'hh': np.repeat(hh_names, bg_sample_size),
+                         'utility': utility[bg_positions]})
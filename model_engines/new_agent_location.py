@@ -1,6 +1,10 @@
 from pynsim import Engine
+from model_classes.landscape import CACHED_UTILITY_MODES
 from model_classes.urban_agents import HHAgent
-import random
+from model_engines.housing_search import batched_housing_search
+from model_classes.column_tables import OUTMIGRATED
+from model_classes.move_log import MOVE_OUTMIGRATED
+import numpy as np
 import logging
 
 class NewAgentLocation(Engine):
@@ -18,14 +22,19 @@ class NewAgentLocation(Engine):
 
     Attributes:
         sample_size (integer): a single value that indicates the sample size for new agent's housing search
+        search_mode (string): 'iterative' samples homes for one agent at a time; 'batched' samples homes for all agents
+            in the location queue in a single pass over the block group arrays (same sampling rules, much faster)
 
     """
-    def __init__(self, target, bg_sample_size=10, house_choice_mode='simple_anova_utility', simple_anova_coefficients=[], budget_reduction_perc=.10, **kwargs):
+    def __init__(self, target, bg_sample_size=10, house_choice_mode='simple_anova_utility', simple_anova_coefficients=[], budget_reduction_perc=.10,
+                 search_mode='iterative', **kwargs):
         super(NewAgentLocation, self).__init__(target, **kwargs)
         self.bg_sample_size = bg_sample_size
         self.house_choice_mode = house_choice_mode
         self.simple_anova_coefficients = simple_anova_coefficients
         self.budget_reduction_perc = budget_reduction_perc
+        self.search_mode = search_mode
+        self.rng = np.random.default_rng()  # replaced by a seeded stream when the engine is added to an ICOMSimulator
 
 
     def run(self):
@@ -36,6 +45,12 @@ class NewAgentLocation(Engine):
 
         logging.info("Running the new agent location engine, year " + str(self.target.current_timestep.year))
 
+        if self.search_mode == 'batched':
+            self.target.hh_utilities_df = batched_housing_search(self.target, list(self.target.unassigned_hhs.values()), self.house_choice_mode,
+                                                                 self.simple_anova_coefficients, bg_sample_size=self.bg_sample_size,
+                                                                 budget_reduction_perc=self.budget_reduction_perc, random_state=self.rng)
+            return
+
         # for hh in self.target.unassigned_hhs.values():
         #     bg_budget = self.target.housing_bg_df[(self.target.housing_bg_df.salesprice1993 <= hh.house_budget)]
         #     bg_sample = bg_budget.sample(n=10, replace=True, weights='available_units').GEOID.to_list() # Sample from available units
@@ -65,9 +80,10 @@ class NewAgentLocation(Engine):
                 bg_budget = bg_all[(bg_all.new_price <= hh.house_budget)]  # JY revise to pin to dynamic prices
             if first:
                 try:
-                    bg_sample = bg_budget.sample(n=10, replace=True, weights='available_units')  # Sample from available units (JY revisit this weighting)
+                    bg_sample = bg_budget.sample(n=10, replace=True, weights='available_units', random_state=self.rng)  # Sample from available units (JY revisit this weighting)
                 except ValueError:
                     logging.info(hh.name + ' cannot afford any available homes!')  # JY: need to pull out of unassigned_hhs
+                    self.target.log_moves([hh], OUTMIGRATED, MOVE_OUTMIGRATED)
                     hh.location = 'outmigrated'
                     continue
                 bg_sample['hh'] = hh.name
@@ -76,9 +92,10 @@ class NewAgentLocation(Engine):
                 bg_sample['c'] = 0.2
             else:
                 try:
-                    bg_append = bg_budget.sample(n=10, replace=True, weights='available_units')  # Sample from available units
+                    bg_append = bg_budget.sample(n=10, replace=True, weights='available_units', random_state=self.rng)  # Sample from available units
                 except ValueError:
                     logging.info(hh.name + ' cannot afford any available homes!')  # JY: need to pull out of unassigned_hhs
+                    self.target.log_moves([hh], OUTMIGRATED, MOVE_OUTMIGRATED)
                     hh.location = 'outmigrated'
                     continue
                 bg_append['hh'] = hh.name
@@ -97,15 +114,8 @@ class NewAgentLocation(Engine):
 
             bg_sample['utility'] = bg_sample.apply(cobb_douglas_utility, axis=1)
 
-        elif self.house_choice_mode == 'simple_flood_utility':  # JY consider moving to method on household agents
-            bg_sample['utility'] = (self.simple_anova_coefficients[0]) + (self.simple_anova_coefficients[1] * self.target.housing_bg_df['N_MeanSqfeet']) + (self.simple_anova_coefficients[2] * self.target.housing_bg_df['N_MeanAge']) \
-                                                                + (self.simple_anova_coefficients[3] * self.target.housing_bg_df['N_MeanNoOfStories']) + (self.simple_anova_coefficients[4] * self.target.housing_bg_df['N_MeanFullBathNumber'])\
-                                                                + (self.simple_anova_coefficients[5] * self.target.housing_bg_df['N_perc_area_flood']) + (1 * self.target.housing_bg_df['residuals'])  # JY temp change N_perc_area_flood to perc_fld_area
-
-        elif self.house_choice_mode == 'simple_avoidance_utility' or self.house_choice_mode == 'budget_reduction':  # JY consider moving to method on household agents
-            bg_sample['utility'] = (self.simple_anova_coefficients[0]) + (self.simple_anova_coefficients[1] * self.target.housing_bg_df['N_MeanSqfeet']) + (self.simple_anova_coefficients[2] * self.target.housing_bg_df['N_MeanAge']) \
-                                                                + (self.simple_anova_coefficients[3] * self.target.housing_bg_df['N_MeanNoOfStories']) + (self.simple_anova_coefficients[4] * self.target.housing_bg_df['N_MeanFullBathNumber'])\
-                                                                + (1 * self.target.housing_bg_df['residuals'])
+        elif self.house_choice_mode in CACHED_UTILITY_MODES:  # JY consider moving to method on household agents
+            bg_sample['utility'] = self.target.get_bg_utility(self.house_choice_mode, self.simple_anova_coefficients)[bg_sample.index.values]  # gather cached utility by block group row
 
         self.target.hh_utilities_df = bg_sample[['GEOID', 'hh', 'utility']]
 
@@ -123,23 +133,25 @@ class NewAgentLocation(Engine):
         # assign new population to block groups (currently assumes agents move to a random block group)
         new_population = self.target.total_population * self.pop_growth
         no_of_new_agents = (new_population + self.no_hhs_per_agent // 2) // self.no_hhs_per_agent  # division with rounding to nearest integer
+        avoidance = self.rng.random(int(no_of_new_agents)) <= .10  # flood avoidance flags (HHAgent default simple_avoidance_perc)
         count = 1
         for a in range(int(no_of_new_agents)):
-            bg = random.choice(bg_dev_allowed)
+            bg = bg_dev_allowed[self.rng.integers(len(bg_dev_allowed))]
             name = 'hh_agent_' + str(self.timestep.year) + '_' + str(count)
             self.target.add_component(HHAgent(name=name, location=bg.name, no_hhs_per_agent=self.no_hhs_per_agent,
-                                               hh_size=self.hh_size, year_of_residence=self.timestep.year))  # add household agent to pynsim network
-            bg.hh_agents[self.target.components[-1].name] = self.target.components[-1]  # add pynsim household agent to associated block group node
+                                               hh_size=self.hh_size, year_of_residence=self.timestep.year, avoidance=avoidance[a],
+                                               table=self.target.hh_table))  # add household agent to pynsim network
+            self.target.place_agents([self.target.components[-1]], [self.target.bg_index[bg.name]])  # add pynsim household agent to associated block group node
             self.target.get_institution('all_hh_agents').add_component(self.target.components[-1])  # add pynsim household agent to all hh agents institution
             count += 1
 
         # make agent relocation decisions (currently assumes that 10% of randomly selected agents move to a random block group)
         no_agents_moving = int(len(self.target.get_institution('all_hh_agents').components) * .10)
-        agent_move_list = random.sample(self.target.get_institution('all_hh_agents').components, no_agents_moving)
+        all_hh_agents = self.target.get_institution('all_hh_agents').components
+        agent_move_list = [all_hh_agents[i] for i in self.rng.choice(len(all_hh_agents), no_agents_moving, replace=False)]
         for a in agent_move_list:
-            bg_old_location = self.target.get_node(a.location)
-            bg_new_location = random.choice(bg_dev_allowed)
-            del bg_old_location.hh_agents[a.name]
-            bg_new_location.hh_agents[a.name] = a
+            bg_new_location = bg_dev_allowed[self.rng.integers(len(bg_dev_allowed))]
+            self.target.vacate_agents([a])
+            self.target.place_agents([a], [self.target.bg_index[bg_new_location.name]])
             a.location = bg_new_location.name
 
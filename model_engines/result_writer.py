@@ -0,0 +1,102 @@
+from pynsim import Engine
+import os
+import glob
+import shutil
+import importlib.util
+import logging
+import pandas as pd
+
+# parquet and feather output require pyarrow (optional, results are written as csv files without it); pyarrow is
+# imported by pandas when a file is written, not when this module is imported
+COLUMNAR_FORMATS = ['parquet', 'feather'] if importlib.util.find_spec('pyarrow') is not None else []
+
+RESULT_COLUMNS = ['GEOID', 'GISJOIN', 'new_price', 'population', 'occupied_units', 'available_units', 'demand_exceeds_supply',
+                  'perc_fld_area', 'mhi1990', 'salesprice1993', 'pop1990', 'average_income']  # block group columns written by default
+
+
+class ResultWriter(Engine):
+    """An engine class that writes the selected block group columns of each year to disk as soon as the year is
+    simulated (rather than concatenating the housing_bg_df history after the run).
+
+    Each year is written to its own file in a partitioned directory, {output_dir}/run={run_name}/model_year={model_year}/,
+    so memory use does not grow with the number of years and the years already written survive a job that is killed.
+    Files are written to a temporary name and then renamed, so a partition is never left half-written. The run's
+    directory is cleared when the writer is created, so a rerun with the same run name never mixes in years (or files of
+    another format) from an earlier run. Use read_results to combine the partitions of a run.
+
+    **Target**:
+        s.network
+
+    **Args**:
+        output_dir (str): root directory of the partitioned results
+        run_name (str): name of the model run (partition key)
+        columns (list / str): block group columns to write (static or dynamic)
+        output_format (str): 'parquet' or 'feather' (require pyarrow) or 'csv' (parquet and feather fall back to csv
+            if pyarrow is not installed)
+
+    **Inter-module Outputs/Modifications**:
+        None (writes a file per year)
+    """
+    def __init__(self, target, output_dir='results', run_name='run', columns=RESULT_COLUMNS, output_format='parquet', **kwargs):
+        super(ResultWriter, self).__init__(target, **kwargs)
+        self.output_dir = output_dir
+        self.run_name = str(run_name)
+        self.columns = columns
+        if output_format != 'csv' and output_format not in COLUMNAR_FORMATS:
+            logging.info('pyarrow is not installed, ' + output_format + ' results will be written as csv files')
+            output_format = 'csv'
+        self.output_format = output_format
+
+        run_dir = os.path.join(self.output_dir, 'run=' + self.run_name)
+        if os.path.isdir(run_dir):
+            logging.info('Removing the results of an earlier run in ' + run_dir)
+            shutil.rmtree(run_dir)
+
+    def run(self):
+        """ Run the ResultWriter Engine. Should be the last engine, so that the end-of-year state is written (the same
+            state that is recorded in the housing_bg_df history).
+        """
+        model_year = self.target.current_timestep_idx + 1  # model years are numbered from 1
+        logging.info("Running the result writer engine, year " + str(self.target.current_timestep.year))
+
+        df = pd.DataFrame({column: self.target.get_bg_column(column) for column in self.columns})  # block group row index
+
+        partition_dir = os.path.join(self.output_dir, 'run=' + self.run_name, 'model_year=' + str(model_year))
+        os.makedirs(partition_dir, exist_ok=True)
+        filename = os.path.join(partition_dir, 'part-0.' + self.output_format)
+        temp_filename = filename + '.tmp'
+        if self.output_format == 'parquet':
+            df.to_parquet(temp_filename, index=False)
+        elif self.output_format == 'feather':
+            df.to_feather(temp_filename)
+        else:
+            df.to_csv(temp_filename, index=False)
+        os.replace(temp_filename, filename)  # atomic rename, readers never see a partial file
+
+
+def read_results(output_dir, run_name):
+    """Reads all years written by the ResultWriter for a run into a single dataframe (with a model_year column), in
+    model year order
+
+    **Args**:
+    output_dir (str): root directory of the partitioned results
+    run_name (str): name of the model run
+    """
+    frames = []
+    for partition_dir in glob.glob(os.path.join(output_dir, 'run=' + str(run_name), 'model_year=*')):
+        model_year = int(os.path.basename(partition_dir).split('=')[1])
+        for filename in glob.glob(os.path.join(partition_dir, 'part-*')):
+            if filename.endswith('.tmp'):
+                continue  # incomplete write of a killed job
+            if filename.endswith('.parquet'):
+                df = pd.read_parquet(filename)
+            elif filename.endswith('.feather'):
+                df = pd.read_feather(filename)
+            else:
+                df = pd.read_csv(filename, dtype={'GEOID': str, 'GISJOIN': str})
+            df['model_year'] = model_year
+            frames.append(df)
+    if not frames:
+        return pd.DataFrame()
+    frames.sort(key=lambda df: df['model_year'].iat[0])
+    return pd.concat(frames)  # a single concatenation of all years